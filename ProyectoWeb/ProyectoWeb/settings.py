@@ -103,6 +103,27 @@ DATABASES = {
 }
 
 
+# Caché
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# En memoria local por defecto, que solo sirve con un único proceso. Con
+# varios workers (o con procesar_exportaciones) hace falta un backend
+# compartido (Redis o Memcached): las versiones de las exportaciones y la
+# invalidación de los KPIs viven en la caché y cada proceso debe ver los
+# cambios de los demás (ver reportes.cache_exportaciones).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Caducidad de lo que se cachea y se invalida con señales (KPIs del
+# dashboard, periodos del balance, ficheros de exportación). Es solo un
+# límite de seguridad para los cambios que no pasan por las señales
+# (update(), bulk_create(), SQL directo...).
+CACHE_DURACION_SEGURIDAD = 60 * 60 * 24
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -145,6 +166,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Días que se guardan los ficheros de las exportaciones en segundo plano (reportes)
+EXPORTACIONES_RETENCION_DIAS = 7
+# Segundos sin señales de vida tras los que una exportación en proceso se da por
+# abandonada y vuelve a la cola (el cierre anual da una por hoja terminada)
+EXPORTACIONES_TIEMPO_MAXIMO_SEGUNDOS = 3600
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
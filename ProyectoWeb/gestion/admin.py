@@ -1,14 +1,15 @@
 from django import forms
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.html import format_html
 from django.shortcuts import redirect
-from django.template.loader import render_to_string
-from django.core.files.base import ContentFile
 from django.utils.safestring import mark_safe
-import io
-from xhtml2pdf import pisa
 
-from .models import Alumno, Profesor, Padres, Horario, MatriculaHorario, Sesion, Asistencia, Pago, Tarifa, Gasto
+from .comprobantes import solicitar_comprobantes
+from .facturacion import facturar_mes
+from .models import Alumno, Profesor, Padres, Horario, MatriculaHorario, Sesion, Asistencia, Pago, Tarifa, Gasto, ResumenAsistenciaMensual, ContadorPago
+from .conciliacion import conciliar_asistencias
 
 
 class PagoAdminForm(forms.ModelForm):
@@ -70,6 +71,15 @@ class AlumnoAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('fecha_alta',)
     inlines = [MatriculaHorarioInline]
+    actions = ['facturar_mes_en_curso']
+
+    def facturar_mes_en_curso(self, request, queryset):
+        pagos = facturar_mes(timezone.localdate(), queryset.values_list('id', flat=True))
+        if pagos:
+            self.message_user(request, f'{len(pagos)} pagos creados ({pagos[0].numero} a {pagos[-1].numero}).')
+        else:
+            self.message_user(request, 'Ningún alumno seleccionado estaba pendiente de facturar este mes.', messages.WARNING)
+    facturar_mes_en_curso.short_description = 'Facturar el mes en curso con la tarifa predeterminada (solo pendientes)'
     
     def response_change(self, request, obj):
         """Redirigir después de editar"""
@@ -154,6 +164,7 @@ class SesionAdmin(admin.ModelAdmin):
     list_filter = ('horario__profesor',)
     date_hierarchy = 'inicio'
     search_fields = ('horario__asignatura', 'horario__profesor__user__first_name', 'horario__profesor__user__last_name')
+    readonly_fields = ('resumen_asistencias',)
     inlines = [AsistenciaInline]
     
     def get_form(self, request, obj=None, **kwargs):
@@ -209,6 +220,14 @@ class SesionAdmin(admin.ModelAdmin):
             if asistencias_a_crear:
                 Asistencia.objects.bulk_create(asistencias_a_crear, ignore_conflicts=True)
 
+    def resumen_asistencias(self, obj):
+        if not obj.pk:
+            return '-'
+        conciliacion = conciliar_asistencias(obj)
+        return (f"{len(conciliacion['presentes'])} presentes, {len(conciliacion['faltas'])} faltas, "
+                f"{len(conciliacion['sin_registro'])} sin registro, {len(conciliacion['otros'])} no matriculados")
+    resumen_asistencias.short_description = 'Resumen de asistencia'
+
 
 @admin.register(Asistencia)
 class AsistenciaAdmin(admin.ModelAdmin):
@@ -218,14 +237,29 @@ class AsistenciaAdmin(admin.ModelAdmin):
     autocomplete_fields = ['sesion', 'alumno']
 
 
+@admin.register(ResumenAsistenciaMensual)
+class ResumenAsistenciaMensualAdmin(admin.ModelAdmin):
+    list_display = ('alumno', 'horario', 'anio', 'mes', 'presentes', 'faltas', 'sesiones', 'fecha_actualizacion')
+    list_filter = ('anio', 'mes', 'horario__profesor')
+    search_fields = ('alumno__nombre', 'alumno__apellido', 'horario__asignatura')
+    list_select_related = ('alumno', 'horario__profesor__user')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 
 @admin.register(Pago)
 class PagoAdmin(admin.ModelAdmin):
     form = PagoAdminForm
     list_display = ('numero', 'alumno', 'tarifa', 'importe_original', 'descuento', 'importe_final', 'fecha', 'comprobante_link')
-    list_filter = ('fecha', 'tarifa', 'profesor')
+    list_filter = ('fecha', 'tarifa', 'profesor', 'estado_comprobante')
     search_fields = ('numero', 'alumno__nombre', 'alumno__apellido', 'concepto')
-    readonly_fields = ('comprobante', 'fecha')
+    readonly_fields = ('comprobante', 'estado_comprobante', 'error_comprobante', 'fecha')
+    actions = ['reintentar_comprobantes']
     autocomplete_fields = ['alumno', 'profesor']
     fieldsets = (
         ('Información General', {
@@ -235,7 +269,7 @@ class PagoAdmin(admin.ModelAdmin):
             'fields': ('tarifa', 'importe_original', 'descuento', 'importe_final')
         }),
         ('Documentación', {
-            'fields': ('comprobante', 'generar_comprobante')
+            'fields': ('comprobante', 'estado_comprobante', 'error_comprobante', 'generar_comprobante')
         }),
     )
     
@@ -262,12 +296,11 @@ class PagoAdmin(admin.ModelAdmin):
                 'onchange': 'prefillTarifa(this.value)'
             })
         
-        # Pre-llenar numero con el siguiente correlativo si es nuevo
+        # El número se reserva al guardar (ContadorPago); aquí solo se avisa
         if obj is None and 'numero' in form.base_fields:
-            try:
-                form.base_fields['numero'].initial = Pago.generar_siguiente_numero()
-            except Exception:
-                pass
+            form.base_fields['numero'].widget.attrs.update({
+                'placeholder': 'Se asigna automáticamente al guardar'
+            })
         
         return form
     
@@ -287,30 +320,50 @@ class PagoAdmin(admin.ModelAdmin):
         # Obtener el valor del checkbox antes de guardar
         generar_comprobante = form.cleaned_data.get('generar_comprobante', False)
         
-        # Autogenerar numero si viene vacío por cualquier motivo
-        if not getattr(obj, 'numero', None):
-            try:
-                obj.numero = Pago.generar_siguiente_numero()
-            except Exception:
-                pass
-        
-        # Guardar el modelo primero
+        # Guardar el modelo primero (Pago.save asigna el número si viene vacío)
         super().save_model(request, obj, form, change)
         
-        # Generar comprobante solo si está marcado el checkbox
-        if generar_comprobante and not obj.comprobante:
-            html = render_to_string('gestion/pagos/comprobante.html', {'pago': obj})
-            pdf_io = io.BytesIO()
-            pisa.CreatePDF(io.BytesIO(html.encode('utf-8')), dest=pdf_io, encoding='utf-8')
-            obj.comprobante.save(f'comprobante_{obj.numero}.pdf', ContentFile(pdf_io.getvalue()), save=True)
+        # Generar comprobante solo si está marcado el checkbox (lo genera en segundo plano generar_comprobantes)
+        if generar_comprobante and not obj.comprobante and obj.estado_comprobante not in ('pendiente', 'generando'):
+            solicitar_comprobantes([obj.pk])
 
     def comprobante_link(self, obj):
-        if obj.comprobante:
+        if obj.comprobante and obj.estado_comprobante in ('', 'listo'):
             return format_html('<a href="{}" target="_blank" class="btn btn-sm btn-primary">📄 Descargar PDF</a>', obj.comprobante.url)
+        if obj.estado_comprobante == 'error':
+            return format_html('<span class="badge bg-danger" title="{}">❌ Error</span>', obj.error_comprobante)
+        if obj.estado_comprobante:
+            return format_html('<span class="badge bg-secondary">⏳ {}</span>', obj.get_estado_comprobante_display())
         return '-'
     comprobante_link.allow_tags = True
     comprobante_link.short_description = 'Comprobante'
 
+    def reintentar_comprobantes(self, request, queryset):
+        # Los que ya tienen PDF (también los anteriores a la cola, con estado vacío) no se tocan
+        sin_pdf = Q(comprobante__isnull=True) | Q(comprobante='')
+        pagos = queryset.filter(Q(estado_comprobante='error') | (sin_pdf & ~Q(estado_comprobante__in=['pendiente', 'generando'])))
+        ids = list(pagos.values_list('id', flat=True))
+        solicitar_comprobantes(ids)
+        self.message_user(request, f'{len(ids)} comprobantes en cola. Los generará en segundo plano el comando generar_comprobantes.')
+    reintentar_comprobantes.short_description = 'Generar de nuevo los comprobantes con error o sin PDF'
+
+
+@admin.register(ContadorPago)
+class ContadorPagoAdmin(admin.ModelAdmin):
+    """Solo consulta: los contadores los mueve Pago.save. Bajar ``ultimo`` a
+    mano haría que se repitieran números ya asignados."""
+    list_display = ('anio', 'ultimo')
+    readonly_fields = ('anio', 'ultimo')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 
 @admin.register(Gasto)
 class GastoAdmin(admin.ModelAdmin):
@@ -0,0 +1,123 @@
+"""Generación en segundo plano de los comprobantes PDF de los pagos.
+
+El estado del comprobante vive en el propio ``Pago`` y hace de cola: al
+pedir un comprobante el pago solo queda ``pendiente``, así que guardar un
+pago en el admin no espera a xhtml2pdf ni lo ejecuta en el proceso web. El
+comando ``generar_comprobantes`` vacía la cola con un pool de procesos:
+toma los pendientes con :func:`tomar_pendientes`, los genera con
+:func:`generar_lote` y guarda el resultado con :func:`guardar_resultados`.
+
+Cada pago tomado queda ``generando`` con la hora de inicio; si el proceso
+muere a medias, :func:`reclamar_caducados` lo devuelve a la cola pasado
+``COMPROBANTES_TIEMPO_MAXIMO_SEGUNDOS``. ``regenerar_comprobantes`` usa las
+mismas piezas para regenerar muchos comprobantes de golpe.
+"""
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import Pago
+from .renderizador import renderizar_comprobante
+
+# Tras este tiempo en 'generando' se da por muerto el proceso que lo tomó
+TIEMPO_MAXIMO = timedelta(seconds=getattr(settings, 'COMPROBANTES_TIEMPO_MAXIMO_SEGUNDOS', 600))
+
+
+def nombre_comprobante(numero):
+    """Ruta del comprobante del pago ``numero`` dentro del almacenamiento"""
+    return f'comprobantes/{get_valid_filename(f"comprobante_{numero}.pdf")}'
+
+
+def guardar_comprobante(nombre, pdf):
+    """Escribe el PDF de forma atómica y devuelve ``nombre``.
+
+    Se escribe un temporal en la misma carpeta y se renombra sobre el
+    definitivo, así que nunca queda a la vista un PDF a medio escribir.
+    """
+    ruta = Pago._meta.get_field('comprobante').storage.path(nombre)
+    carpeta = os.path.dirname(ruta)
+    os.makedirs(carpeta, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=carpeta, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as fichero:
+            fichero.write(pdf)
+        if settings.FILE_UPLOAD_PERMISSIONS is not None:
+            os.chmod(temporal, settings.FILE_UPLOAD_PERMISSIONS)
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.unlink(temporal)
+        raise
+    return nombre
+
+
+def solicitar_comprobantes(pago_ids):
+    """Deja los pagos pendientes para que los genere ``generar_comprobantes``"""
+    Pago.objects.filter(pk__in=list(pago_ids)).update(estado_comprobante='pendiente', error_comprobante='')
+
+
+def reclamar_caducados(ahora=None):
+    """Devuelve a pendientes los comprobantes que llevan demasiado tiempo generándose.
+
+    Son los de un proceso que murió a medias; devuelve cuántos había.
+    """
+    limite = (ahora or timezone.now()) - TIEMPO_MAXIMO
+    return (Pago.objects
+            .filter(estado_comprobante='generando')
+            .filter(Q(inicio_comprobante__lt=limite) | Q(inicio_comprobante__isnull=True))
+            .update(estado_comprobante='pendiente'))
+
+
+def tomar_pendientes(cantidad):
+    """Marca como generando hasta ``cantidad`` pagos pendientes y devuelve sus ids.
+
+    ``skip_locked`` permite varios procesos trabajando sobre la misma cola
+    sin que dos tomen el mismo pago.
+    """
+    with transaction.atomic():
+        ids = list(Pago.objects
+                   .select_for_update(skip_locked=True)
+                   .filter(estado_comprobante='pendiente')
+                   .order_by('id')
+                   .values_list('id', flat=True)[:cantidad])
+        Pago.objects.filter(pk__in=ids).update(estado_comprobante='generando', inicio_comprobante=timezone.now())
+    return ids
+
+
+def guardar_resultados(resultados):
+    """Guarda en los pagos los resultados de :func:`generar_lote`.
+
+    Devuelve ``(correctos, fallidos)`` como pagos sin guardar con los campos
+    actualizados. ``bulk_update`` no dispara las señales del pago ni cambia su
+    ``fecha_actualizacion``: el comprobante no cambia los datos del pago.
+    """
+    correctos = [Pago(pk=pago_id, comprobante=nombre, estado_comprobante='listo', error_comprobante='')
+                 for pago_id, nombre, error in resultados if not error]
+    fallidos = [Pago(pk=pago_id, estado_comprobante='error', error_comprobante=error)
+                for pago_id, nombre, error in resultados if error]
+    Pago.objects.bulk_update(correctos, ['comprobante', 'estado_comprobante', 'error_comprobante'])
+    Pago.objects.bulk_update(fallidos, ['estado_comprobante', 'error_comprobante'])
+    return correctos, fallidos
+
+
+def generar_lote(pago_ids):
+    """Genera los comprobantes de ``pago_ids`` en un proceso del pool.
+
+    Los pagos se leen con una sola consulta. Devuelve ``(pago_id, nombre,
+    error)`` por pago; actualizar los pagos queda para el proceso principal.
+    """
+    resultados = []
+    for pago in Pago.objects.select_related('alumno', 'profesor__user').filter(pk__in=pago_ids):
+        try:
+            nombre = guardar_comprobante(nombre_comprobante(pago.numero), renderizar_comprobante(pago))
+        except Exception as e:
+            resultados.append((pago.pk, None, str(e)[:1000]))
+        else:
+            resultados.append((pago.pk, nombre, ''))
+    return resultados
@@ -0,0 +1,46 @@
+"""Conciliación entre la lista de matriculados de un horario y las asistencias de una sesión."""
+from django.db.models import Exists, OuterRef
+
+from .models import Asistencia, MatriculaHorario
+
+
+def conciliar_asistencias(sesion):
+    """Clasifica las asistencias de ``sesion`` frente a las matrículas activas de su horario.
+
+    Devuelve un diccionario con las asistencias ``presentes`` y ``faltas`` de
+    alumnos matriculados, las de alumnos no matriculados (``otros``) y los
+    alumnos matriculados ``sin_registro``. Siempre hace dos consultas.
+    """
+    matriculas_activas = MatriculaHorario.objects.filter(horario_id=sesion.horario_id, estado='activa')
+
+    asistencias = (sesion.asistencias
+                   .select_related('alumno')
+                   .annotate(matriculado=Exists(matriculas_activas.filter(alumno=OuterRef('alumno'))))
+                   .order_by('id'))
+
+    presentes = []
+    faltas = []
+    otros = []
+    for asistencia in asistencias:
+        if not asistencia.matriculado:
+            otros.append(asistencia)
+        elif asistencia.presente:
+            presentes.append(asistencia)
+        else:
+            faltas.append(asistencia)
+
+    sin_registro = [
+        matricula.alumno
+        for matricula in (matriculas_activas
+                          .exclude(Exists(Asistencia.objects.filter(sesion=sesion, alumno=OuterRef('alumno'))))
+                          .select_related('alumno')
+                          .order_by('id'))
+    ]
+
+    return {
+        'presentes': presentes,
+        'faltas': faltas,
+        'otros': otros,
+        'sin_registro': sin_registro,
+        'total_matriculados': len(presentes) + len(faltas) + len(sin_registro),
+    }
@@ -0,0 +1,209 @@
+"""Estadísticas agregadas para las vistas de gestión.
+
+Las funciones de este módulo calculan las cifras de los listados con
+anotaciones y subconsultas, de forma que el número de consultas no
+depende del número de filas. La asistencia mensual se lee de
+``ResumenAsistenciaMensual`` en lugar del histórico de asistencias.
+"""
+from django.db.models import Count, DecimalField, Exists, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import MatriculaHorario, Pago, ResumenAsistenciaMensual, Sesion
+
+
+def subconsulta_agregada(qs, campo, agregado, output_field=None):
+    """Subconsulta escalar con ``agregado`` sobre ``qs`` agrupado por ``campo``.
+
+    ``qs`` debe estar filtrado por un ``OuterRef`` sobre ``campo``. Devuelve 0
+    cuando la subconsulta no tiene filas.
+    """
+    output_field = output_field or IntegerField()
+    subconsulta = qs.order_by().values(campo).annotate(_valor=agregado).values('_valor')
+    return Coalesce(Subquery(subconsulta, output_field=output_field), Value(0), output_field=output_field)
+
+
+def resumen_alumnos(alumnos_qs):
+    """Totales de la cabecera del listado de alumnos en una sola consulta"""
+    return alumnos_qs.aggregate(
+        total=Count('id'),
+        activos=Count('id', filter=Q(activo=True)),
+        compartidos=Count('id', filter=Q(activo=True, es_compartido=True)),
+    )
+
+
+def anotar_estadisticas_alumnos(alumnos_qs, now):
+    """Anota sobre ``alumnos_qs`` las estadísticas del mes de ``now``"""
+    resumenes_mes = ResumenAsistenciaMensual.objects.filter(
+        alumno=OuterRef('pk'),
+        anio=now.year,
+        mes=now.month,
+    )
+    pagos_mes = Pago.objects.filter(
+        alumno=OuterRef('pk'),
+        fecha__month=now.month,
+        fecha__year=now.year,
+    )
+    return alumnos_qs.select_related('ultimo_pago').annotate(
+        horarios_matriculados=subconsulta_agregada(
+            MatriculaHorario.objects.filter(alumno=OuterRef('pk'), estado='activa'),
+            'alumno', Count('id'),
+        ),
+        asistencias_este_mes=subconsulta_agregada(resumenes_mes, 'alumno', Sum('presentes')),
+        total_sesiones_mes=subconsulta_agregada(resumenes_mes, 'alumno', Sum(F('presentes') + F('faltas'))),
+        pagos_este_mes=subconsulta_agregada(
+            pagos_mes, 'alumno', Sum('importe_final'),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+    )
+
+
+def estadisticas_alumnos(alumnos, now):
+    """Lista de diccionarios por alumno para la plantilla de alumnos.
+
+    ``alumnos`` es un queryset o una lista ya evaluada de alumnos anotados
+    con :func:`anotar_estadisticas_alumnos`. El último pago viene en la misma
+    consulta y las próximas sesiones se cargan con una sola consulta más.
+    """
+    alumnos = list(alumnos)
+    sesiones = {
+        sesion.alumno_matriculado_id: sesion
+        for sesion in Sesion.objects.select_related('horario').proximas_por_alumno(now, alumnos)
+    }
+
+    alumnos_con_stats = []
+    for alumno in alumnos:
+        porcentaje_asistencia = 0
+        if alumno.total_sesiones_mes > 0:
+            porcentaje_asistencia = round((alumno.asistencias_este_mes / alumno.total_sesiones_mes) * 100, 1)
+
+        alumnos_con_stats.append({
+            'alumno': alumno,
+            'horarios_matriculados': alumno.horarios_matriculados,
+            'asistencias_este_mes': alumno.asistencias_este_mes,
+            'no_asistencias_este_mes': alumno.total_sesiones_mes - alumno.asistencias_este_mes,
+            'total_sesiones_mes': alumno.total_sesiones_mes,
+            'porcentaje_asistencia': porcentaje_asistencia,
+            'pagos_este_mes': alumno.pagos_este_mes,
+            'ultimo_pago': alumno.ultimo_pago,
+            'proxima_sesion': sesiones.get(alumno.id),
+        })
+    return alumnos_con_stats
+
+
+def resumen_horarios(horarios_qs):
+    """Totales de la cabecera del listado de horarios en una sola consulta"""
+    return horarios_qs.aggregate(
+        total=Count('id'),
+        activos=Count('id', filter=Q(activo=True)),
+    )
+
+
+def anotar_estadisticas_horarios(horarios_qs, now):
+    """Anota sobre ``horarios_qs`` las estadísticas del mes de ``now``"""
+    return horarios_qs.select_related('profesor__user').annotate(
+        alumnos_matriculados=subconsulta_agregada(
+            MatriculaHorario.objects.filter(horario=OuterRef('pk'), estado='activa'),
+            'horario', Count('id'),
+        ),
+        sesiones_este_mes=subconsulta_agregada(
+            Sesion.objects.filter(horario=OuterRef('pk'), inicio__month=now.month, inicio__year=now.year),
+            'horario', Count('id'),
+        ),
+        asistencias_este_mes=subconsulta_agregada(
+            ResumenAsistenciaMensual.objects.filter(horario=OuterRef('pk'), anio=now.year, mes=now.month),
+            'horario', Sum('presentes'),
+        ),
+    )
+
+
+def estadisticas_horarios(horarios, now):
+    """Lista de diccionarios por horario para la plantilla de horarios.
+
+    ``horarios`` viene anotado con :func:`anotar_estadisticas_horarios`; las
+    sesiones próxima y última se cargan juntas en una sola consulta.
+    """
+    horarios = list(horarios)
+    proximas = {}
+    ultimas = {}
+    for sesion in Sesion.objects.filter(horario__in=horarios).contiguas(now):
+        (proximas if sesion.es_proxima else ultimas)[sesion.horario_id] = sesion
+
+    horarios_con_stats = []
+    for horario in horarios:
+        # Ocupación del aula (porcentaje de capacidad)
+        ocupacion = 0
+        if horario.capacidad > 0:
+            ocupacion = round((horario.alumnos_matriculados / horario.capacidad) * 100, 1)
+
+        horarios_con_stats.append({
+            'horario': horario,
+            'alumnos_matriculados': horario.alumnos_matriculados,
+            'sesiones_este_mes': horario.sesiones_este_mes,
+            'asistencias_este_mes': horario.asistencias_este_mes,
+            'proxima_sesion': proximas.get(horario.id),
+            'ultima_sesion': ultimas.get(horario.id),
+            'ocupacion': ocupacion,
+        })
+    return horarios_con_stats
+
+
+def resumen_sesiones(sesiones_qs, now):
+    """Totales de la cabecera del listado de sesiones en una sola consulta"""
+    return sesiones_qs.aggregate(
+        total=Count('id'),
+        pasadas=Count('id', filter=Q(inicio__lt=now)),
+        futuras=Count('id', filter=Q(inicio__gte=now)),
+        hoy=Count('id', filter=Q(inicio__date=now.date())),
+    )
+
+
+def anotar_estadisticas_sesiones(sesiones_qs):
+    """Anota sobre ``sesiones_qs`` la asistencia de los alumnos matriculados.
+
+    Las asistencias se agrupan por sesión en la misma consulta y solo cuentan
+    las de alumnos con matrícula activa en el horario; la comprobación se hace
+    con ``EXISTS``, así que un alumno nunca se cuenta dos veces.
+    """
+    matricula_activa = Q(Exists(MatriculaHorario.objects.filter(
+        alumno=OuterRef('asistencias__alumno'),
+        horario=OuterRef('horario'),
+        estado='activa',
+    )))
+
+    return sesiones_qs.select_related('horario__profesor__user').annotate(
+        alumnos_matriculados=subconsulta_agregada(
+            MatriculaHorario.objects.filter(horario=OuterRef('horario'), estado='activa'),
+            'horario', Count('id'),
+        ),
+        total_asistencias=Count('asistencias', filter=matricula_activa),
+        asistencias_presentes=Count('asistencias', filter=matricula_activa & Q(asistencias__presente=True)),
+    )
+
+
+def estadisticas_sesiones(sesiones, now):
+    """Lista de diccionarios por sesión para la plantilla de sesiones"""
+    sesiones_con_stats = []
+    for sesion in sesiones:
+        # Porcentaje de asistencia
+        porcentaje_asistencia = 0
+        if sesion.total_asistencias > 0:
+            porcentaje_asistencia = round((sesion.asistencias_presentes / sesion.total_asistencias) * 100, 1)
+
+        # Estado de la sesión
+        if sesion.inicio < now:
+            estado_sesion = 'pasada'
+        elif sesion.inicio.date() == now.date():
+            estado_sesion = 'hoy'
+        else:
+            estado_sesion = 'futura'
+
+        sesiones_con_stats.append({
+            'sesion': sesion,
+            'alumnos_matriculados': sesion.alumnos_matriculados,
+            'total_asistencias': sesion.total_asistencias,
+            'asistencias_presentes': sesion.asistencias_presentes,
+            'asistencias_faltas': sesion.total_asistencias - sesion.asistencias_presentes,
+            'porcentaje_asistencia': porcentaje_asistencia,
+            'estado_sesion': estado_sesion,
+        })
+    return sesiones_con_stats
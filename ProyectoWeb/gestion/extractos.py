@@ -0,0 +1,129 @@
+"""Extractos mensuales por familia: un PDF con los pagos del mes de todos los hijos.
+
+Las familias, sus hijos y los pagos del mes se leen con tres consultas
+(``prefetch_related`` de ``hijos`` y de ``pago_set`` filtrado al mes) y el
+HTML de cada extracto se compone en el proceso principal. Lo que cuesta es
+xhtml2pdf, así que la conversión a PDF se reparte entre procesos que solo
+reciben el HTML y no tocan la base de datos.
+"""
+import os
+import zipfile
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import Prefetch
+from django.template.loader import get_template
+from django.utils.text import get_valid_filename
+
+from .models import Alumno, Padres, Pago
+from .procesos import crear_pool
+from .renderizador import calentar, pdf_desde_html
+
+PLANTILLA = 'gestion/pagos/extracto.html'
+
+
+def rango_mes(anio, mes):
+    """``(primer día, primer día del mes siguiente)``"""
+    inicio = date(anio, mes, 1)
+    return inicio, date(anio + mes // 12, mes % 12 + 1, 1)
+
+
+def familias_del_mes(anio, mes, padre_ids=None):
+    """Familias con algún pago de sus hijos en el mes, con hijos y pagos precargados.
+
+    Cada hijo lleva en ``pagos_mes`` sus pagos del mes; los hijos sin pagos
+    quedan fuera de ``hijos_con_pagos``.
+    """
+    inicio, fin = rango_mes(anio, mes)
+    pagos = (
+        Pago.objects.filter(fecha__gte=inicio, fecha__lt=fin)
+        .select_related('tarifa', 'profesor__user')
+        .order_by('fecha', 'numero')
+    )
+    hijos = (
+        Alumno.objects.filter(pago__fecha__gte=inicio, pago__fecha__lt=fin).distinct()
+        .order_by('nombre', 'apellido', 'id')
+        .prefetch_related(Prefetch('pago_set', queryset=pagos, to_attr='pagos_mes'))
+    )
+    familias = (
+        Padres.objects.filter(hijos__pago__fecha__gte=inicio, hijos__pago__fecha__lt=fin).distinct()
+        .order_by('apellido', 'nombre', 'id')
+        .prefetch_related(Prefetch('hijos', queryset=hijos, to_attr='hijos_con_pagos'))
+    )
+    if padre_ids:
+        familias = familias.filter(pk__in=padre_ids)
+    return familias
+
+
+def html_extracto(padre, anio, mes, plantilla=None):
+    """HTML del extracto de ``padre`` (precargado con :func:`familias_del_mes`)"""
+    hijos = [
+        {'alumno': hijo, 'pagos': hijo.pagos_mes, 'total': sum((p.importe_final for p in hijo.pagos_mes), Decimal('0'))}
+        for hijo in padre.hijos_con_pagos
+    ]
+    return (plantilla or get_template(PLANTILLA)).render({
+        'padre': padre,
+        'periodo': date(anio, mes, 1),
+        'hijos': hijos,
+        'total': sum((hijo['total'] for hijo in hijos), Decimal('0')),
+    })
+
+
+def nombre_extracto(padre, anio, mes):
+    return get_valid_filename(f'extracto_{anio}-{mes:02d}_{padre.pk}_{padre.nombre}_{padre.apellido}.pdf')
+
+
+def _pdf(trabajo):
+    nombre, html = trabajo
+    try:
+        return nombre, pdf_desde_html(html), ''
+    except Exception as e:
+        return nombre, None, str(e)
+
+
+def generar_extractos(anio, mes, procesos=1, padre_ids=None):
+    """Genera los extractos del mes. Devuelve ``(nombre, pdf, error)`` por familia.
+
+    Es un generador: los PDF se entregan según terminan, en el orden de las
+    familias, para escribirlos sin tenerlos todos en memoria.
+    """
+    plantilla = get_template(PLANTILLA)
+    trabajos = [
+        (nombre_extracto(padre, anio, mes), html_extracto(padre, anio, mes, plantilla))
+        for padre in familias_del_mes(anio, mes, padre_ids)
+    ]
+    if procesos <= 1 or len(trabajos) <= 1:
+        yield from map(_pdf, trabajos)
+        return
+
+    # Lotes pequeños para repartir bien la carga sin un viaje por extracto
+    lote = max(1, min(20, len(trabajos) // (procesos * 4)))
+    with crear_pool(procesos, preparar=calentar) as pool:
+        yield from pool.map(_pdf, trabajos, chunksize=lote)
+
+
+def guardar_extractos(resultados, carpeta=None, zip_path=None):
+    """Escribe los PDF en ``carpeta`` y/o en el ZIP ``zip_path``.
+
+    Devuelve ``(generados, [(nombre, error)])``.
+    """
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    # Los PDF ya van comprimidos: se guardan sin volver a comprimir
+    archivo = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) if zip_path else None
+    generados, errores = 0, []
+    try:
+        for nombre, pdf, error in resultados:
+            if error:
+                errores.append((nombre, error))
+                continue
+            if carpeta:
+                with open(os.path.join(carpeta, nombre), 'wb') as fichero:
+                    fichero.write(pdf)
+            if archivo:
+                archivo.writestr(nombre, pdf)
+            generados += 1
+    finally:
+        if archivo:
+            archivo.close()
+    return generados, errores
@@ -0,0 +1,106 @@
+"""Facturación mensual: un pago por cada alumno activo pendiente del mes.
+
+Se factura a los alumnos activos con tarifa predeterminada (y activa) que
+no tienen ningún pago en el mes, según ``alumnos_pendientes_de_pago``. Los
+números salen de un único bloque consecutivo de ``ContadorPago`` y los pagos
+se insertan con ``bulk_create`` por lotes, todo en una transacción: o se
+factura a todos o a ninguno. Volver a lanzar la facturación no duplica
+nada, porque los alumnos facturados dejan de estar pendientes.
+
+Solo se factura el mes en curso: los pagos llevan la fecha del día en que
+se crean y de ella sale el mes que cubren, así que un mes pasado seguiría
+pendiente (y el alumno quedaría al día en el mes actual sin haberlo pagado).
+
+``bulk_create`` no dispara ``post_save``: el último pago de cada alumno se
+actualiza aquí con ``bulk_update`` y el resto de datos derivados (KPIs,
+exportaciones, balance) se avisa con la señal ``pagos_creados_en_bloque``.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Alumno, ContadorPago, Pago
+from .seguimiento_pagos import alumnos_pendientes_de_pago, periodo_de
+from .signals import pagos_creados_en_bloque
+
+# Filas por cada INSERT/UPDATE
+TAMANO_LOTE = 500
+
+
+def concepto_mensualidad(periodo):
+    return f'Mensualidad {periodo:%m/%Y}'
+
+
+def alumnos_a_facturar(periodo, alumnos=None):
+    """Alumnos activos sin pago en el mes de ``periodo`` con tarifa predeterminada activa"""
+    pendientes = (
+        alumnos_pendientes_de_pago(periodo)
+        .filter(tarifa_predeterminada__activa=True)
+        .select_related('tarifa_predeterminada')
+        .order_by('apellido', 'nombre', 'id')
+    )
+    if alumnos is not None:
+        pendientes = pendientes.filter(pk__in=alumnos)
+    return pendientes
+
+
+def _pago(alumno, numero, concepto):
+    precio = alumno.tarifa_predeterminada.precio
+    return Pago(
+        alumno=alumno,
+        tarifa=alumno.tarifa_predeterminada,
+        numero=numero,
+        importe_original=precio,
+        descuento=Decimal('0'),
+        importe_final=precio,
+        concepto=concepto,
+    )
+
+
+def previsualizar(periodo, alumnos=None):
+    """Pagos que crearía :func:`facturar_mes`, sin guardar ni reservar números"""
+    hoy = timezone.localdate()
+    ultimo = ContadorPago.objects.filter(anio=hoy.year).values_list('ultimo', flat=True).first() or 0
+    concepto = concepto_mensualidad(periodo)
+    return [
+        _pago(alumno, ContadorPago.formatear(hoy.year, ultimo + i), concepto)
+        for i, alumno in enumerate(alumnos_a_facturar(periodo, alumnos), start=1)
+    ]
+
+
+def facturar_mes(periodo, alumnos=None):
+    """Crea los pagos del mes de ``periodo`` y los devuelve (ya con ``pk``).
+
+    ``alumnos`` limita la facturación a esos ids o a ese queryset. Lanza
+    ``ValueError`` si ``periodo`` no es del mes en curso.
+    """
+    periodo = periodo_de(periodo)
+    hoy = timezone.localdate()
+    if periodo != periodo_de(hoy):
+        raise ValueError(f'Solo se puede facturar el mes en curso ({hoy:%m/%Y})')
+    concepto = concepto_mensualidad(periodo)
+    with transaction.atomic():
+        # Las filas bloqueadas hacen esperar a otra facturación simultánea,
+        # que después ya no las verá pendientes
+        pendientes = list(alumnos_a_facturar(periodo, alumnos).select_for_update(of=('self',)))
+        if not pendientes:
+            return []
+
+        numeros = ContadorPago.reservar(len(pendientes), anio=hoy.year)
+        pagos = [_pago(alumno, numero, concepto) for alumno, numero in zip(pendientes, numeros)]
+        Pago.objects.bulk_create(pagos, batch_size=TAMANO_LOTE)
+
+        # Lo que haría la señal post_save de cada pago (seguimiento_pagos)
+        for pago in pagos:
+            pago.alumno.ultimo_pago = pago
+            pago.alumno.ultimo_pago_fecha = pago.fecha
+            pago.alumno.ultimo_pago_importe = pago.importe_final
+            pago.alumno.ultimo_periodo_pagado = periodo_de(pago.fecha)
+        Alumno.objects.bulk_update(
+            pendientes,
+            ['ultimo_pago', 'ultimo_pago_fecha', 'ultimo_pago_importe', 'ultimo_periodo_pagado'],
+            batch_size=TAMANO_LOTE,
+        )
+        pagos_creados_en_bloque.send(sender=Pago, pagos=pagos)
+    return pagos
@@ -0,0 +1,53 @@
+"""Instantánea cacheada de las cifras del dashboard de gestión.
+
+La instantánea se guarda en la caché por defecto de Django y se invalida
+desde ``gestion.signals`` cuando cambian alumnos, pagos, horarios, sesiones
+o gastos, así que abrir el dashboard casi nunca llega a la base de datos.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import Alumno, Gasto, Horario, Pago, Sesion
+
+CLAVE_KPIS = 'gestion:kpis'
+
+
+def calcular_kpis(now):
+    """Calcula las cifras del dashboard para el mes de ``now``"""
+    pagos = Pago.objects.aggregate(
+        total=Count('id'),
+        importe_mes=Sum('importe_final', filter=Q(fecha__month=now.month, fecha__year=now.year)),
+    )
+    gastos = Gasto.objects.aggregate(
+        total=Count('id'),
+        importe_mes=Sum('importe', filter=Q(fecha_gasto__month=now.month, fecha_gasto__year=now.year)),
+    )
+    return {
+        'alumnos_count': Alumno.objects.filter(activo=True).count(),
+        'pagos_count': pagos['total'],
+        'horarios_count': Horario.objects.filter(activo=True).count(),
+        'sesiones_count': Sesion.objects.count(),
+        'gastos_count': gastos['total'],
+        'pagos_mes': pagos['importe_mes'] or 0,
+        'gastos_mes': gastos['importe_mes'] or 0,
+        'mes': (now.year, now.month),
+        'generado': now,
+    }
+
+
+def obtener_kpis():
+    """Devuelve la instantánea cacheada, recalculándola si falta o es de otro mes"""
+    now = timezone.now()
+    kpis = cache.get(CLAVE_KPIS)
+    if kpis is None or kpis['mes'] != (now.year, now.month):
+        kpis = calcular_kpis(now)
+        cache.set(CLAVE_KPIS, kpis, settings.CACHE_DURACION_SEGURIDAD)
+    return kpis
+
+
+def invalidar_kpis():
+    """Descarta la instantánea cuando se confirme la transacción en curso"""
+    transaction.on_commit(lambda: cache.delete(CLAVE_KPIS))
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from gestion.facturacion import facturar_mes, previsualizar
+
+
+class Command(BaseCommand):
+    help = ('Crea un pago con la tarifa predeterminada para cada alumno activo '
+            'que aún no tiene ningún pago en el mes en curso')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alumno', type=int, action='append', help='Solo este alumno (se puede repetir)')
+        parser.add_argument('--simular', action='store_true', help='Mostrar los pagos que se crearían sin guardarlos')
+
+    def _linea(self, pago):
+        alumno = pago.alumno
+        return f'+ {pago.numero}  {alumno.apellido}, {alumno.nombre}  {pago.tarifa.nombre}  {pago.importe_final}€'
+
+    def handle(self, *args, **options):
+        periodo = timezone.localdate().replace(day=1)
+
+        if options['simular']:
+            pagos = previsualizar(periodo, options['alumno'])
+            for pago in pagos:
+                self.stdout.write(self._linea(pago))
+            total = sum(pago.importe_final for pago in pagos)
+            self.stdout.write(f'{len(pagos)} pagos por crear ({total}€) para {periodo:%m/%Y}. '
+                              'Los números son orientativos: se reservan al facturar.')
+            return
+
+        inicio = time.monotonic()
+        try:
+            pagos = facturar_mes(periodo, options['alumno'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        transcurrido = time.monotonic() - inicio
+
+        if not pagos:
+            self.stdout.write(f'No hay alumnos pendientes de facturar en {periodo:%m/%Y}')
+            return
+        total = sum(pago.importe_final for pago in pagos)
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {len(pagos)} pagos creados ({pagos[0].numero} a {pagos[-1].numero}, {total}€) en {transcurrido:.1f}s'
+        ))
+        self.stdout.write('Los comprobantes se generan con: python manage.py regenerar_comprobantes')
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from gestion.comprobantes import generar_lote, guardar_resultados, reclamar_caducados, tomar_pendientes
+from gestion.models import Pago
+from gestion.procesos import crear_pool
+from gestion.renderizador import calentar
+
+
+class Command(BaseCommand):
+    help = 'Genera en segundo plano los comprobantes PDF pendientes (los que se piden desde el admin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Generar los comprobantes pendientes y terminar')
+        parser.add_argument('--intervalo', type=float, default=2,
+                            help='Segundos de espera cuando la cola está vacía (por defecto 2)')
+        parser.add_argument('--procesos', type=int, default=1,
+                            help='Procesos que generan los PDF (por defecto 1)')
+        parser.add_argument('--lote', type=int, default=20,
+                            help='Pagos que toma cada proceso de una vez (por defecto 20)')
+        parser.add_argument('--reintentar', action='store_true',
+                            help='Volver a intentar antes los comprobantes con error')
+
+    def handle(self, *args, **options):
+        if options['reintentar']:
+            Pago.objects.filter(estado_comprobante='error').update(estado_comprobante='pendiente', error_comprobante='')
+
+        with crear_pool(options['procesos'], preparar=calentar) as pool:
+            try:
+                while True:
+                    close_old_connections()
+                    reclamados = reclamar_caducados()
+                    if reclamados:
+                        self.stdout.write(f'♻️  {reclamados} comprobantes que se quedaron generando vuelven a la cola')
+
+                    lotes = [ids for ids in (tomar_pendientes(options['lote']) for _ in range(options['procesos'])) if ids]
+                    if not lotes:
+                        if options['una_vez']:
+                            break
+                        time.sleep(options['intervalo'])
+                        continue
+
+                    for resultados in pool.map(generar_lote, lotes):
+                        correctos, fallidos = guardar_resultados(resultados)
+                        for pago in fallidos:
+                            self.stderr.write(f'❌ Pago {pago.pk}: {pago.error_comprobante}')
+                        if correctos:
+                            self.stdout.write(self.style.SUCCESS(f'✅ {len(correctos)} comprobantes generados'))
+            except KeyboardInterrupt:
+                self.stdout.write('Detenido')
@@ -0,0 +1,48 @@
+import os
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from gestion.extractos import generar_extractos, guardar_extractos
+
+
+class Command(BaseCommand):
+    help = 'Genera el extracto mensual en PDF de cada familia con los pagos de todos sus hijos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mes', help='Mes del extracto (AAAA-MM, por defecto el mes anterior)')
+        parser.add_argument('--salida', default='extractos', help='Carpeta donde dejar los PDF (por defecto ./extractos)')
+        parser.add_argument('--zip', help='Reunir además los extractos en este fichero ZIP')
+        parser.add_argument('--solo-zip', action='store_true', help='No dejar los PDF sueltos, solo el ZIP')
+        parser.add_argument('--padre', type=int, action='append', help='Solo esta familia (se puede repetir)')
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help='Procesos en paralelo (por defecto, uno por CPU)')
+
+    def _mes(self, valor):
+        if not valor:
+            hoy = timezone.localdate()
+            return (hoy.year, hoy.month - 1) if hoy.month > 1 else (hoy.year - 1, 12)
+        try:
+            fecha = datetime.strptime(valor, '%Y-%m')
+        except ValueError:
+            raise CommandError(f'Mes no válido: {valor}')
+        return fecha.year, fecha.month
+
+    def handle(self, *args, **options):
+        if options['solo_zip'] and not options['zip']:
+            raise CommandError('--solo-zip necesita --zip')
+        anio, mes = self._mes(options['mes'])
+        carpeta = None if options['solo_zip'] else options['salida']
+
+        inicio = time.monotonic()
+        resultados = generar_extractos(anio, mes, procesos=options['procesos'], padre_ids=options['padre'])
+        generados, errores = guardar_extractos(resultados, carpeta=carpeta, zip_path=options['zip'])
+        transcurrido = time.monotonic() - inicio
+
+        for nombre, error in errores:
+            self.stderr.write(f'❌ {nombre}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {generados} extractos de {mes:02d}/{anio} en {transcurrido:.1f}s, {len(errores)} con error'
+        ))
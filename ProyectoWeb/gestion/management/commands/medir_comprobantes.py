@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion.models import Pago
+from gestion.renderizador import calentar, renderizar_comprobante, vaciar_cache_plantilla
+
+
+class Command(BaseCommand):
+    help = ('Mide el renderizado de los comprobantes en frío (primer PDF del proceso, '
+            'plantilla sin compilar) y en caliente (plantilla y xhtml2pdf ya cargados)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cantidad', type=int, default=50, help='Pagos a renderizar en caliente (por defecto 50)')
+
+    def handle(self, *args, **options):
+        if options['cantidad'] < 1:
+            raise CommandError('--cantidad debe ser mayor que 0')
+        pagos = list(Pago.objects.select_related('alumno', 'profesor__user').order_by('-id')[:options['cantidad']])
+        if not pagos:
+            raise CommandError('No hay pagos con los que medir')
+
+        # En frío: el primer PDF del proceso, compilando la plantilla
+        vaciar_cache_plantilla()
+        inicio = time.perf_counter()
+        renderizar_comprobante(pagos[0])
+        frio = time.perf_counter() - inicio
+
+        # En caliente: todo renderizado de nuevo, sin nada guardado entre PDF
+        calentar()
+        inicio = time.perf_counter()
+        for pago in pagos:
+            renderizar_comprobante(pago)
+        caliente = (time.perf_counter() - inicio) / len(pagos)
+
+        self.stdout.write(f'En frío: {frio * 1000:.1f} ms ({1 / frio:.1f} comprobantes/s)')
+        self.stdout.write(f'En caliente: {caliente * 1000:.1f} ms cada uno ({1 / caliente:.1f} comprobantes/s)')
+        self.stdout.write(self.style.SUCCESS(f'✅ {len(pagos)} comprobantes medidos'))
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from datetime import datetime
+
+from gestion.models import ResumenAsistenciaMensual, Sesion
+from gestion.resumenes import limites_mes, meses_con_sesiones, recalcular_resumen_mes
+
+
+def _parse_mes(valor):
+    try:
+        fecha = datetime.strptime(valor, '%Y-%m')
+    except ValueError:
+        raise CommandError(f'Mes inválido: {valor} (formato AAAA-MM)')
+    return fecha.year, fecha.month
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye los resúmenes mensuales de asistencia, completos o para un rango de meses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primer mes a recalcular (AAAA-MM)')
+        parser.add_argument('--hasta', help='Último mes a recalcular (AAAA-MM), incluido')
+        parser.add_argument('--horario', type=int, help='Recalcular solo este horario')
+
+    def handle(self, *args, **options):
+        sesiones = Sesion.objects.all()
+        resumenes = ResumenAsistenciaMensual.objects.all()
+
+        if options['desde']:
+            anio, mes = _parse_mes(options['desde'])
+            inicio, _ = limites_mes(anio, mes)
+            sesiones = sesiones.filter(inicio__gte=inicio)
+            resumenes = resumenes.filter(Q(anio__gt=anio) | Q(anio=anio, mes__gte=mes))
+        if options['hasta']:
+            anio, mes = _parse_mes(options['hasta'])
+            _, fin = limites_mes(anio, mes)
+            sesiones = sesiones.filter(inicio__lt=fin)
+            resumenes = resumenes.filter(Q(anio__lt=anio) | Q(anio=anio, mes__lte=mes))
+        if options['horario']:
+            sesiones = sesiones.filter(horario_id=options['horario'])
+            resumenes = resumenes.filter(horario_id=options['horario'])
+
+        claves = meses_con_sesiones(sesiones)
+        # Meses que ya no tienen sesiones: sus resúmenes se recalculan para borrarlos
+        claves |= set(resumenes.values_list('horario_id', 'anio', 'mes').order_by().distinct())
+
+        self.stdout.write(f'Recalculando {len(claves)} meses de horario...')
+        with transaction.atomic():
+            for clave in sorted(claves):
+                recalcular_resumen_mes(*clave)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Resúmenes recalculados: {ResumenAsistenciaMensual.objects.count()} filas en total'
+            )
+        )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gestion.models import Alumno
+from gestion.seguimiento_pagos import actualizar_ultimo_pago
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el último pago de cada alumno (tras cargas o cambios masivos con update())'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alumno', type=int, help='Recalcular solo este alumno')
+
+    def handle(self, *args, **options):
+        alumnos = Alumno.objects.order_by('id')
+        if options['alumno']:
+            alumnos = alumnos.filter(pk=options['alumno'])
+        ids = list(alumnos.values_list('id', flat=True))
+
+        self.stdout.write(f'Recalculando el último pago de {len(ids)} alumnos...')
+        with transaction.atomic():
+            for alumno_id in ids:
+                actualizar_ultimo_pago(alumno_id)
+
+        self.stdout.write(self.style.SUCCESS('✅ Últimos pagos recalculados'))
@@ -0,0 +1,106 @@
+import os
+import time
+from concurrent.futures import as_completed
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion.comprobantes import generar_lote, guardar_resultados, nombre_comprobante
+from gestion.models import Pago
+from gestion.procesos import crear_pool
+from gestion.renderizador import calentar
+
+# Pagos que se leen de la base de datos en cada bloque al seleccionar
+TAMANO_LECTURA = 2000
+
+
+class Command(BaseCommand):
+    help = ('Regenera en paralelo los comprobantes PDF que faltan, no existen en disco o '
+            'tienen un nombre antiguo (o todos los que coincidan con los filtros con --todos)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todos', action='store_true',
+                            help='Regenerar todos los pagos filtrados, no solo los que faltan o están anticuados')
+        parser.add_argument('--desde', help='Solo pagos desde esta fecha (AAAA-MM-DD)')
+        parser.add_argument('--hasta', help='Solo pagos hasta esta fecha (AAAA-MM-DD)')
+        parser.add_argument('--alumno', type=int, help='Solo los pagos de este alumno')
+        parser.add_argument('--numero', help='Solo los pagos cuyo número empieza así (p. ej. PG-2024-)')
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help='Procesos en paralelo (por defecto, uno por CPU)')
+        parser.add_argument('--lote', type=int, default=50, help='Pagos por lote de cada proceso (por defecto 50)')
+        parser.add_argument('--borrar-antiguos', action='store_true',
+                            help='Borrar el PDF anterior cuando el nuevo tiene otro nombre')
+        parser.add_argument('--simular', action='store_true', help='Solo contar los comprobantes a regenerar')
+
+    def _fecha(self, valor):
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Fecha no válida: {valor}')
+
+    def _seleccionar(self, options):
+        """``{pago_id: nombre actual}`` de los pagos a regenerar"""
+        # Los que están en la cola de generar_comprobantes se dejan en paz
+        pagos = Pago.objects.exclude(estado_comprobante__in=['pendiente', 'generando']).order_by('id')
+        if options['desde']:
+            pagos = pagos.filter(fecha__gte=self._fecha(options['desde']))
+        if options['hasta']:
+            pagos = pagos.filter(fecha__lte=self._fecha(options['hasta']))
+        if options['alumno']:
+            pagos = pagos.filter(alumno_id=options['alumno'])
+        if options['numero']:
+            pagos = pagos.filter(numero__startswith=options['numero'])
+
+        # Un solo listado del directorio en lugar de comprobar cada fichero
+        storage = Pago._meta.get_field('comprobante').storage
+        try:
+            en_disco = set(storage.listdir('comprobantes')[1])
+        except FileNotFoundError:
+            en_disco = set()
+
+        seleccion = {}
+        for pago_id, numero, actual in pagos.values_list('id', 'numero', 'comprobante').iterator(chunk_size=TAMANO_LECTURA):
+            anticuado = (
+                not actual
+                or actual != nombre_comprobante(numero)
+                or os.path.basename(actual) not in en_disco
+            )
+            if options['todos'] or anticuado:
+                seleccion[pago_id] = actual or ''
+        return seleccion
+
+    def handle(self, *args, **options):
+        seleccion = self._seleccionar(options)
+        self.stdout.write(f'{len(seleccion)} comprobantes por regenerar')
+        if options['simular'] or not seleccion:
+            return
+
+        ids = list(seleccion)
+        lotes = [ids[i:i + options['lote']] for i in range(0, len(ids), options['lote'])]
+        storage = Pago._meta.get_field('comprobante').storage
+        generados = errores = 0
+        inicio = time.monotonic()
+
+        with crear_pool(options['procesos'], preparar=calentar) as pool:
+            futuros = [pool.submit(generar_lote, lote) for lote in lotes]
+            for futuro in as_completed(futuros):
+                correctos, fallidos = guardar_resultados(futuro.result())
+
+                if options['borrar_antiguos']:
+                    for pago in correctos:
+                        anterior = seleccion[pago.pk]
+                        if anterior and anterior != pago.comprobante.name:
+                            storage.delete(anterior)
+
+                generados += len(correctos)
+                errores += len(fallidos)
+                for pago in fallidos:
+                    self.stderr.write(f'❌ Pago {pago.pk}: {pago.error_comprobante}')
+                transcurrido = time.monotonic() - inicio
+                self.stdout.write(f'{generados + errores}/{len(ids)} ({generados / transcurrido:.1f} comprobantes/s)')
+
+        transcurrido = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {generados} comprobantes en {transcurrido:.1f}s '
+            f'({generados / transcurrido:.1f} comprobantes/s), {errores} con error'
+        ))
@@ -0,0 +1,103 @@
+"""Matriz de asistencia (alumno × sesión) de un horario.
+
+La matriz se carga con dos consultas, una para las sesiones (las columnas) y
+otra para todas sus asistencias, y se guarda en un ``array`` compacto; todas
+las cifras de asistencia de una página se calculan después en memoria.
+"""
+from array import array
+
+from .models import Asistencia
+
+SIN_REGISTRO = -1
+FALTA = 0
+PRESENTE = 1
+
+
+class MatrizAsistencia:
+    """Presencia de cada alumno (filas) en cada sesión (columnas)"""
+
+    def __init__(self, alumnos, sesiones):
+        self.alumnos = list(alumnos)
+        self.sesiones = list(sesiones)
+        self._filas = {alumno.id: i for i, alumno in enumerate(self.alumnos)}
+        self._columnas = {sesion.id: j for j, sesion in enumerate(self.sesiones)}
+        self._celdas = array('b', [SIN_REGISTRO]) * (len(self.alumnos) * len(self.sesiones))
+
+    def _indice(self, alumno_id, sesion_id):
+        fila = self._filas.get(alumno_id)
+        columna = self._columnas.get(sesion_id)
+        if fila is None or columna is None:
+            return None
+        return fila * len(self.sesiones) + columna
+
+    def marcar(self, alumno_id, sesion_id, presente):
+        indice = self._indice(alumno_id, sesion_id)
+        if indice is not None:
+            self._celdas[indice] = PRESENTE if presente else FALTA
+
+    def valor(self, alumno_id, sesion_id):
+        indice = self._indice(alumno_id, sesion_id)
+        return SIN_REGISTRO if indice is None else self._celdas[indice]
+
+    def resumen_sesion(self, sesion_id):
+        """``(registros, presentes)`` de los alumnos de la matriz en una sesión"""
+        columna = self._columnas[sesion_id]
+        valores = self._celdas[columna::len(self.sesiones)] if self.sesiones else []
+        return _contar(valores)
+
+    def resumen_alumno(self, alumno_id, sesion_ids=None):
+        """``(registros, presentes)`` de un alumno, opcionalmente solo en ``sesion_ids``"""
+        inicio = self._filas[alumno_id] * len(self.sesiones)
+        fila = self._celdas[inicio:inicio + len(self.sesiones)]
+        if sesion_ids is not None:
+            fila = [fila[self._columnas[sesion_id]] for sesion_id in sesion_ids]
+        return _contar(fila)
+
+    def resumen(self, sesion_ids):
+        """``(registros, presentes)`` de todos los alumnos en ``sesion_ids``"""
+        registros = presentes = 0
+        for sesion_id in sesion_ids:
+            total_sesion, presentes_sesion = self.resumen_sesion(sesion_id)
+            registros += total_sesion
+            presentes += presentes_sesion
+        return registros, presentes
+
+    def ultimo_registro(self, alumno_id):
+        """``(sesion, presente)`` del registro más reciente del alumno, o ``None``"""
+        inicio = self._filas[alumno_id] * len(self.sesiones)
+        for columna in range(len(self.sesiones) - 1, -1, -1):
+            valor = self._celdas[inicio + columna]
+            if valor != SIN_REGISTRO:
+                return self.sesiones[columna], valor == PRESENTE
+        return None
+
+
+def _contar(valores):
+    registros = presentes = 0
+    for valor in valores:
+        if valor != SIN_REGISTRO:
+            registros += 1
+            presentes += valor
+    return registros, presentes
+
+
+def cargar_matriz_asistencia(horario, alumnos, desde=None, hasta=None):
+    """Carga la matriz de ``alumnos`` en las sesiones de ``horario`` entre ``desde`` y ``hasta``.
+
+    Las sesiones se ordenan por ``inicio``. Los límites son opcionales y
+    ``hasta`` es exclusivo.
+    """
+    sesiones = horario.sesiones.order_by('inicio', 'id')
+    asistencias = Asistencia.objects.filter(sesion__horario=horario)
+    if desde is not None:
+        sesiones = sesiones.filter(inicio__gte=desde)
+        asistencias = asistencias.filter(sesion__inicio__gte=desde)
+    if hasta is not None:
+        sesiones = sesiones.filter(inicio__lt=hasta)
+        asistencias = asistencias.filter(sesion__inicio__lt=hasta)
+
+    matriz = MatrizAsistencia(alumnos, sesiones)
+    asistencias = asistencias.filter(alumno_id__in=[alumno.id for alumno in matriz.alumnos])
+    for sesion_id, alumno_id, presente in asistencias.values_list('sesion_id', 'alumno_id', 'presente'):
+        matriz.marcar(alumno_id, sesion_id, presente)
+    return matriz
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0008_alumno_curso'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alumno',
+            index=models.Index(fields=['apellido', 'nombre', 'id'], name='alumno_apellido_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['-fecha_gasto', '-id'], name='gasto_fecha_gasto_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='horario',
+            index=models.Index(fields=['dia_semana', 'hora_inicio', 'id'], name='horario_dia_hora_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['-fecha', '-id'], name='pago_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sesion',
+            index=models.Index(fields=['-inicio', 'id'], name='sesion_inicio_idx'),
+        ),
+    ]
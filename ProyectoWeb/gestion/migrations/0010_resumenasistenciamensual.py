@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:18
+
+import django.db.models.deletion
+from collections import defaultdict
+from datetime import date
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def poblar_resumenes(apps, schema_editor):
+    """Carga inicial de los resúmenes a partir del histórico de asistencias"""
+    Sesion = apps.get_model('gestion', 'Sesion')
+    Asistencia = apps.get_model('gestion', 'Asistencia')
+    MatriculaHorario = apps.get_model('gestion', 'MatriculaHorario')
+    ResumenAsistenciaMensual = apps.get_model('gestion', 'ResumenAsistenciaMensual')
+
+    sesiones = {
+        (fila['horario_id'], fila['anio'], fila['mes']): fila['total']
+        for fila in Sesion.objects.annotate(anio=ExtractYear('inicio'), mes=ExtractMonth('inicio'))
+        .values('horario_id', 'anio', 'mes').annotate(total=Count('id')).order_by()
+    }
+
+    matriculas = defaultdict(list)
+    for alumno_id, horario_id, fecha_matricula in MatriculaHorario.objects.filter(estado='activa').values_list(
+        'alumno_id', 'horario_id', 'fecha_matricula'
+    ):
+        matriculas[horario_id].append((alumno_id, fecha_matricula))
+
+    filas = {}
+    for (horario_id, anio, mes) in sesiones:
+        fin = date(anio + mes // 12, mes % 12 + 1, 1)
+        for alumno_id, fecha_matricula in matriculas[horario_id]:
+            if fecha_matricula < fin:
+                filas[(alumno_id, horario_id, anio, mes)] = (0, 0)
+
+    asistencias = Asistencia.objects.annotate(
+        anio=ExtractYear('sesion__inicio'), mes=ExtractMonth('sesion__inicio'),
+    ).values('alumno_id', 'sesion__horario_id', 'anio', 'mes').annotate(
+        presentes=Count('id', filter=Q(presente=True)),
+        faltas=Count('id', filter=Q(presente=False)),
+    ).order_by()
+    for fila in asistencias:
+        clave = (fila['alumno_id'], fila['sesion__horario_id'], fila['anio'], fila['mes'])
+        filas[clave] = (fila['presentes'], fila['faltas'])
+
+    ResumenAsistenciaMensual.objects.bulk_create([
+        ResumenAsistenciaMensual(
+            alumno_id=alumno_id, horario_id=horario_id, anio=anio, mes=mes,
+            presentes=presentes, faltas=faltas, sesiones=sesiones[(horario_id, anio, mes)],
+        )
+        for (alumno_id, horario_id, anio, mes), (presentes, faltas) in filas.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0009_indices_paginacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenAsistenciaMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('anio', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('presentes', models.PositiveIntegerField(default=0)),
+                ('faltas', models.PositiveIntegerField(default=0)),
+                ('sesiones', models.PositiveIntegerField(default=0, help_text='Sesiones del horario en el mes')),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('alumno', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_asistencia', to='gestion.alumno')),
+                ('horario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_asistencia', to='gestion.horario')),
+            ],
+            options={
+                'verbose_name': 'Resumen de asistencia mensual',
+                'verbose_name_plural': 'Resúmenes de asistencia mensual',
+                'indexes': [models.Index(fields=['anio', 'mes', 'horario'], name='resumen_asist_mes_idx')],
+                'unique_together': {('alumno', 'horario', 'anio', 'mes')},
+            },
+        ),
+        migrations.RunPython(poblar_resumenes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def poblar_ultimo_pago(apps, schema_editor):
+    """Carga inicial del último pago de cada alumno"""
+    Alumno = apps.get_model('gestion', 'Alumno')
+    Pago = apps.get_model('gestion', 'Pago')
+
+    ultimos = {}
+    for pago in Pago.objects.order_by('alumno_id', '-fecha', '-id').only('id', 'alumno_id', 'fecha', 'importe_final'):
+        ultimos.setdefault(pago.alumno_id, pago)
+
+    alumnos = list(Alumno.objects.filter(id__in=ultimos))
+    for alumno in alumnos:
+        pago = ultimos[alumno.id]
+        alumno.ultimo_pago_id = pago.id
+        alumno.ultimo_pago_fecha = pago.fecha
+        alumno.ultimo_pago_importe = pago.importe_final
+        alumno.ultimo_periodo_pagado = pago.fecha.replace(day=1)
+    Alumno.objects.bulk_update(
+        alumnos,
+        ['ultimo_pago', 'ultimo_pago_fecha', 'ultimo_pago_importe', 'ultimo_periodo_pagado'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0010_resumenasistenciamensual'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alumno',
+            name='ultimo_pago',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gestion.pago'),
+        ),
+        migrations.AddField(
+            model_name='alumno',
+            name='ultimo_pago_fecha',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='alumno',
+            name='ultimo_pago_importe',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='alumno',
+            name='ultimo_periodo_pagado',
+            field=models.DateField(blank=True, editable=False, help_text='Primer día del último mes con pago', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='alumno',
+            index=models.Index(fields=['activo', 'ultimo_periodo_pagado'], name='alumno_periodo_pagado_idx'),
+        ),
+        migrations.RunPython(poblar_ultimo_pago, migrations.RunPython.noop),
+    ]
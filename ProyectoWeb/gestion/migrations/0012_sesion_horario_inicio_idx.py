@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0011_alumno_ultimo_pago'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sesion',
+            index=models.Index(fields=['horario', 'inicio'], name='sesion_horario_inicio_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0012_sesion_horario_inicio_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gasto',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='pago',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='gasto_actualizacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='pago_actualizacion_idx'),
+        ),
+    ]
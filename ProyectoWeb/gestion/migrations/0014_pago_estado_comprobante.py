@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+def marcar_comprobantes_existentes(apps, schema_editor):
+    """Los pagos que ya tienen PDF quedan con el comprobante listo"""
+    Pago = apps.get_model('gestion', 'Pago')
+    Pago.objects.exclude(comprobante='').exclude(comprobante__isnull=True).update(estado_comprobante='listo')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0013_pago_gasto_fecha_actualizacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pago',
+            name='error_comprobante',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='pago',
+            name='estado_comprobante',
+            field=models.CharField(blank=True, choices=[('pendiente', 'Pendiente'), ('generando', 'Generando'), ('listo', 'Listo'), ('error', 'Error')], max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['estado_comprobante'], name='pago_estado_comprobante_idx'),
+        ),
+        migrations.RunPython(marcar_comprobantes_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:53
+
+import re
+
+from django.db import migrations, models
+
+
+def iniciar_contadores(apps, schema_editor):
+    """Cada contador empieza en el número más alto ya usado en su año"""
+    Pago = apps.get_model('gestion', 'Pago')
+    ContadorPago = apps.get_model('gestion', 'ContadorPago')
+    re_numero = re.compile(r'^PG-(\d{4})-(\d+)$')
+    ultimos = {}
+    for numero in Pago.objects.filter(numero__startswith='PG-').values_list('numero', flat=True).iterator():
+        coincidencia = re_numero.match(numero)
+        if coincidencia:
+            anio, valor = int(coincidencia.group(1)), int(coincidencia.group(2))
+            ultimos[anio] = max(ultimos.get(anio, 0), valor)
+    ContadorPago.objects.bulk_create([ContadorPago(anio=anio, ultimo=ultimo) for anio, ultimo in ultimos.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0014_pago_estado_comprobante'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorPago',
+            fields=[
+                ('anio', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('ultimo', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador de pagos',
+                'verbose_name_plural': 'Contadores de pagos',
+            },
+        ),
+        migrations.AlterField(
+            model_name='pago',
+            name='numero',
+            field=models.CharField(blank=True, help_text='Se asigna automáticamente al guardar si se deja vacío', max_length=20, unique=True),
+        ),
+        migrations.RunPython(iniciar_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0015_contador_pago'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pago',
+            name='inicio_comprobante',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
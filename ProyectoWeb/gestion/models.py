@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator
+from django.db.models import F
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 import os
 import re
 
@@ -43,10 +46,36 @@ class Alumno(models.Model):
     padre = models.ForeignKey('Padres', on_delete=models.SET_NULL, null=True, blank=True, related_name='hijos')
     tarifa_predeterminada = models.ForeignKey('Tarifa', on_delete=models.SET_NULL, null=True, blank=True, 
                                             help_text="Tarifa predeterminada para este alumno")
+    # Datos del último pago, mantenidos por gestion.signals (ver gestion/seguimiento_pagos.py)
+    ultimo_pago = models.ForeignKey('Pago', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+                                    related_name='+')
+    ultimo_pago_fecha = models.DateField(null=True, blank=True, editable=False)
+    ultimo_pago_importe = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    ultimo_periodo_pagado = models.DateField(null=True, blank=True, editable=False,
+                                             help_text="Primer día del último mes con pago")
+
+    CAMPOS_ULTIMO_PAGO = ('ultimo_pago', 'ultimo_pago_fecha', 'ultimo_pago_importe', 'ultimo_periodo_pagado')
+
+    def save(self, *args, **kwargs):
+        # Los datos del último pago solo se escriben con update() al cambiar
+        # los pagos: un alumno leído antes de un pago no debe volver a dejar
+        # los valores antiguos al guardarse
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name not in self.CAMPOS_ULTIMO_PAGO
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.nombre + ' ' + self.apellido
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['apellido', 'nombre', 'id'], name='alumno_apellido_nombre_idx'),
+            models.Index(fields=['activo', 'ultimo_periodo_pagado'], name='alumno_periodo_pagado_idx'),
+        ]
+
 class Profesor(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='perfil_profesor')
     telefono = models.CharField(max_length=20, blank=True)
@@ -83,6 +112,11 @@ class Horario(models.Model):
     fecha_inicio = models.DateField(null=True, blank=True)
     fecha_fin = models.DateField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['dia_semana', 'hora_inicio', 'id'], name='horario_dia_hora_idx'),
+        ]
+
     def __str__(self):
         return f"{self.asignatura} - {self.get_dia_semana_display()} {self.hora_inicio}-{self.hora_fin} ({self.profesor})"
 
@@ -101,10 +135,60 @@ class MatriculaHorario(models.Model):
     def __str__(self):
         return f"{self.alumno} -> {self.horario}"
 
+class SesionQuerySet(models.QuerySet):
+    def contiguas(self, momento):
+        """Próxima y anterior sesión de cada horario respecto a ``momento``.
+
+        Se resuelve en una sola consulta numerando las sesiones de cada horario
+        con una función de ventana; cada sesión devuelta lleva ``es_proxima``.
+        """
+        futura = models.Q(inicio__gte=momento)
+        return self.annotate(
+            es_proxima=models.ExpressionWrapper(futura, output_field=models.BooleanField()),
+            _posicion=models.Window(
+                RowNumber(),
+                partition_by=[models.F('horario_id'), models.F('es_proxima')],
+                # Las futuras de menor a mayor inicio y las pasadas de mayor a menor
+                order_by=[
+                    models.Case(models.When(futura, then=models.F('inicio'))).asc(),
+                    models.Case(models.When(futura, then=models.F('id'))).asc(),
+                    models.F('inicio').desc(),
+                    models.F('id').desc(),
+                ],
+            ),
+        ).filter(_posicion=1)
+
+    def proximas_por_alumno(self, momento, alumnos):
+        """Próxima sesión de cada alumno entre todos sus horarios con matrícula activa.
+
+        Cada sesión devuelta lleva ``alumno_matriculado_id``.
+        """
+        return self.filter(
+            horario__matriculas__alumno__in=alumnos,
+            horario__matriculas__estado='activa',
+            inicio__gte=momento,
+        ).annotate(
+            alumno_matriculado_id=models.F('horario__matriculas__alumno_id'),
+            _posicion=models.Window(
+                RowNumber(),
+                partition_by=[models.F('horario__matriculas__alumno_id')],
+                order_by=[models.F('inicio').asc(), models.F('id').asc()],
+            ),
+        ).filter(_posicion=1)
+
+
 class Sesion(models.Model):
     horario = models.ForeignKey(Horario, on_delete=models.CASCADE, related_name='sesiones')
     inicio = models.DateTimeField()
     fin = models.DateTimeField()
+
+    objects = SesionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-inicio', 'id'], name='sesion_inicio_idx'),
+            models.Index(fields=['horario', 'inicio'], name='sesion_horario_inicio_idx'),
+        ]
     
     def __str__(self):
         return f"{self.horario.asignatura} - {self.inicio.strftime('%d/%m/%Y %H:%M')}"
@@ -120,6 +204,33 @@ class Asistencia(models.Model):
     def __str__(self):
         return f"{self.alumno.nombre} {self.alumno.apellido}"
         
+class ResumenAsistenciaMensual(models.Model):
+    """Asistencia agregada de un alumno en un horario durante un mes.
+
+    Se mantiene desde ``gestion.signals`` al guardar o borrar asistencias,
+    sesiones y matrículas, y se reconstruye con el comando
+    ``recalcular_resumen_asistencias``.
+    """
+    alumno = models.ForeignKey('Alumno', on_delete=models.CASCADE, related_name='resumenes_asistencia')
+    horario = models.ForeignKey('Horario', on_delete=models.CASCADE, related_name='resumenes_asistencia')
+    anio = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    presentes = models.PositiveIntegerField(default=0)
+    faltas = models.PositiveIntegerField(default=0)
+    sesiones = models.PositiveIntegerField(default=0, help_text="Sesiones del horario en el mes")
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Resumen de asistencia mensual"
+        verbose_name_plural = "Resúmenes de asistencia mensual"
+        unique_together = [('alumno', 'horario', 'anio', 'mes')]
+        indexes = [
+            models.Index(fields=['anio', 'mes', 'horario'], name='resumen_asist_mes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.alumno} - {self.horario.asignatura} ({self.mes:02d}/{self.anio})"
+
 class Tarifa(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
     precio = models.DecimalField(max_digits=10, decimal_places=2, help_text="Precio en euros")
@@ -137,50 +248,117 @@ class Tarifa(models.Model):
         verbose_name_plural = "Tarifas"
         ordering = ['nombre']
 
+class ContadorPago(models.Model):
+    """Último número de pago asignado en cada año (``PG-<año>-<número>``).
+
+    Reservar números es un ``UPDATE`` del contador del año, que bloquea su
+    fila hasta el final de la transacción: dos guardados a la vez esperan su
+    turno en lugar de calcular el mismo número, y no hace falta buscar el
+    último pago.
+    """
+    anio = models.PositiveIntegerField(primary_key=True)
+    ultimo = models.PositiveIntegerField(default=0)
+
+    re_numero = re.compile(r'^PG-(\d{4})-(\d+)$')
+
+    class Meta:
+        verbose_name = "Contador de pagos"
+        verbose_name_plural = "Contadores de pagos"
+
+    def __str__(self):
+        return f"{self.anio}: {self.ultimo}"
+
+    @staticmethod
+    def formatear(anio, numero):
+        return f"PG-{anio}-{numero:04d}"
+
+    @classmethod
+    def reservar(cls, cantidad=1, anio=None):
+        """Reserva ``cantidad`` números consecutivos del año y los devuelve.
+
+        Si la transacción que los reserva se deshace, los números vuelven a
+        quedar libres. El año por defecto es el de la fecha local (``TIME_ZONE``),
+        como ``Pago.fecha`` y la facturación mensual.
+        """
+        anio = anio or timezone.localdate().year
+        with transaction.atomic():
+            # Primero el UPDATE, que toma el bloqueo; la fila del año solo
+            # se crea la primera vez
+            if not cls.objects.filter(anio=anio).update(ultimo=F('ultimo') + cantidad):
+                cls.objects.get_or_create(anio=anio)
+                cls.objects.filter(anio=anio).update(ultimo=F('ultimo') + cantidad)
+            ultimo = cls.objects.values_list('ultimo', flat=True).get(anio=anio)
+        return [cls.formatear(anio, n) for n in range(ultimo - cantidad + 1, ultimo + 1)]
+
+    @classmethod
+    def registrar(cls, numero):
+        """Adelanta el contador si ``numero`` se ha puesto a mano por delante de él"""
+        coincidencia = cls.re_numero.match(numero or '')
+        if not coincidencia:
+            return
+        anio, valor = int(coincidencia.group(1)), int(coincidencia.group(2))
+        with transaction.atomic():
+            if not cls.objects.filter(anio=anio, ultimo__lt=valor).update(ultimo=valor):
+                cls.objects.get_or_create(anio=anio, defaults={'ultimo': valor})
+
+
 class Pago(models.Model):
+    ESTADOS_COMPROBANTE = [
+        ('pendiente', 'Pendiente'),
+        ('generando', 'Generando'),
+        ('listo', 'Listo'),
+        ('error', 'Error'),
+    ]
+
     alumno = models.ForeignKey('Alumno', on_delete=models.PROTECT)
     profesor = models.ForeignKey('Profesor', on_delete=models.PROTECT, blank=True, null=True)
     tarifa = models.ForeignKey('Tarifa', on_delete=models.PROTECT, null=True, blank=True)
-    numero = models.CharField(max_length=20, unique=True)
+    numero = models.CharField(max_length=20, unique=True, blank=True,
+                              help_text="Se asigna automáticamente al guardar si se deja vacío")
     fecha = models.DateField(auto_now_add=True)
     importe_original = models.DecimalField(max_digits=10, decimal_places=2, help_text="Importe original de la tarifa", default=0)
     descuento = models.DecimalField(max_digits=5, decimal_places=2, default=0, help_text="Descuento aplicado en euros")
     importe_final = models.DecimalField(max_digits=10, decimal_places=2, help_text="Importe final después del descuento", default=0)
     concepto = models.CharField(max_length=200, blank=True)
     comprobante = models.FileField(upload_to='comprobantes/', blank=True, null=True)
+    # Estado del comprobante PDF, que se genera en segundo plano (gestion.comprobantes)
+    estado_comprobante = models.CharField(max_length=10, choices=ESTADOS_COMPROBANTE, blank=True)
+    error_comprobante = models.TextField(blank=True)
+    # Cuándo lo tomó el proceso que lo genera, para recuperar los que se quedan a medias
+    inicio_comprobante = models.DateTimeField(null=True, blank=True)
+    # Marca de la exportación incremental (reportes.sincronizacion)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-fecha', '-id'], name='pago_fecha_idx'),
+            models.Index(fields=['fecha_actualizacion', 'id'], name='pago_actualizacion_idx'),
+            models.Index(fields=['estado_comprobante'], name='pago_estado_comprobante_idx'),
+        ]
     
     @staticmethod
     def generar_siguiente_numero() -> str:
-        from datetime import datetime
-        year = datetime.now().year
-        prefix = f"PG-{year}-"
-        
-        # Buscar el último pago del año actual
-        ultimo = Pago.objects.filter(numero__startswith=prefix).order_by('-numero').first()
-        
-        if not ultimo:
-            # Primer pago del año
-            return f"{prefix}0001"
-        
-        # Extraer el número del último pago
-        try:
-            # Obtener la parte numérica después del prefijo
-            numero_str = ultimo.numero.replace(prefix, "")
-            numero_actual = int(numero_str)
-            numero_siguiente = numero_actual + 1
-            return f"{prefix}{numero_siguiente:04d}"
-        except (ValueError, AttributeError):
-            # Fallback: usar el ID + 1
-            ultimo_por_id = Pago.objects.order_by('-id').first()
-            if ultimo_por_id:
-                return f"{prefix}{(ultimo_por_id.id + 1):04d}"
-            return f"{prefix}0001"
-    
+        """Número que recibiría ahora el siguiente pago, sin reservarlo.
+
+        Es orientativo: el número definitivo se reserva al guardar (ver
+        ContadorPago), así que consultarlo no gasta números ni deja huecos.
+        """
+        anio = timezone.localdate().year
+        ultimo = ContadorPago.objects.filter(anio=anio).values_list('ultimo', flat=True).first() or 0
+        return ContadorPago.formatear(anio, ultimo + 1)
+
     def save(self, *args, **kwargs):
         # Calcular importe final automáticamente
         if self.importe_original is not None and self.descuento is not None:
             self.importe_final = self.importe_original - self.descuento
-        super().save(*args, **kwargs)
+        # El número se reserva en la misma transacción que el guardado: si
+        # este falla, el contador vuelve atrás y no quedan huecos
+        with transaction.atomic():
+            if not self.numero:
+                self.numero = ContadorPago.reservar()[0]
+            else:
+                ContadorPago.registrar(self.numero)
+            super().save(*args, **kwargs)
     
     def __str__(self):
         return f"Pago {self.numero} - {self.alumno} - {self.importe_final}€"
@@ -223,6 +401,8 @@ class Gasto(models.Model):
             )
         ]
     )
+    # Marca de la exportación incremental (reportes.sincronizacion)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.concepto} - {self.importe}€ ({self.get_categoria_display()})"
@@ -240,4 +420,8 @@ class Gasto(models.Model):
     class Meta:
         verbose_name = "Gasto"
         verbose_name_plural = "Gastos"
-        ordering = ['-fecha_gasto', '-fecha']
\ No newline at end of file
+        ordering = ['-fecha_gasto', '-fecha']
+        indexes = [
+            models.Index(fields=['-fecha_gasto', '-id'], name='gasto_fecha_gasto_idx'),
+            models.Index(fields=['fecha_actualizacion', 'id'], name='gasto_actualizacion_idx'),
+        ]
\ No newline at end of file
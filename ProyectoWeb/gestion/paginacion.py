@@ -0,0 +1,125 @@
+"""Paginación por cursor (keyset) para los listados de gestión.
+
+En lugar de ``OFFSET`` cada página busca a partir de la clave de la última
+fila mostrada, de modo que la página N cuesta lo mismo que la primera si
+las claves de orden están indexadas.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+TAMANO_PAGINA = 50
+
+
+def _campos_orden(orden):
+    """Convierte ``('-fecha', 'id')`` en ``[('fecha', True), ('id', False)]``"""
+    return [(campo.lstrip('-'), campo.startswith('-')) for campo in orden]
+
+
+def _codificar_cursor(valores):
+    datos = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in valores])
+    return base64.urlsafe_b64encode(datos.encode('utf-8')).decode('ascii')
+
+
+def _decodificar_cursor(model, campos, cursor):
+    """Devuelve los valores del cursor o ``None`` si no es válido"""
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+    if not isinstance(valores, list) or len(valores) != len(campos):
+        return None
+    try:
+        return [
+            model._meta.get_field(campo).to_python(valor)
+            for (campo, _), valor in zip(campos, valores)
+        ]
+    except ValidationError:
+        return None
+
+
+def _condicion_seek(campos, valores, hacia_atras):
+    """Filtro de las filas posteriores (o anteriores) a la clave ``valores``"""
+    condicion = Q()
+    iguales = {}
+    for (campo, descendente), valor in zip(campos, valores):
+        lookup = 'lt' if descendente != hacia_atras else 'gt'
+        condicion |= Q(**iguales, **{f'{campo}__{lookup}': valor})
+        iguales[campo] = valor
+    return condicion
+
+
+class PaginaKeyset:
+    """Una página de resultados con los enlaces a la anterior y la siguiente"""
+
+    def __init__(self, request, objetos, campos, tiene_anterior, tiene_siguiente):
+        self.objetos = objetos
+        self.tiene_anterior = tiene_anterior and bool(objetos)
+        self.tiene_siguiente = tiene_siguiente and bool(objetos)
+        self._request = request
+        self._campos = campos
+
+    def __iter__(self):
+        return iter(self.objetos)
+
+    def __len__(self):
+        return len(self.objetos)
+
+    def _clave(self, obj):
+        return [getattr(obj, campo) for campo, _ in self._campos]
+
+    def _url(self, parametro, obj):
+        params = self._request.GET.copy()
+        params.pop('despues', None)
+        params.pop('antes', None)
+        params[parametro] = _codificar_cursor(self._clave(obj))
+        return '?' + params.urlencode()
+
+    @property
+    def url_siguiente(self):
+        if self.tiene_siguiente:
+            return self._url('despues', self.objetos[-1])
+        return ''
+
+    @property
+    def url_anterior(self):
+        if self.tiene_anterior:
+            return self._url('antes', self.objetos[0])
+        return ''
+
+
+def paginar_keyset(request, queryset, orden, por_pagina=TAMANO_PAGINA):
+    """Pagina ``queryset`` por las claves de ``orden`` usando ``?despues=``/``?antes=``.
+
+    ``orden`` debe identificar cada fila de forma única (terminar en ``id``).
+    Un cursor inválido se ignora y se muestra la primera página.
+    """
+    campos = _campos_orden(orden)
+    despues = request.GET.get('despues', '')
+    antes = request.GET.get('antes', '')
+    valores = None
+    hacia_atras = False
+    if despues:
+        valores = _decodificar_cursor(queryset.model, campos, despues)
+    elif antes:
+        valores = _decodificar_cursor(queryset.model, campos, antes)
+        hacia_atras = valores is not None
+
+    if hacia_atras:
+        queryset = queryset.order_by(*[campo if desc else f'-{campo}' for campo, desc in campos])
+    else:
+        queryset = queryset.order_by(*orden)
+    if valores is not None:
+        queryset = queryset.filter(_condicion_seek(campos, valores, hacia_atras))
+
+    objetos = list(queryset[:por_pagina + 1])
+    hay_mas = len(objetos) > por_pagina
+    objetos = objetos[:por_pagina]
+
+    if hacia_atras:
+        objetos.reverse()
+        return PaginaKeyset(request, objetos, campos, tiene_anterior=hay_mas, tiene_siguiente=True)
+    return PaginaKeyset(request, objetos, campos, tiene_anterior=valores is not None, tiene_siguiente=hay_mas)
@@ -0,0 +1,29 @@
+"""Pools de procesos para el trabajo pesado (PDF, hojas de Excel).
+
+Todos los pools del proyecto se crean con :func:`crear_pool`, que deja
+cada proceso hijo con Django inicializado y, si se indica, precalentado
+(p. ej. la plantilla y xhtml2pdf de los comprobantes).
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections
+
+
+def iniciar_proceso(preparar=None):
+    """Inicializa Django en un proceso del pool (necesario si no se crean con fork)"""
+    django.setup()
+    if preparar is not None:
+        preparar()
+
+
+def crear_pool(procesos, preparar=None):
+    """``ProcessPoolExecutor`` de ``procesos`` procesos con Django inicializado.
+
+    ``preparar`` es una función a nivel de módulo (se envía a los hijos) que
+    se ejecuta una vez en cada proceso al arrancar.
+    """
+    # Con fork los hijos heredarían las conexiones abiertas del padre y
+    # compartirían el mismo socket con la base de datos
+    connections.close_all()
+    return ProcessPoolExecutor(max_workers=procesos, initializer=iniciar_proceso, initargs=(preparar,))
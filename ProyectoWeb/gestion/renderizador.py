@@ -0,0 +1,54 @@
+"""Renderizado de los comprobantes PDF con la plantilla ya compilada.
+
+La plantilla se compila una sola vez por proceso y :func:`calentar` hace
+un primer renderizado de prueba al arrancar, que deja cargados los
+módulos de xhtml2pdf y reportlab y las métricas de las fuentes estándar.
+Así el primer comprobante de cada proceso no paga ese coste y cada
+comprobante se puede renderizar bajo demanda.
+
+La plantilla no usa fuentes propias ni imágenes, así que no hay más
+recursos que precargar. xhtml2pdf no permite reutilizar una hoja de estilos
+ya analizada entre documentos (la regla ``@page`` de la plantilla configura
+el propio documento al analizarse), así que el CSS se analiza en cada PDF.
+"""
+import functools
+import io
+
+from django.template.loader import get_template
+from xhtml2pdf import pisa
+
+PLANTILLA = 'gestion/pagos/comprobante.html'
+
+
+@functools.lru_cache(maxsize=None)
+def plantilla():
+    """Plantilla del comprobante, compilada una vez por proceso"""
+    return get_template(PLANTILLA)
+
+
+def html_comprobante(pago):
+    return plantilla().render({'pago': pago})
+
+
+def pdf_desde_html(html):
+    """Convierte el HTML del comprobante en PDF con xhtml2pdf"""
+    pdf_io = io.BytesIO()
+    resultado = pisa.CreatePDF(io.BytesIO(html.encode('utf-8')), dest=pdf_io, encoding='utf-8')
+    if resultado.err:
+        raise ValueError(f'xhtml2pdf no pudo generar el PDF ({resultado.err} errores)')
+    return pdf_io.getvalue()
+
+
+def renderizar_comprobante(pago):
+    """PDF del comprobante de ``pago`` en bytes"""
+    return pdf_desde_html(html_comprobante(pago))
+
+
+def calentar():
+    """Compila la plantilla y renderiza un PDF de prueba que se descarta"""
+    pdf_desde_html(plantilla().render({'pago': None}))
+
+
+def vaciar_cache_plantilla():
+    """Olvida la plantilla compilada (p. ej. para medir en frío)"""
+    plantilla.cache_clear()
@@ -0,0 +1,109 @@
+"""Mantenimiento de los resúmenes mensuales de asistencia.
+
+Cada resumen se recalcula por completo para un (horario, año, mes) a partir
+de las asistencias y matrículas, así que recalcular es siempre idempotente.
+"""
+import threading
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from .models import Asistencia, MatriculaHorario, ResumenAsistenciaMensual, Sesion
+
+_pendientes = threading.local()
+
+
+def mes_de(fecha_hora):
+    """``(año, mes)`` de un datetime en la zona horaria actual"""
+    local = timezone.localtime(fecha_hora)
+    return local.year, local.month
+
+
+def limites_mes(anio, mes):
+    """Inicio del mes y del mes siguiente como datetimes con zona horaria"""
+    tz = timezone.get_current_timezone()
+    inicio = datetime(anio, mes, 1, tzinfo=tz)
+    fin = datetime(anio + mes // 12, mes % 12 + 1, 1, tzinfo=tz)
+    return inicio, fin
+
+
+def recalcular_resumen_mes(horario_id, anio, mes):
+    """Recalcula los resúmenes de un horario en un mes.
+
+    Hay fila para cada alumno con asistencias en el mes y para cada alumno con
+    matrícula activa anterior al fin del mes, si el horario tuvo sesiones.
+    """
+    inicio, fin = limites_mes(anio, mes)
+    sesiones = Sesion.objects.filter(horario_id=horario_id, inicio__gte=inicio, inicio__lt=fin).count()
+
+    filas = {}
+    if sesiones:
+        matriculados = MatriculaHorario.objects.filter(
+            horario_id=horario_id, estado='activa', fecha_matricula__lt=fin.date()
+        ).values_list('alumno_id', flat=True)
+        for alumno_id in matriculados:
+            filas[alumno_id] = (0, 0)
+
+        asistencias = Asistencia.objects.filter(
+            sesion__horario_id=horario_id, sesion__inicio__gte=inicio, sesion__inicio__lt=fin
+        ).values('alumno_id').annotate(
+            presentes=Count('id', filter=Q(presente=True)),
+            faltas=Count('id', filter=Q(presente=False)),
+        ).order_by()
+        for fila in asistencias:
+            filas[fila['alumno_id']] = (fila['presentes'], fila['faltas'])
+
+    with transaction.atomic():
+        ResumenAsistenciaMensual.objects.filter(horario_id=horario_id, anio=anio, mes=mes).delete()
+        ResumenAsistenciaMensual.objects.bulk_create([
+            ResumenAsistenciaMensual(
+                alumno_id=alumno_id, horario_id=horario_id, anio=anio, mes=mes,
+                presentes=presentes, faltas=faltas, sesiones=sesiones,
+            )
+            for alumno_id, (presentes, faltas) in filas.items()
+        ])
+
+
+def programar_recalculo(horario_id, anio, mes):
+    """Recalcula el resumen cuando se confirme la transacción en curso.
+
+    Las claves pendientes se agrupan, de modo que guardar muchas asistencias
+    de la misma sesión recalcula el mes una sola vez.
+    """
+    claves = getattr(_pendientes, 'claves', None)
+    if claves is None:
+        claves = _pendientes.claves = set()
+    claves.add((horario_id, anio, mes))
+    transaction.on_commit(_procesar_pendientes)
+
+
+def clave_sesion(sesion_id):
+    """``(horario_id, año, mes)`` de una sesión, cacheado hasta el próximo commit"""
+    cache = getattr(_pendientes, 'sesiones', None)
+    if cache is None:
+        cache = _pendientes.sesiones = {}
+    if sesion_id not in cache:
+        horario_id, inicio = Sesion.objects.values_list('horario_id', 'inicio').get(pk=sesion_id)
+        cache[sesion_id] = (horario_id, *mes_de(inicio))
+    return cache[sesion_id]
+
+
+def _procesar_pendientes():
+    claves = getattr(_pendientes, 'claves', None) or set()
+    _pendientes.claves = set()
+    _pendientes.sesiones = {}
+    for clave in sorted(claves):
+        recalcular_resumen_mes(*clave)
+
+
+def meses_con_sesiones(sesiones_qs):
+    """Conjunto de ``(horario_id, año, mes)`` de las sesiones de ``sesiones_qs``"""
+    return set(
+        sesiones_qs.annotate(anio=ExtractYear('inicio'), mes=ExtractMonth('inicio'))
+        .values_list('horario_id', 'anio', 'mes')
+        .order_by()
+        .distinct()
+    )
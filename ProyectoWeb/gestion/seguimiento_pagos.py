@@ -0,0 +1,48 @@
+"""Último pago y último periodo pagado de cada alumno.
+
+Los datos se guardan desnormalizados en ``Alumno`` y se actualizan en la
+misma transacción en la que se guarda o borra un ``Pago``, de modo que los
+alumnos pendientes de pago salen de una sola consulta indexada.
+"""
+from django.db import transaction
+
+from .models import Alumno, Pago
+
+
+def periodo_de(fecha):
+    """Primer día del mes de ``fecha``"""
+    return fecha.replace(day=1)
+
+
+def actualizar_ultimo_pago(alumno_id):
+    """Recalcula los datos del último pago de un alumno.
+
+    La fila del alumno se bloquea antes de leer sus pagos para que dos pagos
+    simultáneos del mismo alumno no se pisen el resultado.
+    """
+    with transaction.atomic():
+        if not Alumno.objects.select_for_update().filter(pk=alumno_id).exists():
+            return
+        ultimo = (Pago.objects.filter(alumno_id=alumno_id)
+                  .order_by('-fecha', '-id')
+                  .values('id', 'fecha', 'importe_final')
+                  .first())
+        if ultimo is None:
+            Alumno.objects.filter(pk=alumno_id).update(
+                ultimo_pago=None, ultimo_pago_fecha=None, ultimo_pago_importe=None, ultimo_periodo_pagado=None,
+            )
+        else:
+            Alumno.objects.filter(pk=alumno_id).update(
+                ultimo_pago=ultimo['id'],
+                ultimo_pago_fecha=ultimo['fecha'],
+                ultimo_pago_importe=ultimo['importe_final'],
+                ultimo_periodo_pagado=periodo_de(ultimo['fecha']),
+            )
+
+
+def alumnos_pendientes_de_pago(fecha):
+    """Alumnos activos sin ningún pago en el mes de ``fecha``"""
+    return (Alumno.objects
+            .filter(activo=True)
+            .exclude(ultimo_periodo_pagado__gte=periodo_de(fecha))
+            .select_related('ultimo_pago'))
@@ -0,0 +1,109 @@
+"""Señales que mantienen al día los resúmenes de asistencia, el último pago de cada alumno y los KPIs."""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .kpis import invalidar_kpis
+from .models import Alumno, Asistencia, Gasto, Horario, MatriculaHorario, Pago, Sesion
+from .resumenes import clave_sesion, meses_con_sesiones, mes_de, programar_recalculo
+from .seguimiento_pagos import actualizar_ultimo_pago
+
+# Pagos creados con bulk_create, que no envía post_save (argumento ``pagos``)
+pagos_creados_en_bloque = Signal()
+
+
+@receiver(pre_save, sender=Sesion)
+def recordar_mes_sesion(sender, instance, raw=False, **kwargs):
+    """Guarda horario e inicio previos por si la sesión cambia de mes"""
+    instance._mes_anterior = None
+    if raw or instance.pk is None:
+        return
+    anterior = Sesion.objects.filter(pk=instance.pk).values_list('horario_id', 'inicio').first()
+    if anterior:
+        instance._mes_anterior = (anterior[0], *mes_de(anterior[1]))
+
+
+@receiver(post_save, sender=Sesion)
+def sesion_guardada(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    programar_recalculo(instance.horario_id, *mes_de(instance.inicio))
+    anterior = getattr(instance, '_mes_anterior', None)
+    if anterior:
+        programar_recalculo(*anterior)
+
+
+@receiver(post_delete, sender=Sesion)
+def sesion_borrada(sender, instance, **kwargs):
+    programar_recalculo(instance.horario_id, *mes_de(instance.inicio))
+
+
+@receiver(pre_save, sender=Asistencia)
+def recordar_sesion_asistencia(sender, instance, raw=False, **kwargs):
+    """Guarda la sesión previa por si la asistencia pasa a otra sesión (y otro mes)"""
+    instance._sesion_anterior = None
+    if raw or instance.pk is None:
+        return
+    instance._sesion_anterior = Asistencia.objects.filter(pk=instance.pk).values_list('sesion_id', flat=True).first()
+
+
+@receiver(post_save, sender=Asistencia)
+@receiver(post_delete, sender=Asistencia)
+def asistencia_modificada(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    programar_recalculo(*clave_sesion(instance.sesion_id))
+    anterior = getattr(instance, '_sesion_anterior', None)
+    if anterior and anterior != instance.sesion_id:
+        programar_recalculo(*clave_sesion(anterior))
+
+
+@receiver(post_save, sender=MatriculaHorario)
+@receiver(post_delete, sender=MatriculaHorario)
+def matricula_modificada(sender, instance, raw=False, **kwargs):
+    """Una matrícula solo afecta a los meses con sesiones desde el mes actual"""
+    if raw:
+        return
+    inicio_mes = timezone.localtime().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    sesiones = Sesion.objects.filter(horario_id=instance.horario_id, inicio__gte=inicio_mes)
+    for clave in meses_con_sesiones(sesiones):
+        programar_recalculo(*clave)
+
+
+@receiver(pre_save, sender=Pago)
+def recordar_alumno_pago(sender, instance, raw=False, **kwargs):
+    """Guarda el alumno previo por si el pago se reasigna a otro alumno"""
+    instance._alumno_anterior = None
+    if raw or instance.pk is None:
+        return
+    instance._alumno_anterior = Pago.objects.filter(pk=instance.pk).values_list('alumno_id', flat=True).first()
+
+
+@receiver(post_save, sender=Pago)
+def pago_guardado(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    actualizar_ultimo_pago(instance.alumno_id)
+    anterior = getattr(instance, '_alumno_anterior', None)
+    if anterior and anterior != instance.alumno_id:
+        actualizar_ultimo_pago(anterior)
+
+
+@receiver(post_delete, sender=Pago)
+def pago_borrado(sender, instance, **kwargs):
+    actualizar_ultimo_pago(instance.alumno_id)
+
+@receiver(post_save, sender=Alumno)
+@receiver(post_delete, sender=Alumno)
+@receiver(post_save, sender=Pago)
+@receiver(post_delete, sender=Pago)
+@receiver(post_save, sender=Horario)
+@receiver(post_delete, sender=Horario)
+@receiver(post_save, sender=Sesion)
+@receiver(post_delete, sender=Sesion)
+@receiver(post_save, sender=Gasto)
+@receiver(post_delete, sender=Gasto)
+@receiver(pagos_creados_en_bloque, sender=Pago)
+def kpis_modificados(sender, raw=False, **kwargs):
+    if not raw:
+        invalidar_kpis()
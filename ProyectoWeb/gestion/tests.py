@@ -1,3 +1,365 @@
-from django.test import TestCase
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .comprobantes import reclamar_caducados, tomar_pendientes
+from .facturacion import facturar_mes
+from .models import (
+    Alumno, Asistencia, ContadorPago, Horario, MatriculaHorario, Pago, Profesor, ResumenAsistenciaMensual, Sesion,
+    Tarifa,
+)
+from .paginacion import _campos_orden, _codificar_cursor, _decodificar_cursor, paginar_keyset
+
+
+class ContadorPagoTests(TestCase):
+    def setUp(self):
+        self.alumno = Alumno.objects.create(nombre='Ana', apellido='García')
+        self.anio = timezone.localdate().year
+
+    def test_numeros_consecutivos(self):
+        primero = Pago.objects.create(alumno=self.alumno, importe_original=10)
+        segundo = Pago.objects.create(alumno=self.alumno, importe_original=10)
+        self.assertEqual(primero.numero, f'PG-{self.anio}-0001')
+        self.assertEqual(segundo.numero, f'PG-{self.anio}-0002')
+
+    def test_reservar_bloque(self):
+        Pago.objects.create(alumno=self.alumno, importe_original=10)
+        bloque = ContadorPago.reservar(3)
+        self.assertEqual(bloque, [f'PG-{self.anio}-{n:04d}' for n in (2, 3, 4)])
+        self.assertEqual(Pago.objects.create(alumno=self.alumno).numero, f'PG-{self.anio}-0005')
+
+    def test_siguiente_numero_no_reserva(self):
+        Pago.objects.create(alumno=self.alumno)
+        self.assertEqual(Pago.generar_siguiente_numero(), f'PG-{self.anio}-0002')
+        self.assertEqual(Pago.generar_siguiente_numero(), f'PG-{self.anio}-0002')
+        self.assertEqual(Pago.objects.create(alumno=self.alumno).numero, f'PG-{self.anio}-0002')
+
+    def test_numero_manual_adelanta_el_contador(self):
+        Pago.objects.create(alumno=self.alumno, numero=f'PG-{self.anio}-0100')
+        self.assertEqual(Pago.objects.create(alumno=self.alumno).numero, f'PG-{self.anio}-0101')
+
+    def test_reserva_deshecha_no_deja_hueco(self):
+        Pago.objects.create(alumno=self.alumno)
+        try:
+            with transaction.atomic():
+                ContadorPago.reservar(5)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(Pago.objects.create(alumno=self.alumno).numero, f'PG-{self.anio}-0002')
+
+
+class FacturacionTests(TestCase):
+    def setUp(self):
+        tarifa = Tarifa.objects.create(nombre='Mensual', precio=50)
+        self.alumnos = [
+            Alumno.objects.create(nombre=f'Alumno {i}', apellido='López', tarifa_predeterminada=tarifa)
+            for i in range(3)
+        ]
+        Alumno.objects.create(nombre='Sin tarifa', apellido='López')
+        Alumno.objects.create(nombre='Baja', apellido='López', activo=False, tarifa_predeterminada=tarifa)
+        self.hoy = timezone.localdate()
+
+    def test_factura_solo_pendientes_con_numeros_consecutivos(self):
+        Pago.objects.create(alumno=self.alumnos[0], importe_original=50)
+        pagos = facturar_mes(self.hoy)
+        self.assertEqual({pago.alumno_id for pago in pagos}, {self.alumnos[1].pk, self.alumnos[2].pk})
+        self.assertEqual([pago.numero for pago in pagos],
+                         [ContadorPago.formatear(self.hoy.year, n) for n in (2, 3)])
+        self.assertEqual(Alumno.objects.get(pk=self.alumnos[1].pk).ultimo_pago_id, pagos[0].pk)
+
+    def test_volver_a_facturar_no_duplica(self):
+        self.assertEqual(len(facturar_mes(self.hoy)), 3)
+        self.assertEqual(facturar_mes(self.hoy), [])
+        self.assertEqual(Pago.objects.count(), 3)
+
+    def test_mes_futuro(self):
+        with self.assertRaises(ValueError):
+            facturar_mes(self.hoy.replace(day=1) + timedelta(days=31))
+
+    def test_mes_pasado(self):
+        with self.assertRaises(ValueError):
+            facturar_mes(self.hoy.replace(day=1) - timedelta(days=1))
+        self.assertFalse(Pago.objects.exists())
+        self.assertIsNone(Alumno.objects.get(pk=self.alumnos[0].pk).ultimo_periodo_pagado)
+
+
+class AlumnoUltimoPagoTests(TestCase):
+    def test_guardar_alumno_antiguo_no_pisa_el_ultimo_pago(self):
+        alumno = Alumno.objects.create(nombre='Ana', apellido='García')
+        antiguo = Alumno.objects.get(pk=alumno.pk)
+        pago = Pago.objects.create(alumno=alumno, importe_original=10)
+        antiguo.telefono = '600000000'
+        antiguo.save()
+        alumno.refresh_from_db()
+        self.assertEqual(alumno.telefono, '600000000')
+        self.assertEqual(alumno.ultimo_pago_id, pago.pk)
+        self.assertEqual(alumno.ultimo_pago_importe, 10)
+
+
+class ColaComprobantesTests(TestCase):
+    def setUp(self):
+        alumno = Alumno.objects.create(nombre='Ana', apellido='García')
+        self.pagos = [Pago.objects.create(alumno=alumno, importe_original=10) for _ in range(3)]
+
+    def test_tomar_pendientes(self):
+        Pago.objects.filter(pk__in=[self.pagos[0].pk, self.pagos[2].pk]).update(estado_comprobante='pendiente')
+        self.assertEqual(tomar_pendientes(1), [self.pagos[0].pk])
+        self.assertEqual(tomar_pendientes(5), [self.pagos[2].pk])
+        self.assertEqual(tomar_pendientes(5), [])
+        self.assertFalse(Pago.objects.filter(estado_comprobante='generando', inicio_comprobante__isnull=True).exists())
+
+    def test_reclamar_caducados(self):
+        ahora = timezone.now()
+        Pago.objects.filter(pk=self.pagos[0].pk).update(estado_comprobante='generando',
+                                                         inicio_comprobante=ahora - timedelta(days=1))
+        Pago.objects.filter(pk=self.pagos[1].pk).update(estado_comprobante='generando', inicio_comprobante=ahora)
+        self.assertEqual(reclamar_caducados(ahora), 1)
+        self.assertEqual(Pago.objects.get(pk=self.pagos[0].pk).estado_comprobante, 'pendiente')
+        self.assertEqual(Pago.objects.get(pk=self.pagos[1].pk).estado_comprobante, 'generando')
+
+
+class PaginacionKeysetTests(TestCase):
+    """Recorrer todas las páginas en los dos sentidos, con empates en las claves"""
+
+    POR_PAGINA = 7
+
+    @classmethod
+    def setUpTestData(cls):
+        hoy = timezone.localdate()
+        for i in range(6):
+            alumno = Alumno.objects.create(nombre=f'N{i % 2}', apellido=f'A{i % 3}')
+            for _ in range(5):
+                Pago.objects.create(alumno=alumno, importe_original=10)
+        # Tres fechas con muchos pagos cada una: empates en la primera clave
+        for pago in Pago.objects.all():
+            Pago.objects.filter(pk=pago.pk).update(fecha=hoy - timedelta(days=pago.pk % 3))
+
+    def _pagina(self, queryset, orden, url=''):
+        return paginar_keyset(RequestFactory().get('/' + url), queryset, orden, por_pagina=self.POR_PAGINA)
+
+    def _seguir(self, primera, enlace, abrir):
+        """Páginas desde ``primera`` siguiendo ``enlace`` hasta que no haya más"""
+        paginas = [primera]
+        while getattr(paginas[-1], enlace):
+            self.assertLess(len(paginas), Pago.objects.count(), 'La paginación no termina')
+            paginas.append(abrir(getattr(paginas[-1], enlace)))
+        return paginas
+
+    def _recorrer(self, queryset, orden):
+        """Páginas hacia delante y, desde la última, hacia atrás"""
+        def abrir(url):
+            return self._pagina(queryset, orden, url)
+
+        adelante = self._seguir(self._pagina(queryset, orden), 'url_siguiente', abrir)
+        atras = self._seguir(adelante[-1], 'url_anterior', abrir)[::-1]
+        return [[obj.pk for obj in pagina] for pagina in adelante], [[obj.pk for obj in pagina] for pagina in atras]
+
+    def _comprobar(self, queryset, orden):
+        esperado = list(queryset.order_by(*orden).values_list('pk', flat=True))
+        adelante, atras = self._recorrer(queryset, orden)
+        self.assertEqual([pk for pagina in adelante for pk in pagina], esperado)
+        self.assertEqual(atras, adelante)
+        self.assertTrue(all(len(pagina) == self.POR_PAGINA for pagina in adelante[:-1]))
+
+    def test_orden_descendente(self):
+        self._comprobar(Pago.objects.all(), ('-fecha', '-id'))
+
+    def test_orden_mixto(self):
+        self._comprobar(Pago.objects.all(), ('-fecha', 'id'))
+
+    def test_orden_ascendente_con_empates(self):
+        self._comprobar(Alumno.objects.all(), ('apellido', 'nombre', 'id'))
+
+    def test_formato_del_cursor(self):
+        campos = _campos_orden(('-fecha', '-id'))
+        self.assertEqual(campos, [('fecha', True), ('id', True)])
+        fecha = timezone.localdate()
+        cursor = _codificar_cursor([fecha, 42])
+        self.assertRegex(cursor, r'^[A-Za-z0-9_=-]+$')
+        self.assertEqual(_decodificar_cursor(Pago, campos, cursor), [fecha, 42])
+
+    def test_cursores_no_validos(self):
+        primera = [pago.pk for pago in self._pagina(Pago.objects.all(), ('-fecha', '-id'))]
+        campos = _campos_orden(('-fecha', '-id'))
+        invalidos = [
+            'no-es-base64!',
+            'ñ',
+            _codificar_cursor({'fecha': '2024-01-01'}),
+            _codificar_cursor(['2024-01-01']),
+            _codificar_cursor(['no es fecha', 1]),
+            _codificar_cursor(['2024-01-01', 'x']),
+        ]
+        for cursor in invalidos:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(_decodificar_cursor(Pago, campos, cursor))
+                for parametro in ('despues', 'antes'):
+                    pagina = paginar_keyset(RequestFactory().get('/', {parametro: cursor}),
+                                            Pago.objects.all(), ('-fecha', '-id'), por_pagina=self.POR_PAGINA)
+                    self.assertEqual([pago.pk for pago in pagina], primera)
+                    self.assertFalse(pagina.tiene_anterior)
+
+    @mock.patch('gestion.views.paginar_keyset', functools.partial(paginar_keyset, por_pagina=POR_PAGINA))
+    def test_listado_de_pagos(self):
+        self.client.force_login(User.objects.create_user('admin', password='x'))
+        url = reverse('gestion:pagos')
+        esperado = list(Pago.objects.order_by('-fecha', '-id').values_list('pk', flat=True))
+
+        def abrir(enlace=''):
+            return self.client.get(url + enlace).context['pagina']
+
+        paginas = self._seguir(abrir(), 'url_siguiente', abrir)
+        self.assertGreater(len(paginas), 2)
+        vistos = [pago.pk for pagina in paginas for pago in pagina]
+        self.assertEqual(vistos, esperado)
+
+        atras = self._seguir(paginas[-1], 'url_anterior', abrir)
+        self.assertEqual([[p.pk for p in pagina] for pagina in reversed(atras)],
+                         [[p.pk for p in pagina] for pagina in paginas])
+
+        respuesta = self.client.get(url, {'despues': '%%%'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([pago.pk for pago in respuesta.context['pagina']], esperado[:len(respuesta.context['pagina'])])
+
+
+class ResumenAsistenciaTests(TestCase):
+    """Los resúmenes mantenidos por las señales coinciden con recalcularlos desde cero"""
+
+    def setUp(self):
+        profesor = Profesor.objects.create(user=User.objects.create_user('profe'))
+        self.horario = Horario.objects.create(profesor=profesor, asignatura='Matemáticas', dia_semana=1,
+                                              hora_inicio='10:00', hora_fin='11:00')
+        self.alumnos = [Alumno.objects.create(nombre=f'Alumno {i}', apellido='López') for i in range(3)]
+        for alumno in self.alumnos[:2]:
+            MatriculaHorario.objects.create(alumno=alumno, horario=self.horario)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.enero = self._sesion(2025, 1, 15)
+            self.febrero = self._sesion(2025, 2, 12)
+
+    def _sesion(self, anio, mes, dia):
+        inicio = timezone.make_aware(datetime(anio, mes, dia, 10))
+        return Sesion.objects.create(horario=self.horario, inicio=inicio, fin=inicio + timedelta(hours=1))
+
+    def _resumenes(self):
+        return sorted(ResumenAsistenciaMensual.objects.values_list(
+            'alumno_id', 'horario_id', 'anio', 'mes', 'presentes', 'faltas', 'sesiones'))
+
+    def _comprobar(self):
+        incremental = self._resumenes()
+        call_command('recalcular_resumen_asistencias', stdout=StringIO())
+        self.assertEqual(incremental, self._resumenes())
+        return incremental
+
+    def _asistencias(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return [
+                Asistencia.objects.create(sesion=sesion, alumno=alumno, presente=presente)
+                for sesion in (self.enero, self.febrero)
+                for alumno, presente in zip(self.alumnos, (True, False, True))
+            ]
+
+    def test_crear(self):
+        self._asistencias()
+        self.assertEqual(len(self._comprobar()), 6)
+
+    def test_mover_asistencia_de_mes(self):
+        asistencia = self._asistencias()[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            asistencia.sesion = self._sesion(2025, 3, 5)
+            asistencia.save()
+        self._comprobar()
+
+    def test_mover_sesion_de_mes(self):
+        self._asistencias()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.enero.inicio += timedelta(days=60)
+            self.enero.fin += timedelta(days=60)
+            self.enero.save()
+        self._comprobar()
+
+    def test_borrar(self):
+        asistencias = self._asistencias()
+        with self.captureOnCommitCallbacks(execute=True):
+            asistencias[0].delete()
+            asistencias[4].delete()
+        self._comprobar()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.febrero.delete()
+        self._comprobar()
+
+    def test_transaccion_deshecha(self):
+        asistencias = self._asistencias()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    # Cambios que se deshacen: la sesión nunca llega a moverse
+                    self.enero.inicio += timedelta(days=60)
+                    self.enero.save()
+                    asistencias[0].presente = False
+                    asistencias[0].save()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.enero.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            asistencias[1].presente = True
+            asistencias[1].save()
+        self._comprobar()
+
+
+class ContadorPagoConcurrenciaTests(TransactionTestCase):
+    """Muchos hilos reservando a la vez no repiten ni saltan números"""
+
+    HILOS = 8
+    POR_HILO = 10
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Los hilos necesitan una base de datos compartida (no SQLite en memoria)')
+        self.alumno = Alumno.objects.create(nombre='Ana', apellido='García')
+        self.anio = timezone.localdate().year
+
+    def _en_paralelo(self, funcion):
+        barrera = threading.Barrier(self.HILOS)
+
+        def hilo(_):
+            barrera.wait()
+            try:
+                return funcion()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.HILOS) as pool:
+            return [numero for numeros in pool.map(hilo, range(self.HILOS)) for numero in numeros]
+
+    def test_pagos_simultaneos(self):
+        def crear_pagos():
+            return [Pago.objects.create(alumno_id=self.alumno.pk, importe_original=10).numero
+                    for _ in range(self.POR_HILO)]
+
+        numeros = self._en_paralelo(crear_pagos)
+        total = self.HILOS * self.POR_HILO
+        self.assertEqual(sorted(numeros), [ContadorPago.formatear(self.anio, n) for n in range(1, total + 1)])
+        self.assertEqual(Pago.objects.count(), total)
+
+    def test_bloques_y_pagos_simultaneos(self):
+        def reservar_y_crear():
+            numeros = []
+            for _ in range(self.POR_HILO // 2):
+                numeros += ContadorPago.reservar(5)
+                numeros.append(Pago.objects.create(alumno_id=self.alumno.pk).numero)
+            return numeros
+
+        numeros = self._en_paralelo(reservar_y_crear)
+        total = self.HILOS * (self.POR_HILO // 2) * 6
+        self.assertEqual(sorted(numeros), [ContadorPago.formatear(self.anio, n) for n in range(1, total + 1)])
@@ -2,57 +2,49 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
-from django.db.models import Sum, Q, Count
+from django.db.models import Sum, Q, Count, OuterRef, Subquery
 from django.utils.dateparse import parse_date
 from django.http import JsonResponse
 
-from .models import Alumno, Pago, Horario, Sesion, Profesor, Gasto
+from .models import Alumno, Pago, Horario, Sesion, Profesor, Gasto, Asistencia
+from .estadisticas import (
+    resumen_alumnos, anotar_estadisticas_alumnos, estadisticas_alumnos,
+    resumen_horarios, anotar_estadisticas_horarios, estadisticas_horarios,
+    resumen_sesiones, anotar_estadisticas_sesiones, estadisticas_sesiones,
+)
+from .paginacion import paginar_keyset
+from .matriz_asistencia import cargar_matriz_asistencia
+from .conciliacion import conciliar_asistencias
+from .kpis import obtener_kpis
+from .seguimiento_pagos import alumnos_pendientes_de_pago
 
 @login_required(login_url='login:login')
 def inicio(request):
     """Dashboard principal con estadísticas"""
-    # Contar registros
-    alumnos_count = Alumno.objects.filter(activo=True).count()
-    pagos_count = Pago.objects.count()
-    horarios_count = Horario.objects.filter(activo=True).count()
-    sesiones_count = Sesion.objects.count()
-    gastos_count = Gasto.objects.count()
-    
-    # Estadísticas de pagos del mes actual
-    now = timezone.now()
-    pagos_mes = Pago.objects.filter(
-        fecha__month=now.month,
-        fecha__year=now.year
-    ).aggregate(total=Sum('importe_final'))['total'] or 0
-    
-    # Gastos del mes actual
-    gastos_mes = Gasto.objects.filter(
-        fecha_gasto__month=now.month,
-        fecha_gasto__year=now.year
-    ).aggregate(total=Sum('importe'))['total'] or 0
+    # Cifras cacheadas (se invalidan al modificar los datos)
+    kpis = obtener_kpis()
     
     # Balance del mes (ingresos - gastos)
-    balance_mes = pagos_mes - gastos_mes
+    balance_mes = kpis['pagos_mes'] - kpis['gastos_mes']
     
     context = {
         'titulo': 'Dashboard de Gestión',
-        'alumnos_count': alumnos_count,
-        'pagos_count': pagos_count,
-        'horarios_count': horarios_count,
-        'sesiones_count': sesiones_count,
-        'gastos_count': gastos_count,
-        'pagos_mes': pagos_mes,
-        'gastos_mes': gastos_mes,
+        'alumnos_count': kpis['alumnos_count'],
+        'pagos_count': kpis['pagos_count'],
+        'horarios_count': kpis['horarios_count'],
+        'sesiones_count': kpis['sesiones_count'],
+        'gastos_count': kpis['gastos_count'],
+        'pagos_mes': kpis['pagos_mes'],
+        'gastos_mes': kpis['gastos_mes'],
         'balance_mes': balance_mes,
+        'kpis_generados': kpis['generado'],
+        'kpis_antiguedad': int((timezone.now() - kpis['generado']).total_seconds()),
     }
     return render(request, 'gestion/inicio.html', context)
 
 @login_required(login_url='login:login')
 def alumnos(request):
     """Gestión de alumnos con estadísticas completas"""
-    from .models import Alumno
-    from django.db.models import Count, Sum, Q
-    
     # Obtener mes y año actual para filtros
     now = timezone.now()
     mes_actual = now.month
@@ -96,79 +88,20 @@ def alumnos(request):
         )
     
     # Estadísticas específicas
-    total_alumnos = alumnos_totales.count()
-    alumnos_activos = alumnos_totales.filter(activo=True).count()
-    alumnos_compartidos = alumnos_totales.filter(activo=True, es_compartido=True).count()
-    
-    # Anotar estadísticas para cada alumno
-    alumnos_con_stats = []
-    for alumno in alumnos_qs:
-        # Horarios matriculados activos
-        horarios_matriculados = alumno.matriculas.filter(estado='activa').count()
-        
-        # Asistencias totales (este mes)
-        asistencias_este_mes = alumno.asistencias.filter(
-            sesion__inicio__month=mes_actual,
-            sesion__inicio__year=año_actual,
-            presente=True
-        ).count()
-        
-        # No asistencias totales (este mes)
-        no_asistencias_este_mes = alumno.asistencias.filter(
-            sesion__inicio__month=mes_actual,
-            sesion__inicio__year=año_actual,
-            presente=False
-        ).count()
-        
-        # Total de sesiones este mes
-        total_sesiones_mes = alumno.asistencias.filter(
-            sesion__inicio__month=mes_actual,
-            sesion__inicio__year=año_actual
-        ).count()
-        
-        # Porcentaje de asistencia este mes
-        porcentaje_asistencia = 0
-        if total_sesiones_mes > 0:
-            porcentaje_asistencia = round((asistencias_este_mes / total_sesiones_mes) * 100, 1)
-        
-        # Pagos este mes
-        pagos_este_mes = alumno.pago_set.filter(
-            fecha__month=mes_actual,
-            fecha__year=año_actual
-        ).aggregate(
-            total_pagado=Sum('importe_final')
-        )['total_pagado'] or 0
-        
-        # Último pago
-        ultimo_pago = alumno.pago_set.order_by('-fecha').first()
-        
-        # Próxima sesión
-        proxima_sesion = None
-        for matricula in alumno.matriculas.filter(estado='activa'):
-            proxima = matricula.horario.sesiones.filter(
-                inicio__gte=now
-            ).order_by('inicio').first()
-            if proxima and (proxima_sesion is None or proxima.inicio < proxima_sesion.inicio):
-                proxima_sesion = proxima
-        
-        alumnos_con_stats.append({
-            'alumno': alumno,
-            'horarios_matriculados': horarios_matriculados,
-            'asistencias_este_mes': asistencias_este_mes,
-            'no_asistencias_este_mes': no_asistencias_este_mes,
-            'total_sesiones_mes': total_sesiones_mes,
-            'porcentaje_asistencia': porcentaje_asistencia,
-            'pagos_este_mes': pagos_este_mes,
-            'ultimo_pago': ultimo_pago,
-            'proxima_sesion': proxima_sesion,
-        })
+    resumen = resumen_alumnos(alumnos_totales)
+    total_alumnos = resumen['total']
+    alumnos_activos = resumen['activos']
+    alumnos_compartidos = resumen['compartidos']
     
-    # Ordenar por apellido
-    alumnos_con_stats.sort(key=lambda x: (x['alumno'].apellido, x['alumno'].nombre))
+    # Anotar estadísticas para los alumnos de la página, ordenados por apellido
+    pagina = paginar_keyset(request, anotar_estadisticas_alumnos(alumnos_qs, now), ('apellido', 'nombre', 'id'))
+    alumnos_con_stats = estadisticas_alumnos(pagina, now)
     
     context = {
         'titulo': 'Gestión de Alumnos',
         'alumnos': alumnos_con_stats,
+        'pagina': pagina,
+        'total_registros': alumnos_qs.count(),
         'total_alumnos': total_alumnos,
         'alumnos_activos': alumnos_activos,
         'alumnos_compartidos': alumnos_compartidos,
@@ -186,11 +119,8 @@ def alumnos(request):
 @login_required(login_url='login:login')
 def pagos(request):
     """Listado y resumen de pagos con filtros básicos"""
-    from .models import Alumno
-    from datetime import datetime
-    
     pagos_all = (Pago.objects
-                .select_related('alumno', 'profesor')
+                .select_related('alumno', 'profesor__user')
                 .order_by('-fecha', '-id'))
 
     # Totales globales (sin filtros)
@@ -202,22 +132,10 @@ def pagos(request):
     año_actual = now.year
 
     # Alumnos pendientes de pago (que NO tienen pagos en el mes actual)
-    alumnos_activos = Alumno.objects.filter(activo=True)
-    alumnos_con_pago_mes = pagos_all.filter(
-        fecha__month=mes_actual,
-        fecha__year=año_actual
-    ).values_list('alumno_id', flat=True).distinct()
-    
-    alumnos_pendientes_raw = alumnos_activos.exclude(id__in=alumnos_con_pago_mes)
-    
-    # Añadir información del último pago para cada alumno pendiente
-    alumnos_pendientes = []
-    for alumno in alumnos_pendientes_raw:
-        ultimo_pago = alumno.pago_set.order_by('-fecha').first()
-        alumnos_pendientes.append({
-            'alumno': alumno,
-            'ultimo_pago': ultimo_pago,
-        })
+    alumnos_pendientes = [
+        {'alumno': alumno, 'ultimo_pago': alumno.ultimo_pago}
+        for alumno in alumnos_pendientes_de_pago(now.date())
+    ]
 
     # Filtros GET
     q = (request.GET.get('q') or '').strip()
@@ -256,14 +174,19 @@ def pagos(request):
 
     hoy = timezone.localdate()
     total_hoy = pagos_qs.filter(fecha=hoy).aggregate(total=Sum('importe_final'))['total'] or 0
-    total_filtrado = pagos_qs.aggregate(total=Sum('importe_final'))['total'] or 0
+    filtrado = pagos_qs.aggregate(total=Sum('importe_final'), registros=Count('id'))
+    total_filtrado = filtrado['total'] or 0
+
+    pagina = paginar_keyset(request, pagos_qs, ('-fecha', '-id'))
 
     context = {
         'titulo': 'Gestión de Pagos',
-        'pagos': pagos_qs,
+        'pagos': pagina.objetos,
+        'pagina': pagina,
         'alumnos_pendientes': alumnos_pendientes,
         'total_hoy': total_hoy,
         'total_filtrado': total_filtrado,
+        'total_registros': filtrado['registros'],
         'total_general_all': total_general_all,
         'fecha_hoy': hoy,
         'mes_actual': mes_actual,
@@ -305,9 +228,6 @@ def get_alumnos_por_horario(request):
 @login_required(login_url='login:login')
 def horarios(request):
     """Gestión de horarios con estadísticas completas"""
-    from .models import Horario
-    from django.db.models import Count, Sum, Q
-    
     # Obtener mes y año actual para filtros
     now = timezone.now()
     mes_actual = now.month
@@ -366,87 +286,23 @@ def horarios(request):
         horarios_totales = horarios_totales.filter(id=horario_id)
     
     # Estadísticas específicas
-    total_horarios = horarios_totales.count()
-    horarios_activos = horarios_totales.filter(activo=True).count()
+    resumen = resumen_horarios(horarios_totales)
+    total_horarios = resumen['total']
+    horarios_activos = resumen['activos']
     
     # Sesiones este mes (suma de todas las sesiones de los horarios filtrados)
-    total_sesiones_este_mes = 0
-    print(f"DEBUG: Calculando sesiones para mes {mes_actual}/{año_actual}")
-    print(f"DEBUG: Horarios totales a revisar: {horarios_totales.count()}")
-    
-    for horario in horarios_totales:
-        sesiones_horario = horario.sesiones.filter(
-            inicio__month=mes_actual,
-            inicio__year=año_actual
-        ).count()
-        total_sesiones_este_mes += sesiones_horario
-        print(f"DEBUG: Horario {horario.asignatura} - {horario.get_dia_semana_display()} tiene {sesiones_horario} sesiones este mes")
-    
-    print(f"DEBUG: Total sesiones este mes: {total_sesiones_este_mes}")
-    
-    # Alternativa: Calcular directamente desde el modelo Sesion
-    from .models import Sesion
-    total_sesiones_este_mes_alt = Sesion.objects.filter(
+    total_sesiones_este_mes = Sesion.objects.filter(
         horario__in=horarios_totales,
         inicio__month=mes_actual,
         inicio__year=año_actual
     ).count()
-    print(f"DEBUG: Total sesiones (método alternativo): {total_sesiones_este_mes_alt}")
-    
-    # Usar el método más eficiente
-    total_sesiones_este_mes = total_sesiones_este_mes_alt
-    
-    # Anotar estadísticas para cada horario
-    horarios_con_stats = []
-    for horario in horarios_qs:
-        # Alumnos matriculados activamente
-        alumnos_matriculados = horario.matriculas.filter(estado='activa').count()
-        
-        # Sesiones este mes para este horario específico
-        sesiones_este_mes_horario = horario.sesiones.filter(
-            inicio__month=mes_actual,
-            inicio__year=año_actual
-        ).count()
-        
-        # Asistencias totales este mes
-        asistencias_este_mes = horario.sesiones.filter(
-            inicio__month=mes_actual,
-            inicio__year=año_actual
-        ).aggregate(
-            total_asistencias=Count('asistencias__id', filter=Q(asistencias__presente=True))
-        )['total_asistencias'] or 0
-        
-        # Próxima sesión
-        proxima_sesion = horario.sesiones.filter(
-            inicio__gte=now
-        ).order_by('inicio').first()
-        
-        # Última sesión
-        ultima_sesion = horario.sesiones.filter(
-            inicio__lt=now
-        ).order_by('-inicio').first()
-        
-        # Ocupación del aula (porcentaje de capacidad)
-        ocupacion = 0
-        if horario.capacidad > 0:
-            ocupacion = round((alumnos_matriculados / horario.capacidad) * 100, 1)
-        
-        horarios_con_stats.append({
-            'horario': horario,
-            'alumnos_matriculados': alumnos_matriculados,
-            'sesiones_este_mes': sesiones_este_mes_horario,
-            'asistencias_este_mes': asistencias_este_mes,
-            'proxima_sesion': proxima_sesion,
-            'ultima_sesion': ultima_sesion,
-            'ocupacion': ocupacion,
-        })
     
-    # Ordenar por día de la semana y hora de inicio
-    horarios_con_stats.sort(key=lambda x: (x['horario'].dia_semana, x['horario'].hora_inicio))
+    # Anotar estadísticas para cada horario de la página, por día de la semana y hora de inicio
+    pagina = paginar_keyset(request, anotar_estadisticas_horarios(horarios_qs, now), ('dia_semana', 'hora_inicio', 'id'))
+    horarios_con_stats = estadisticas_horarios(pagina, now)
     
     # Obtener lista de profesores para el filtro
-    from .models import Profesor
-    profesores = Profesor.objects.filter(activo=True).order_by('user__first_name', 'user__last_name')
+    profesores = Profesor.objects.filter(activo=True).select_related('user').order_by('user__first_name', 'user__last_name')
     
     # Obtener lista de todos los horarios para el filtro de horario específico
     todos_horarios = Horario.objects.filter(activo=True).order_by('asignatura', 'dia_semana', 'hora_inicio')
@@ -454,6 +310,8 @@ def horarios(request):
     context = {
         'titulo': 'Gestión de Horarios',
         'horarios': horarios_con_stats,
+        'pagina': pagina,
+        'total_registros': horarios_qs.count(),
         'profesores': profesores,
         'todos_horarios': todos_horarios,  # Lista para el filtro de horario específico
         'total_horarios': total_horarios,
@@ -474,10 +332,6 @@ def horarios(request):
 @login_required(login_url='login:login')
 def sesiones(request):
     """Gestión de sesiones con estadísticas completas"""
-    from .models import Sesion, Horario
-    from django.db.models import Count, Q
-    from django.utils import timezone
-    
     # Obtener mes y año actual para filtros
     now = timezone.now()
     mes_actual = now.month
@@ -535,60 +389,25 @@ def sesiones(request):
         sesiones_totales = sesiones_totales.filter(horario__profesor_id=profesor_id)
     
     # Estadísticas específicas
-    total_sesiones = sesiones_totales.count()
-    sesiones_pasadas = sesiones_totales.filter(inicio__lt=now).count()
-    sesiones_futuras = sesiones_totales.filter(inicio__gte=now).count()
-    sesiones_hoy = sesiones_totales.filter(inicio__date=now.date()).count()
-    
-    # Anotar estadísticas para cada sesión
-    sesiones_con_stats = []
-    for sesion in sesiones_qs:
-        # Alumnos matriculados activamente en el horario
-        alumnos_matriculados = sesion.horario.matriculas.filter(estado='activa').count()
-        
-        # Asistencias de la sesión
-        asistencias_sesion = sesion.asistencias.filter(
-            alumno__matriculas__horario=sesion.horario,
-            alumno__matriculas__estado='activa'
-        )
-        total_asistencias = asistencias_sesion.count()
-        asistencias_presentes = asistencias_sesion.filter(presente=True).count()
-        asistencias_faltas = asistencias_sesion.filter(presente=False).count()
-        
-        # Porcentaje de asistencia
-        porcentaje_asistencia = 0
-        if total_asistencias > 0:
-            porcentaje_asistencia = round((asistencias_presentes / total_asistencias) * 100, 1)
-        
-        # Estado de la sesión
-        if sesion.inicio < now:
-            estado_sesion = 'pasada'
-        elif sesion.inicio.date() == now.date():
-            estado_sesion = 'hoy'
-        else:
-            estado_sesion = 'futura'
-        
-        sesiones_con_stats.append({
-            'sesion': sesion,
-            'alumnos_matriculados': alumnos_matriculados,
-            'total_asistencias': total_asistencias,
-            'asistencias_presentes': asistencias_presentes,
-            'asistencias_faltas': asistencias_faltas,
-            'porcentaje_asistencia': porcentaje_asistencia,
-            'estado_sesion': estado_sesion,
-        })
+    resumen = resumen_sesiones(sesiones_totales, now)
+    total_sesiones = resumen['total']
+    sesiones_pasadas = resumen['pasadas']
+    sesiones_futuras = resumen['futuras']
+    sesiones_hoy = resumen['hoy']
     
-    # Ordenar por fecha de inicio (más recientes primero)
-    sesiones_con_stats.sort(key=lambda x: x['sesion'].inicio, reverse=True)
+    # Anotar estadísticas para cada sesión de la página (más recientes primero)
+    pagina = paginar_keyset(request, anotar_estadisticas_sesiones(sesiones_qs), ('-inicio', 'id'))
+    sesiones_con_stats = estadisticas_sesiones(pagina, now)
     
     # Obtener listas para filtros
     horarios = Horario.objects.filter(activo=True).order_by('asignatura')
-    from .models import Profesor
-    profesores = Profesor.objects.filter(activo=True).order_by('user__first_name', 'user__last_name')
+    profesores = Profesor.objects.filter(activo=True).select_related('user').order_by('user__first_name', 'user__last_name')
     
     context = {
         'titulo': 'Gestión de Sesiones',
         'sesiones': sesiones_con_stats,
+        'pagina': pagina,
+        'total_registros': sesiones_qs.count(),
         'horarios': horarios,
         'profesores': profesores,
         'mes_actual': mes_actual,
@@ -636,15 +455,15 @@ def detalle_alumno(request, alumno_id):
     horarios_matriculados = alumno.matriculas.filter(estado='activa')
     total_horarios = horarios_matriculados.count()
     
-    # Asistencias del mes actual
-    asistencias_mes = alumno.asistencias.filter(
-        sesion__inicio__month=mes_actual,
-        sesion__inicio__year=año_actual
-    ).order_by('-sesion__inicio')
+    # Asistencias del mes actual (resúmenes mensuales por horario)
+    asistencias_mes = alumno.resumenes_asistencia.filter(
+        anio=año_actual,
+        mes=mes_actual
+    ).aggregate(presentes=Sum('presentes'), faltas=Sum('faltas'))
     
-    asistencias_presente = asistencias_mes.filter(presente=True).count()
-    asistencias_faltas = asistencias_mes.filter(presente=False).count()
-    total_sesiones_mes = asistencias_mes.count()
+    asistencias_presente = asistencias_mes['presentes'] or 0
+    asistencias_faltas = asistencias_mes['faltas'] or 0
+    total_sesiones_mes = asistencias_presente + asistencias_faltas
     
     porcentaje_asistencia = 0
     if total_sesiones_mes > 0:
@@ -665,21 +484,23 @@ def detalle_alumno(request, alumno_id):
         sesion__inicio__gte=tres_meses_atras
     ).order_by('-sesion__inicio')
     
-    # Próximas sesiones
-    proximas_sesiones = []
-    for matricula in horarios_matriculados:
-        proxima = matricula.horario.sesiones.filter(
-            inicio__gte=now
-        ).order_by('inicio').first()
-        if proxima:
-            proximas_sesiones.append({
-                'sesion': proxima,
-                'horario': matricula.horario,
-                'matricula': matricula
-            })
-    
-    # Ordenar por fecha de sesión
-    proximas_sesiones.sort(key=lambda x: x['sesion'].inicio)
+    # Próximas sesiones (la siguiente de cada horario, en una sola consulta)
+    matriculas_por_horario = {
+        matricula.horario_id: matricula
+        for matricula in horarios_matriculados.select_related('horario__profesor__user')
+    }
+    proximas = Sesion.objects.filter(
+        horario__in=matriculas_por_horario,
+        inicio__gte=now,
+    ).contiguas(now).order_by('inicio', 'id')
+    proximas_sesiones = [
+        {
+            'sesion': proxima,
+            'horario': matriculas_por_horario[proxima.horario_id].horario,
+            'matricula': matriculas_por_horario[proxima.horario_id],
+        }
+        for proxima in proximas
+    ]
     
     # Historial de asistencias (últimos 6 meses)
     seis_meses_atras = now - timedelta(days=180)
@@ -710,12 +531,8 @@ def detalle_alumno(request, alumno_id):
 @login_required(login_url='login:login')
 def detalle_horario(request, horario_id):
     """Vista detallada de un horario específico"""
-    from .models import Horario
-    from django.db.models import Count, Sum, Q
-    from datetime import timedelta
-    
     try:
-        horario = Horario.objects.get(id=horario_id)
+        horario = Horario.objects.select_related('profesor__user').get(id=horario_id)
     except Horario.DoesNotExist:
         messages.error(request, 'Horario no encontrado.')
         return redirect('gestion:horarios')
@@ -726,49 +543,45 @@ def detalle_horario(request, horario_id):
     año_actual = now.year
     
     # Estadísticas del horario
-    matriculas_activas = horario.matriculas.filter(estado='activa')
-    total_alumnos = matriculas_activas.count()
+    matriculas_activas = list(
+        horario.matriculas.filter(estado='activa').select_related('alumno').order_by('alumno__apellido', 'alumno__nombre', 'id')
+    )
+    total_alumnos = len(matriculas_activas)
     
     # Ocupación del aula
     ocupacion = 0
     if horario.capacidad > 0:
         ocupacion = round((total_alumnos / horario.capacidad) * 100, 1)
     
-    # Sesiones del mes actual
-    sesiones_mes = horario.sesiones.filter(
-        inicio__month=mes_actual,
-        inicio__year=año_actual
-    ).order_by('-inicio')
-    
-    total_sesiones_mes = sesiones_mes.count()
-    
-    # Asistencias del mes
-    asistencias_mes = horario.sesiones.filter(
-        inicio__month=mes_actual,
-        inicio__year=año_actual
-    ).aggregate(
-        total_asistencias=Count('asistencias__id', filter=Q(asistencias__presente=True))
-    )['total_asistencias'] or 0
-    
     # Próximas sesiones
     proximas_sesiones = horario.sesiones.filter(
         inicio__gte=now
-    ).order_by('inicio')[:5]  # Próximas 5 sesiones
+    ).annotate(total_registros=Count('asistencias')).order_by('inicio')[:5]  # Próximas 5 sesiones
     
-    # Últimas sesiones con estadísticas
-    ultimas_sesiones_raw = horario.sesiones.filter(
+    # Últimas sesiones
+    ultimas_sesiones_raw = list(horario.sesiones.filter(
         inicio__lt=now
-    ).order_by('-inicio')[:5]  # Últimas 5 sesiones
+    ).order_by('-inicio')[:5])  # Últimas 5 sesiones
+    
+    # Matriz de asistencia de los alumnos matriculados activamente, desde el
+    # inicio del mes (o la más antigua de las últimas sesiones) en adelante
+    inicio_mes = timezone.localtime(now).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    desde = min([inicio_mes] + [sesion.inicio for sesion in ultimas_sesiones_raw])
+    matriz = cargar_matriz_asistencia(horario, [m.alumno for m in matriculas_activas], desde=desde)
     
+    # Sesiones del mes actual
+    sesiones_mes = [
+        sesion for sesion in reversed(matriz.sesiones)
+        if timezone.localtime(sesion.inicio).month == mes_actual
+        and timezone.localtime(sesion.inicio).year == año_actual
+    ]
+    ids_sesiones_mes = [sesion.id for sesion in sesiones_mes]
+    total_sesiones_mes = len(sesiones_mes)
+    
+    # Últimas sesiones con estadísticas (solo alumnos matriculados activamente)
     ultimas_sesiones = []
     for sesion in ultimas_sesiones_raw:
-        # Solo contar asistencias de alumnos matriculados activamente en este horario
-        alumnos_matriculados_ids = list(matriculas_activas.values_list('alumno_id', flat=True))
-        
-        asistencias_sesion = sesion.asistencias.filter(alumno_id__in=alumnos_matriculados_ids)
-        total_asistencias = asistencias_sesion.count()
-        asistencias_presentes = asistencias_sesion.filter(presente=True).count()
-        asistencias_faltas = asistencias_sesion.filter(presente=False).count()
+        total_asistencias, asistencias_presentes = matriz.resumen_sesion(sesion.id)
         
         porcentaje_asistencia = 0
         if total_asistencias > 0:
@@ -778,31 +591,43 @@ def detalle_horario(request, horario_id):
             'sesion': sesion,
             'total_asistencias': total_asistencias,
             'asistencias_presentes': asistencias_presentes,
-            'asistencias_faltas': asistencias_faltas,
+            'asistencias_faltas': total_asistencias - asistencias_presentes,
             'porcentaje_asistencia': porcentaje_asistencia,
         })
     
-    # Alumnos matriculados con información adicional
+    # Última asistencia de los alumnos sin registros en el rango de la matriz
+    ultimos_registros = {m.alumno_id: matriz.ultimo_registro(m.alumno_id) for m in matriculas_activas}
+    sin_registro = [alumno_id for alumno_id, registro in ultimos_registros.items() if registro is None]
+    asistencias_anteriores = {}
+    if sin_registro:
+        ultima_anterior = Asistencia.objects.filter(
+            alumno=OuterRef('pk'), sesion__horario=horario, sesion__inicio__lt=desde
+        ).order_by('-sesion__inicio').values('id')[:1]
+        ids_anteriores = Alumno.objects.filter(id__in=sin_registro).values(ultima=Subquery(ultima_anterior))
+        asistencias_anteriores = {
+            asistencia.alumno_id: asistencia
+            for asistencia in Asistencia.objects.select_related('sesion').filter(id__in=ids_anteriores)
+        }
+    
+    # Alumnos matriculados con información adicional (ordenados por apellido)
     alumnos_matriculados = []
     for matricula in matriculas_activas:
         # Asistencias del alumno este mes
-        asistencias_alumno = matricula.alumno.asistencias.filter(
-            sesion__horario=horario,
-            sesion__inicio__month=mes_actual,
-            sesion__inicio__year=año_actual
+        total_asistencias_alumno, asistencias_presente_alumno = matriz.resumen_alumno(
+            matricula.alumno_id, ids_sesiones_mes
         )
         
-        total_asistencias_alumno = asistencias_alumno.count()
-        asistencias_presente_alumno = asistencias_alumno.filter(presente=True).count()
-        
         porcentaje_asistencia = 0
         if total_asistencias_alumno > 0:
             porcentaje_asistencia = round((asistencias_presente_alumno / total_asistencias_alumno) * 100, 1)
         
         # Última asistencia
-        ultima_asistencia = matricula.alumno.asistencias.filter(
-            sesion__horario=horario
-        ).order_by('-sesion__inicio').first()
+        registro = ultimos_registros[matricula.alumno_id]
+        if registro is not None:
+            sesion, presente = registro
+            ultima_asistencia = Asistencia(sesion=sesion, alumno=matricula.alumno, presente=presente)
+        else:
+            ultima_asistencia = asistencias_anteriores.get(matricula.alumno_id)
         
         alumnos_matriculados.append({
             'matricula': matricula,
@@ -813,31 +638,12 @@ def detalle_horario(request, horario_id):
             'ultima_asistencia': ultima_asistencia,
         })
     
-    # Ordenar alumnos por apellido
-    alumnos_matriculados.sort(key=lambda x: (x['alumno'].apellido, x['alumno'].nombre))
-    
-    # Estadísticas de asistencia general - cálculo más preciso
-    total_asistencias_posibles = 0
-    total_asistencias_presentes = 0
-    
-    # Solo contar asistencias de alumnos matriculados activamente
-    alumnos_matriculados_ids = list(matriculas_activas.values_list('alumno_id', flat=True))
-    
-    for sesion in sesiones_mes:
-        asistencias_sesion = sesion.asistencias.filter(alumno_id__in=alumnos_matriculados_ids).count()
-        asistencias_presentes_sesion = sesion.asistencias.filter(
-            alumno_id__in=alumnos_matriculados_ids, 
-            presente=True
-        ).count()
-        total_asistencias_posibles += asistencias_sesion
-        total_asistencias_presentes += asistencias_presentes_sesion
+    # Estadísticas de asistencia general del mes
+    total_asistencias_posibles, asistencias_mes = matriz.resumen(ids_sesiones_mes)
     
     porcentaje_asistencia_general = 0
     if total_asistencias_posibles > 0:
-        porcentaje_asistencia_general = round((total_asistencias_presentes / total_asistencias_posibles) * 100, 1)
-    
-    # Actualizar asistencias_mes para que coincida con el cálculo
-    asistencias_mes = total_asistencias_presentes
+        porcentaje_asistencia_general = round((asistencias_mes / total_asistencias_posibles) * 100, 1)
     
     context = {
         'titulo': f'Detalle de {horario.asignatura}',
@@ -860,40 +666,21 @@ def detalle_horario(request, horario_id):
 @login_required(login_url='login:login')
 def detalle_asistencias(request, sesion_id):
     """Vista detallada de asistencias de una sesión específica"""
-    from .models import Sesion
-    from django.db.models import Q
-    
     try:
-        sesion = Sesion.objects.get(id=sesion_id)
+        sesion = Sesion.objects.select_related('horario__profesor__user').get(id=sesion_id)
     except Sesion.DoesNotExist:
         messages.error(request, 'Sesión no encontrada.')
         return redirect('gestion:horarios')
     
-    # Obtener alumnos matriculados activamente en el horario
-    matriculas_activas = sesion.horario.matriculas.filter(estado='activa')
-    alumnos_matriculados_ids = list(matriculas_activas.values_list('alumno_id', flat=True))
-    
-    # Obtener todas las asistencias de la sesión
-    asistencias_sesion = sesion.asistencias.all()
-    
-    # Separar asistencias por estado
-    asistencias_presentes = []
-    asistencias_faltas = []
-    asistencias_otros = []
-    
-    for asistencia in asistencias_sesion:
-        if asistencia.alumno_id in alumnos_matriculados_ids:
-            # Alumno matriculado activamente
-            if asistencia.presente:
-                asistencias_presentes.append(asistencia)
-            else:
-                asistencias_faltas.append(asistencia)
-        else:
-            # Alumno no matriculado o inactivo
-            asistencias_otros.append(asistencia)
+    # Separar asistencias por estado frente a los alumnos matriculados activamente
+    conciliacion = conciliar_asistencias(sesion)
+    asistencias_presentes = conciliacion['presentes']
+    asistencias_faltas = conciliacion['faltas']
+    asistencias_otros = conciliacion['otros']
+    alumnos_sin_registro = conciliacion['sin_registro']
     
     # Estadísticas
-    total_matriculados = len(alumnos_matriculados_ids)
+    total_matriculados = conciliacion['total_matriculados']
     total_presentes = len(asistencias_presentes)
     total_faltas = len(asistencias_faltas)
     total_otros = len(asistencias_otros)
@@ -902,12 +689,6 @@ def detalle_asistencias(request, sesion_id):
     if total_matriculados > 0:
         porcentaje_asistencia = round((total_presentes / total_matriculados) * 100, 1)
     
-    # Alumnos matriculados que no tienen registro de asistencia
-    alumnos_sin_registro = []
-    for matricula in matriculas_activas:
-        if not sesion.asistencias.filter(alumno=matricula.alumno).exists():
-            alumnos_sin_registro.append(matricula.alumno)
-    
     context = {
         'titulo': f'Asistencias - {sesion.horario.asignatura}',
         'sesion': sesion,
@@ -964,7 +745,8 @@ def gastos(request):
             pass
     
     # Statistics
-    total_gastos = gastos_qs.aggregate(total=Sum('importe'))['total'] or 0
+    filtrado = gastos_qs.aggregate(total=Sum('importe'), registros=Count('id'))
+    total_gastos = filtrado['total'] or 0
     gastos_mes = gastos_qs.filter(fecha_gasto__month=mes_actual, fecha_gasto__year=año_actual).aggregate(total=Sum('importe'))['total'] or 0
     
     # Gastos por categoría
@@ -979,10 +761,14 @@ def gastos(request):
         fecha_gasto__year=año_actual
     ).order_by('-fecha_gasto')
     
+    pagina = paginar_keyset(request, gastos_qs, ('-fecha_gasto', '-id'))
+    
     context = {
         'titulo': 'Gestión de Gastos',
-        'gastos': gastos_qs.order_by('-fecha_gasto'),
+        'gastos': pagina.objetos,
+        'pagina': pagina,
         'total_gastos': total_gastos,
+        'total_registros': filtrado['registros'],
         'gastos_mes': gastos_mes,
         'gastos_por_categoria': gastos_por_categoria,
         'gastos_mes_actual': gastos_mes_actual,
@@ -1,3 +1,19 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Eliminacion, ExportJob
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'formato', 'usuario', 'estado', 'filas_procesadas', 'filas_totales', 'fecha_creacion', 'fecha_fin')
+    list_filter = ('estado', 'formato', 'tipo')
+    readonly_fields = ('filas_procesadas', 'filas_totales', 'fecha_creacion', 'fecha_inicio', 'fecha_fin', 'error')
+    date_hierarchy = 'fecha_creacion'
+
+
+@admin.register(Eliminacion)
+class EliminacionAdmin(admin.ModelAdmin):
+    list_display = ('modelo', 'objeto_id', 'descripcion', 'fecha')
+    list_filter = ('modelo',)
+    search_fields = ('descripcion',)
+    date_hierarchy = 'fecha'
@@ -0,0 +1,197 @@
+"""Evolución de ingresos y gastos por periodos (pérdidas y ganancias).
+
+Cada serie sale de una sola consulta agrupada por periodo (``TruncWeek``,
+``TruncMonth`` o ``TruncQuarter``) y por tarifa o categoría. Los periodos ya
+cerrados se guardan en la caché uno a uno y ``reportes.signals`` borra el
+periodo de un pago o un gasto cuando cambia, así que un gráfico de varios
+años solo consulta la base de datos para el periodo en curso.
+
+Los rangos se amplían a periodos completos: con agrupación mensual, del 15
+de marzo al 10 de junio cuenta de marzo a junio enteros.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth, TruncQuarter, TruncWeek
+from django.utils import timezone
+
+from gestion.models import Gasto, Pago, Tarifa
+
+AGRUPACIONES = {
+    'semana': TruncWeek,
+    'mes': TruncMonth,
+    'trimestre': TruncQuarter,
+}
+
+# Serie: (modelo, campo de fecha, campo de importe, campo del desglose)
+SERIES = {
+    'ingresos': (Pago, 'fecha', 'importe_final', 'tarifa_id'),
+    'gastos': (Gasto, 'fecha_gasto', 'importe', 'categoria'),
+}
+
+CATEGORIAS = dict(Gasto.CATEGORIAS_GASTO)
+
+PREFIJO_PERIODO = 'reportes:balance'
+# Periodos como máximo en una consulta (unos 20 años por semanas)
+MAXIMO_PERIODOS = 1040
+
+
+def inicio_periodo(fecha, agrupacion):
+    """Primer día del periodo de ``agrupacion`` que contiene ``fecha``"""
+    if agrupacion == 'semana':
+        return fecha - timedelta(days=fecha.weekday())
+    if agrupacion == 'trimestre':
+        return fecha.replace(month=(fecha.month - 1) // 3 * 3 + 1, day=1)
+    return fecha.replace(day=1)
+
+
+def siguiente_periodo(inicio, agrupacion):
+    """Primer día del periodo siguiente al que empieza en ``inicio``"""
+    if agrupacion == 'semana':
+        return inicio + timedelta(days=7)
+    meses = 3 if agrupacion == 'trimestre' else 1
+    mes = inicio.month - 1 + meses
+    return inicio.replace(year=inicio.year + mes // 12, month=mes % 12 + 1)
+
+
+def periodos(desde, hasta, agrupacion):
+    """Inicio de cada periodo entre ``desde`` y ``hasta``, ambos incluidos"""
+    inicios = []
+    inicio = inicio_periodo(desde, agrupacion)
+    while inicio <= hasta:
+        inicios.append(inicio)
+        inicio = siguiente_periodo(inicio, agrupacion)
+    return inicios
+
+
+def parametros_balance(params, hoy=None):
+    """``(desde, hasta, agrupacion)`` a partir de los parámetros GET.
+
+    Por defecto, los últimos doce meses. Lanza ``ValueError`` si los
+    parámetros no son válidos.
+    """
+    hoy = hoy or timezone.localdate()
+    agrupacion = params.get('agrupacion') or 'mes'
+    if agrupacion not in AGRUPACIONES:
+        raise ValueError(f'Agrupación no válida: {agrupacion}')
+    hasta = _fecha(params.get('hasta')) or hoy
+    desde = _fecha(params.get('desde')) or siguiente_periodo(
+        inicio_periodo(hasta, 'mes').replace(year=hasta.year - 1), 'mes'
+    )
+    if desde > hasta:
+        raise ValueError('La fecha inicial es posterior a la final')
+    if len(periodos(desde, hasta, agrupacion)) > MAXIMO_PERIODOS:
+        raise ValueError('El rango tiene demasiados periodos para esa agrupación')
+    return desde, hasta, agrupacion
+
+
+def _fecha(valor):
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'Fecha no válida: {valor}') from None
+
+
+def _clave(serie, agrupacion, inicio):
+    return f'{PREFIJO_PERIODO}:{serie}:{agrupacion}:{inicio.isoformat()}'
+
+
+def _consultar(serie, agrupacion, desde, hasta):
+    """``{inicio de periodo: {desglose: total}}`` con una sola consulta agrupada"""
+    modelo, campo_fecha, campo_importe, desglose = SERIES[serie]
+    filas = (
+        modelo.objects.filter(**{f'{campo_fecha}__gte': desde, f'{campo_fecha}__lt': hasta})
+        .annotate(periodo=AGRUPACIONES[agrupacion](campo_fecha))
+        .values('periodo', desglose)
+        .annotate(total=Sum(campo_importe))
+        .order_by()
+        .values_list('periodo', desglose, 'total')
+    )
+    totales = defaultdict(dict)
+    for periodo, clave, total in filas:
+        totales[periodo][clave] = total
+    return totales
+
+
+def serie(nombre, desde, hasta, agrupacion, hoy=None):
+    """Lista de ``(inicio, {desglose: total})`` de la serie ``nombre``.
+
+    Los periodos cerrados se leen de la caché con una sola lectura; los que
+    faltan y el periodo en curso se calculan juntos con una consulta.
+    """
+    actual = inicio_periodo(hoy or timezone.localdate(), agrupacion)
+    inicios = periodos(desde, hasta, agrupacion)
+    claves = {inicio: _clave(nombre, agrupacion, inicio) for inicio in inicios if inicio < actual}
+    en_cache = cache.get_many(claves.values())
+    datos = {inicio: en_cache[clave] for inicio, clave in claves.items() if clave in en_cache}
+
+    faltan = [inicio for inicio in inicios if inicio not in datos]
+    if faltan:
+        consultados = _consultar(nombre, agrupacion, faltan[0], siguiente_periodo(faltan[-1], agrupacion))
+        for inicio in faltan:
+            datos[inicio] = consultados.get(inicio, {})
+        cache.set_many(
+            {claves[inicio]: datos[inicio] for inicio in faltan if inicio in claves},
+            settings.CACHE_DURACION_SEGURIDAD,
+        )
+    return [(inicio, datos[inicio]) for inicio in inicios]
+
+
+def invalidar_periodos(nombre, *fechas):
+    """Descarta de la caché los periodos de ``fechas`` en todas las agrupaciones"""
+    claves = {
+        _clave(nombre, agrupacion, inicio_periodo(fecha, agrupacion))
+        for fecha in fechas if fecha
+        for agrupacion in AGRUPACIONES
+    }
+    if claves:
+        transaction.on_commit(lambda: cache.delete_many(claves))
+
+
+def _float(valor):
+    return round(float(valor or 0), 2)
+
+
+def calcular_balance(desde, hasta, agrupacion, hoy=None):
+    """Ingresos por tarifa, gastos por categoría y balance de cada periodo"""
+    ingresos = serie('ingresos', desde, hasta, agrupacion, hoy)
+    gastos = serie('gastos', desde, hasta, agrupacion, hoy)
+    tarifas = Tarifa.objects.in_bulk({tarifa_id for _, totales in ingresos for tarifa_id in totales if tarifa_id})
+
+    resultado = []
+    total_ingresos = total_gastos = 0
+    for (inicio, por_tarifa), (_, por_categoria) in zip(ingresos, gastos):
+        importe_ingresos = _float(sum(por_tarifa.values()))
+        importe_gastos = _float(sum(por_categoria.values()))
+        total_ingresos += importe_ingresos
+        total_gastos += importe_gastos
+        resultado.append({
+            'inicio': inicio,
+            'fin': siguiente_periodo(inicio, agrupacion) - timedelta(days=1),
+            'ingresos': importe_ingresos,
+            'gastos': importe_gastos,
+            'balance': _float(importe_ingresos - importe_gastos),
+            'ingresos_por_tarifa': {
+                tarifas[tarifa_id].nombre if tarifa_id in tarifas else 'Sin tarifa': _float(total)
+                for tarifa_id, total in por_tarifa.items()
+            },
+            'gastos_por_categoria': {
+                CATEGORIAS.get(categoria, categoria): _float(total)
+                for categoria, total in por_categoria.items()
+            },
+        })
+    return {
+        'agrupacion': agrupacion,
+        'desde': resultado[0]['inicio'] if resultado else desde,
+        'hasta': resultado[-1]['fin'] if resultado else hasta,
+        'periodos': resultado,
+        'ingresos': _float(total_ingresos),
+        'gastos': _float(total_gastos),
+        'balance': _float(total_ingresos - total_gastos),
+    }
@@ -0,0 +1,153 @@
+"""Caché de los ficheros de exportación.
+
+Cada modelo que leen las exportaciones tiene en la caché un contador de
+versión que ``reportes.signals`` incrementa al guardar o borrar una fila.
+La huella de una exportación junta las versiones de sus modelos, y el
+fichero generado se guarda bajo (tipo, formato, filtros, huella): repetir
+una descarga con los mismos filtros y sin cambios en los datos sale de la
+caché. La misma clave es el ETag de la respuesta, así que un navegador que
+ya tiene el fichero recibe un 304 sin que se lea ni siquiera la caché.
+
+Como en los KPIs, los cambios que no pasan por las señales (``update()``,
+``bulk_create()``, SQL directo...) no cambian la huella hasta que el fichero
+caduca (``CACHE_DURACION_SEGURIDAD``).
+
+Los contadores viven en la caché ``default``, así que todos los procesos
+(workers web y ``procesar_exportaciones``) deben compartirla: con la
+``LocMemCache`` de desarrollo cada proceso tiene sus propios contadores y un
+cambio guardado en uno no invalida los ficheros que ya tienen los demás. En
+producción con más de un proceso hace falta un backend compartido (Redis o
+Memcached).
+"""
+import hashlib
+import io
+import json
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .formatos import adjunto_xlsx, bloques_exportacion, escribir_xlsx, respuesta_texto
+
+PREFIJO_VERSION = 'reportes:version'
+PREFIJO_FICHERO = 'reportes:exportacion'
+# Los ficheros más grandes se generan siempre y no ocupan la caché
+TAMANO_MAXIMO = getattr(settings, 'EXPORTACIONES_CACHE_MAX_BYTES', 20 * 1024 * 1024)
+
+
+def _clave_version(modelo):
+    return f'{PREFIJO_VERSION}:{modelo._meta.label_lower}'
+
+
+def versiones(modelos):
+    """Versión actual de cada modelo, en el mismo orden, con una sola lectura de la caché"""
+    claves = [_clave_version(modelo) for modelo in modelos]
+    actuales = cache.get_many(claves)
+    for clave in claves:
+        if clave not in actuales:
+            # Primera vez o contador expulsado de la caché: se empieza en un
+            # valor nuevo para no volver a servir ficheros de antes
+            cache.add(clave, time.time_ns(), timeout=None)
+            actuales[clave] = cache.get(clave)
+    return [actuales[clave] for clave in claves]
+
+
+def incrementar_version(modelo):
+    """Cambia la versión de ``modelo`` cuando se confirme la transacción en curso"""
+    clave = _clave_version(modelo)
+
+    def incrementar():
+        try:
+            cache.incr(clave)
+        except ValueError:
+            # Sin contador: la próxima lectura crea uno nuevo
+            pass
+
+    transaction.on_commit(incrementar)
+
+
+def clave_exportacion(tipo, formato, exportaciones, params):
+    """Clave del fichero de ``tipo`` generado con ``exportaciones`` y ``params``.
+
+    Solo cuentan los parámetros que usan las exportaciones, así que el orden
+    de la query string o parámetros ajenos no crean ficheros distintos.
+    """
+    modelos = sorted({modelo for e in exportaciones for modelo in e.modelos}, key=lambda m: m._meta.label_lower)
+    filtros = sorted({
+        (parametro, params.get(parametro, '').strip())
+        for e in exportaciones for parametro in e.parametros
+        if params.get(parametro, '').strip()
+    })
+    datos = json.dumps([tipo, formato, filtros, versiones(modelos)])
+    return hashlib.sha1(datos.encode('utf-8')).hexdigest()
+
+
+def obtener(clave):
+    return cache.get(f'{PREFIJO_FICHERO}:{clave}')
+
+
+def guardar(clave, contenido):
+    if len(contenido) <= TAMANO_MAXIMO:
+        cache.set(f'{PREFIJO_FICHERO}:{clave}', contenido, settings.CACHE_DURACION_SEGURIDAD)
+
+
+def guardar_al_terminar(clave, bloques):
+    """Devuelve los bloques tal cual y, si se envían todos, guarda el fichero completo"""
+    guardados = []
+    tamano = 0
+    for bloque in bloques:
+        yield bloque
+        if guardados is not None:
+            tamano += len(bloque)
+            if tamano <= TAMANO_MAXIMO:
+                guardados.append(bloque)
+            else:
+                guardados = None
+    if guardados is not None:
+        guardar(clave, b''.join(guardados))
+
+
+def respuesta_xlsx(request, tipo, exportaciones):
+    """Libro de ``tipo`` con una hoja por exportación, desde la caché si está al día"""
+    clave = clave_exportacion(tipo, 'xlsx', exportaciones, request.GET)
+    etag = quote_etag(clave)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    contenido = obtener(clave)
+    if contenido is not None:
+        fichero = io.BytesIO(contenido)
+    else:
+        fichero = tempfile.TemporaryFile()
+        escribir_xlsx(fichero, (hoja for e in exportaciones for hoja in e.hojas(request.GET)))
+        if fichero.tell() <= TAMANO_MAXIMO:
+            fichero.seek(0)
+            guardar(clave, fichero.read())
+        fichero.seek(0)
+    response = adjunto_xlsx(fichero, tipo)
+    response['ETag'] = etag
+    return response
+
+
+def respuesta_datos(request, exportacion, formato):
+    """CSV o JSON Lines en streaming, desde la caché si está al día"""
+    clave = clave_exportacion(exportacion.nombre, formato, [exportacion], request.GET)
+    # Débil: el mismo contenido puede enviarse comprimido o sin comprimir
+    etag = 'W/' + quote_etag(clave)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    contenido = obtener(clave)
+    if contenido is not None:
+        bloques = iter([contenido])
+    else:
+        bloques = guardar_al_terminar(clave, bloques_exportacion(exportacion, request.GET, formato))
+    response = respuesta_texto(request, exportacion.nombre, formato, bloques)
+    response['ETag'] = etag
+    return response
@@ -0,0 +1,184 @@
+"""Libro de cierre anual con todas las exportaciones del año.
+
+Cada hoja se genera en su propio proceso (``concurrent.futures``): el proceso
+consulta y convierte las filas y las escribe como XML de SpreadsheetML en un
+fichero temporal. El proceso principal escribe después el esqueleto del
+libro (resumen mensual, encabezados y anchos) e inserta cada parte en su
+hoja al empaquetar el ZIP final, así que el tiempo total se acerca al de la
+hoja más lenta y no a la suma de todas.
+
+Cada proceso lee con su propia conexión, de modo que las hojas no comparten
+una misma instantánea de la base de datos; para un año cerrado no importa.
+"""
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import as_completed
+from datetime import date
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from django.db import connections
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+import openpyxl
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+
+from gestion.models import Gasto, Pago
+from gestion.procesos import crear_pool
+
+from .exportaciones import EXPORTACIONES, Exportacion
+from .formatos import escribir_hoja, medir_anchos
+
+# Hojas del libro, en orden, después del resumen
+HOJAS_CIERRE = ('alumnos', 'pagos', 'asistencias', 'gastos', 'horarios')
+
+MESES = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+         'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+
+_NS = {
+    'm': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+}
+
+
+def parametros_hoja(nombre, anio):
+    """Filtros de la exportación ``nombre`` para limitar los datos a ``anio``"""
+    if nombre == 'gastos':
+        # Los gastos del año van por fecha del gasto, no por fecha de registro
+        return {'gasto_desde': f'{anio}-01-01', 'gasto_hasta': f'{anio}-12-31'}
+    return {'fecha_inicio': f'{anio}-01-01', 'fecha_fin': f'{anio}-12-31'}
+
+
+class ResumenMensual(Exportacion):
+    """Ingresos frente a gastos de cada mes del año"""
+
+    nombre = 'resumen'
+    titulo = 'Resumen'
+    color = '7030A0'
+    columnas = ('Mes', 'Ingresos', 'Gastos', 'Balance')
+
+    def filas_anio(self, anio):
+        ingresos = dict(
+            Pago.objects.filter(fecha__year=anio)
+            .annotate(mes=TruncMonth('fecha')).values('mes')
+            .annotate(total=Sum('importe_final')).order_by().values_list('mes', 'total')
+        )
+        gastos = dict(
+            Gasto.objects.filter(fecha_gasto__year=anio)
+            .annotate(mes=TruncMonth('fecha_gasto')).values('mes')
+            .annotate(total=Sum('importe')).order_by().values_list('mes', 'total')
+        )
+        total_ingresos = total_gastos = 0
+        filas = []
+        for mes in range(1, 13):
+            inicio = date(anio, mes, 1)
+            ingreso = float(ingresos.get(inicio) or 0)
+            gasto = float(gastos.get(inicio) or 0)
+            total_ingresos += ingreso
+            total_gastos += gasto
+            filas.append((MESES[mes - 1], ingreso, gasto, round(ingreso - gasto, 2)))
+        filas.append(('Total', round(total_ingresos, 2), round(total_gastos, 2),
+                      round(total_ingresos - total_gastos, 2)))
+        return filas
+
+
+def _celda_xml(referencia, valor):
+    if valor is None or valor == '':
+        return ''
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f'<c r="{referencia}" t="n"><v>{valor}</v></c>'
+    texto = escape(ILLEGAL_CHARACTERS_RE.sub('', str(valor)))
+    espacio = ' xml:space="preserve"' if texto != texto.strip() else ''
+    return f'<c r="{referencia}" t="inlineStr"><is><t{espacio}>{texto}</t></is></c>'
+
+
+def generar_parte(nombre, params, directorio):
+    """Escribe en ``directorio`` las filas de datos de una hoja como XML.
+
+    Se ejecuta en un proceso del pool. Devuelve el nombre, la ruta del
+    fichero, el número de filas y el ancho de cada columna.
+    """
+    exportacion = EXPORTACIONES[nombre]
+    letras = [get_column_letter(i) for i in range(1, len(exportacion.columnas) + 1)]
+    anchos = [len(columna) for columna in exportacion.columnas]
+    ruta = os.path.join(directorio, f'{nombre}.xml')
+    filas = 0
+    with open(ruta, 'w', encoding='utf-8') as parte:
+        # La fila 1 son los encabezados que escribe el esqueleto
+        for numero, fila in enumerate(exportacion.filas(params), 2):
+            medir_anchos(anchos, (fila,))
+            celdas = ''.join(_celda_xml(f'{letra}{numero}', valor) for letra, valor in zip(letras, fila))
+            parte.write(f'<row r="{numero}">{celdas}</row>')
+            filas += 1
+    connections.close_all()
+    return {'nombre': nombre, 'ruta': ruta, 'filas': filas, 'anchos': anchos}
+
+
+def _rutas_hojas(paquete):
+    """``{titulo de hoja: ruta dentro del ZIP}`` leyendo workbook.xml y sus relaciones"""
+    libro = ElementTree.fromstring(paquete.read('xl/workbook.xml'))
+    relaciones = ElementTree.fromstring(paquete.read('xl/_rels/workbook.xml.rels'))
+    destinos = {
+        rel.get('Id'): rel.get('Target').lstrip('/')
+        for rel in relaciones.findall('rel:Relationship', _NS)
+    }
+    return {
+        hoja.get('name'): destinos[hoja.get(f'{{{_NS["r"]}}}id')]
+        for hoja in libro.find('m:sheets', _NS).findall('m:sheet', _NS)
+    }
+
+
+def _unir(esqueleto, destino, partes):
+    """Copia el ZIP ``esqueleto`` en ``destino`` insertando cada parte en su hoja"""
+    with zipfile.ZipFile(esqueleto) as origen, \
+            zipfile.ZipFile(destino, 'w', compression=zipfile.ZIP_DEFLATED) as final:
+        rutas = _rutas_hojas(origen)
+        partes_por_ruta = {rutas[EXPORTACIONES[nombre].titulo]: ruta for nombre, ruta in partes.items()}
+        for info in origen.infolist():
+            contenido = origen.read(info.filename)
+            if info.filename not in partes_por_ruta:
+                final.writestr(info, contenido)
+                continue
+            xml = contenido.decode('utf-8')
+            corte = xml.index('</sheetData>')
+            with final.open(info.filename, 'w', force_zip64=True) as hoja, \
+                    open(partes_por_ruta[info.filename], 'rb') as parte:
+                hoja.write(xml[:corte].encode('utf-8'))
+                shutil.copyfileobj(parte, hoja, 1024 * 1024)
+                hoja.write(xml[corte:].encode('utf-8'))
+
+
+def escribir_cierre_anual(destino, anio, procesos=None, al_terminar_hoja=None):
+    """Escribe en ``destino`` (ruta o fichero binario) el libro de cierre de ``anio``.
+
+    ``al_terminar_hoja(nombre, filas)`` se llama cada vez que termina una hoja.
+    """
+    procesos = procesos or min(len(HOJAS_CIERRE), os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory() as directorio:
+        resultados = {}
+        with crear_pool(procesos) as pool:
+            futuros = [
+                pool.submit(generar_parte, nombre, parametros_hoja(nombre, anio), directorio)
+                for nombre in HOJAS_CIERRE
+            ]
+            for futuro in as_completed(futuros):
+                resultado = futuro.result()
+                resultados[resultado['nombre']] = resultado
+                if al_terminar_hoja:
+                    al_terminar_hoja(resultado['nombre'], resultado['filas'])
+
+        # Esqueleto: resumen completo y, en cada hoja, anchos y encabezados
+        wb = openpyxl.Workbook(write_only=True)
+        resumen = ResumenMensual()
+        escribir_hoja(wb, resumen, iter(resumen.filas_anio(anio)))
+        for nombre in HOJAS_CIERRE:
+            escribir_hoja(wb, EXPORTACIONES[nombre], iter(()), anchos=resultados[nombre]['anchos'])
+        esqueleto = os.path.join(directorio, 'esqueleto.xlsx')
+        wb.save(esqueleto)
+
+        _unir(esqueleto, destino, {nombre: resultados[nombre]['ruta'] for nombre in HOJAS_CIERRE})
+    return sum(resultado['filas'] for resultado in resultados.values())
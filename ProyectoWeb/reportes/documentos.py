@@ -0,0 +1,129 @@
+"""Descarga en un ZIP de los comprobantes de pago y las facturas de gasto de un periodo.
+
+El ZIP se compone mientras se envía: cada fichero se lee del almacenamiento
+por bloques y lo escrito hasta el momento sale en la respuesta, así que la
+memoria y el tiempo hasta el primer byte no dependen del tamaño del archivo.
+``zipfile`` escribe sobre una salida sin ``seek`` usando descriptores de
+datos tras cada fichero, que es lo que permite no volver atrás.
+
+Los PDF y las imágenes ya van comprimidos y se guardan tal cual; comprimirlos
+otra vez costaría CPU sin reducir casi nada. Los ficheros que no están en
+el almacenamiento se listan en ``faltan.txt`` al final del ZIP.
+"""
+import os
+import zipfile
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from gestion.models import Gasto, Pago
+
+from .balance import inicio_periodo, siguiente_periodo
+
+# Bytes que se leen de cada fichero en cada paso
+TAMANO_BLOQUE = 64 * 1024
+
+# Extensiones que ya vienen comprimidas
+SIN_COMPRIMIR = {'.pdf', '.jpg', '.jpeg', '.png', '.zip'}
+
+# Documentos: (modelo, campo del fichero, campo de fecha)
+DOCUMENTOS = [
+    (Pago, 'comprobante', 'fecha'),
+    (Gasto, 'factura', 'fecha_gasto'),
+]
+
+
+def _fecha(valor):
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'Fecha no válida: {valor}') from None
+
+
+def parametros_documentos(params, hoy=None):
+    """``(desde, hasta)`` de los parámetros GET; por defecto, el trimestre en curso.
+
+    Lanza ``ValueError`` si las fechas no son válidas.
+    """
+    desde = _fecha(params.get('desde'))
+    hasta = _fecha(params.get('hasta'))
+    if desde is None:
+        desde = inicio_periodo(hasta or hoy or timezone.localdate(), 'trimestre')
+    if hasta is None:
+        hasta = siguiente_periodo(inicio_periodo(desde, 'trimestre'), 'trimestre') - timedelta(days=1)
+    if desde > hasta:
+        raise ValueError('La fecha inicial es posterior a la final')
+    return desde, hasta
+
+
+def documentos(desde, hasta):
+    """``(nombre en el almacenamiento, fecha, storage)`` de cada documento del periodo"""
+    for modelo, campo, campo_fecha in DOCUMENTOS:
+        storage = modelo._meta.get_field(campo).storage
+        filas = (
+            modelo.objects.filter(**{f'{campo_fecha}__gte': desde, f'{campo_fecha}__lte': hasta})
+            .exclude(**{f'{campo}__isnull': True}).exclude(**{campo: ''})
+            .order_by(campo_fecha, 'id')
+            .values_list(campo, campo_fecha)
+        )
+        for nombre, fecha in filas.iterator():
+            yield nombre, fecha, storage
+
+
+class _Salida:
+    """Destino del ZIP sin ``seek``: acumula lo escrito hasta que se recoge"""
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def recoger(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+def bloques_zip(entradas):
+    """Bloques de bytes del ZIP con los ficheros de ``entradas`` (ver :func:`documentos`)"""
+    salida = _Salida()
+    faltan = []
+    with zipfile.ZipFile(salida, 'w') as archivo:
+        for nombre, fecha, storage in entradas:
+            try:
+                tamano = storage.size(nombre)
+                origen = storage.open(nombre, 'rb')
+            except OSError:
+                faltan.append(nombre)
+                continue
+
+            info = zipfile.ZipInfo(nombre, date_time=(fecha.year, fecha.month, fecha.day, 0, 0, 0))
+            info.file_size = tamano
+            if os.path.splitext(nombre)[1].lower() in SIN_COMPRIMIR:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with origen, archivo.open(info, 'w') as destino:
+                while bloque := origen.read(TAMANO_BLOQUE):
+                    destino.write(bloque)
+                    if datos := salida.recoger():
+                        yield datos
+            if datos := salida.recoger():
+                yield datos
+
+        if faltan:
+            archivo.writestr('faltan.txt', '\n'.join(faltan) + '\n', compress_type=zipfile.ZIP_DEFLATED)
+    # Al cerrar se escribe el directorio central
+    yield salida.recoger()
@@ -0,0 +1,386 @@
+"""Definición de las exportaciones de reportes.
+
+Cada exportación filtra su consulta a partir de los parámetros GET y
+convierte las filas de ``values_list`` en los valores de la hoja, sin
+instanciar modelos. Los formatos de salida están en ``reportes.formatos``.
+"""
+import re
+from datetime import datetime
+from itertools import groupby
+
+from django.db.models import Count, Q
+
+from gestion.models import (
+    DIAS_SEMANA, Alumno, Asistencia, Gasto, Horario, MatriculaHorario, Padres, Pago, Profesor, Sesion, Tarifa,
+)
+
+# Filas que se piden a la base de datos en cada lote del iterador
+TAMANO_LOTE = 2000
+
+CURSOS = dict(Alumno.CURSOS_CHOICES)
+DIAS = dict(DIAS_SEMANA)
+
+# Caracteres que Excel no admite en el nombre de una hoja
+re_titulo_hoja = re.compile(r'[\[\]:*?/\\]')
+
+
+def _fecha(params, clave):
+    """Fecha ``AAAA-MM-DD`` de ``params`` o ``None`` si falta o no es válida"""
+    valor = params.get(clave, '')
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _dmy(fecha):
+    return fecha.strftime('%d/%m/%Y') if fecha else ''
+
+
+def _si_no(valor):
+    return 'Sí' if valor else 'No'
+
+
+def _nombre_usuario(nombre, apellido, usuario):
+    """Equivalente a ``str(profesor)`` a partir de los campos del usuario"""
+    return f'{nombre} {apellido}'.strip() or usuario
+
+
+class Exportacion:
+    """Una exportación: consulta filtrada, columnas y conversión de cada fila"""
+
+    nombre = ''
+    titulo = ''
+    color = '366092'
+    columnas = ()
+    campos = ()
+    # Campos en bruto de las exportaciones CSV/JSONL (sin formato de hoja)
+    campos_datos = ()
+    # Parámetros GET que usa ``filtrar`` y modelos de los que lee datos
+    # (forman la clave de ``reportes.cache_exportaciones``)
+    parametros = ()
+    modelos = ()
+
+    def filtrar(self, params):
+        raise NotImplementedError
+
+    def convertir(self, valores):
+        raise NotImplementedError
+
+    def filas(self, params, chunk_size=TAMANO_LOTE):
+        """Genera las filas ya convertidas leyendo la consulta por lotes"""
+        consulta = self.filtrar(params).values_list(*self.campos)
+        for valores in consulta.iterator(chunk_size=chunk_size):
+            yield self.convertir(valores)
+
+    def datos(self, params, chunk_size=TAMANO_LOTE):
+        """Tuplas de ``campos_datos`` tal cual salen del cursor (de servidor en PostgreSQL)"""
+        return self.filtrar(params).values_list(*self.campos_datos).iterator(chunk_size=chunk_size)
+
+    def hojas(self, params):
+        """Pares ``(hoja, filas)`` del libro Excel; por defecto una sola hoja"""
+        yield self, self.filas(params)
+
+    def contar_filas(self, params):
+        """Filas de datos que escribe :meth:`hojas` en total"""
+        return self.filtrar(params).count()
+
+
+class Hoja:
+    """Hoja de Excel sin exportación propia (título, color y columnas)"""
+
+    def __init__(self, titulo, columnas, color):
+        self.titulo = titulo
+        self.columnas = columnas
+        self.color = color
+
+
+class ExportacionAlumnos(Exportacion):
+    nombre = 'alumnos'
+    titulo = 'Alumnos'
+    color = '366092'
+    columnas = (
+        'ID', 'Nombre', 'Apellido', 'DNI', 'Curso', 'Teléfono',
+        'Fecha Nacimiento', 'Dirección', 'Compartido', 'Activo',
+        'Fecha Alta', 'Fecha Baja', 'Padre/Madre', 'Tarifa Predeterminada',
+    )
+    campos = (
+        'id', 'nombre', 'apellido', 'dni', 'curso', 'telefono',
+        'fecha_nacimiento', 'direccion', 'es_compartido', 'activo',
+        'fecha_alta', 'fecha_baja', 'padre_id', 'padre__nombre', 'padre__apellido',
+        'tarifa_predeterminada_id', 'tarifa_predeterminada__nombre', 'tarifa_predeterminada__precio',
+    )
+    campos_datos = (
+        'id', 'nombre', 'apellido', 'dni', 'curso', 'telefono', 'fecha_nacimiento', 'direccion',
+        'es_compartido', 'activo', 'fecha_alta', 'fecha_baja', 'padre_id', 'tarifa_predeterminada_id',
+    )
+    parametros = ('estado', 'curso', 'compartido')
+    modelos = (Alumno, Padres, Tarifa)
+
+    def filtrar(self, params):
+        alumnos = Alumno.objects.all()
+        estado = params.get('estado', '')
+        curso = params.get('curso', '')
+        compartido = params.get('compartido', '')
+        if estado:
+            alumnos = alumnos.filter(activo=estado == 'activo')
+        if curso:
+            alumnos = alumnos.filter(curso=curso)
+        if compartido:
+            alumnos = alumnos.filter(es_compartido=compartido == 'compartido')
+        return alumnos
+
+    def convertir(self, valores):
+        (id_, nombre, apellido, dni, curso, telefono, nacimiento, direccion, compartido, activo,
+         alta, baja, padre_id, padre_nombre, padre_apellido, tarifa_id, tarifa_nombre, tarifa_precio) = valores
+        return (
+            id_, nombre, apellido, dni or '', CURSOS.get(curso, curso) if curso else '', telefono or '',
+            _dmy(nacimiento), direccion or '', _si_no(compartido), _si_no(activo),
+            _dmy(alta), _dmy(baja),
+            f'{padre_nombre} {padre_apellido}' if padre_id else '',
+            f'{tarifa_nombre} - {tarifa_precio}€' if tarifa_id else '',
+        )
+
+
+class ExportacionPagos(Exportacion):
+    nombre = 'pagos'
+    titulo = 'Pagos'
+    color = '70AD47'
+    columnas = (
+        'ID', 'Alumno', 'Profesor', 'Fecha', 'Concepto', 'Importe Original',
+        'Descuento', 'Importe Final', 'Tarifa', 'Número',
+    )
+    campos = (
+        'id', 'alumno__nombre', 'alumno__apellido',
+        'profesor_id', 'profesor__user__first_name', 'profesor__user__last_name', 'profesor__user__username',
+        'fecha', 'concepto', 'importe_original', 'descuento', 'importe_final',
+        'tarifa_id', 'tarifa__nombre', 'tarifa__precio', 'numero',
+    )
+    campos_datos = (
+        'id', 'numero', 'fecha', 'alumno_id', 'profesor_id', 'tarifa_id', 'concepto',
+        'importe_original', 'descuento', 'importe_final',
+    )
+    parametros = ('fecha_inicio', 'fecha_fin', 'profesor')
+    modelos = (Pago, Alumno, Profesor, Tarifa)
+
+    def filtrar(self, params):
+        pagos = Pago.objects.order_by('fecha', 'id')
+        fecha_inicio = _fecha(params, 'fecha_inicio')
+        fecha_fin = _fecha(params, 'fecha_fin')
+        profesor = params.get('profesor', '')
+        if fecha_inicio:
+            pagos = pagos.filter(fecha__gte=fecha_inicio)
+        if fecha_fin:
+            pagos = pagos.filter(fecha__lte=fecha_fin)
+        if profesor:
+            pagos = pagos.filter(profesor__id=profesor)
+        return pagos
+
+    def convertir(self, valores):
+        (id_, alumno_nombre, alumno_apellido, profesor_id, prof_nombre, prof_apellido, prof_usuario,
+         fecha, concepto, original, descuento, final, tarifa_id, tarifa_nombre, tarifa_precio, numero) = valores
+        return (
+            id_, f'{alumno_nombre} {alumno_apellido}',
+            _nombre_usuario(prof_nombre, prof_apellido, prof_usuario) if profesor_id else '',
+            _dmy(fecha), concepto, float(original), float(descuento), float(final),
+            f'{tarifa_nombre} - {tarifa_precio}€' if tarifa_id else '', numero,
+        )
+
+
+class ExportacionAsistencias(Exportacion):
+    nombre = 'asistencias'
+    titulo = 'Asistencias'
+    color = 'C5504B'
+    columnas = ('ID', 'Alumno', 'Horario', 'Fecha Sesión', 'Hora Inicio', 'Hora Fin', 'Presente')
+    campos = (
+        'id', 'alumno__nombre', 'alumno__apellido',
+        'sesion__horario__asignatura', 'sesion__horario__dia_semana',
+        'sesion__horario__hora_inicio', 'sesion__horario__hora_fin',
+        'sesion__horario__profesor__user__first_name', 'sesion__horario__profesor__user__last_name',
+        'sesion__horario__profesor__user__username',
+        'sesion__inicio', 'sesion__fin', 'presente',
+    )
+    campos_datos = (
+        'id', 'alumno_id', 'sesion_id', 'sesion__horario_id', 'sesion__inicio', 'sesion__fin', 'presente',
+    )
+    parametros = ('fecha_inicio', 'fecha_fin', 'horario', 'asistio', 'disposicion')
+    modelos = (Asistencia, Alumno, Sesion, Horario, Profesor)
+
+    def filtrar(self, params):
+        asistencias = Asistencia.objects.order_by('-sesion__inicio')
+        fecha_inicio = _fecha(params, 'fecha_inicio')
+        fecha_fin = _fecha(params, 'fecha_fin')
+        horario = params.get('horario', '')
+        asistio = params.get('asistio', '')
+        if fecha_inicio:
+            asistencias = asistencias.filter(sesion__inicio__date__gte=fecha_inicio)
+        if fecha_fin:
+            asistencias = asistencias.filter(sesion__inicio__date__lte=fecha_fin)
+        if horario:
+            asistencias = asistencias.filter(sesion__horario__id=horario)
+        if asistio:
+            asistencias = asistencias.filter(presente=asistio == 'asistio')
+        return asistencias
+
+    def convertir(self, valores):
+        (id_, alumno_nombre, alumno_apellido, asignatura, dia, hora_inicio, hora_fin,
+         prof_nombre, prof_apellido, prof_usuario, inicio, fin, presente) = valores
+        # Mismo texto que str(horario)
+        horario = (f'{asignatura} - {DIAS.get(dia, dia)} {hora_inicio}-{hora_fin} '
+                   f'({_nombre_usuario(prof_nombre, prof_apellido, prof_usuario)})')
+        return (
+            id_, f'{alumno_nombre} {alumno_apellido}', horario,
+            inicio.strftime('%d/%m/%Y'), inicio.strftime('%H:%M'), fin.strftime('%H:%M'),
+            _si_no(presente),
+        )
+
+    def hojas(self, params):
+        if params.get('disposicion') == 'pivote':
+            return self.hojas_pivote(params)
+        return super().hojas(params)
+
+    def contar_filas(self, params):
+        if params.get('disposicion') == 'pivote':
+            # Una fila por alumno en cada horario
+            return self.filtrar(params).order_by().values('sesion__horario_id', 'alumno_id').distinct().count()
+        return super().contar_filas(params)
+
+    def hojas_pivote(self, params):
+        """Una hoja por horario con un alumno por fila y una sesión por columna.
+
+        Las asistencias salen de una sola consulta ordenada por horario y
+        sesión; cada horario se monta en una matriz densa en memoria y se
+        escribe antes de leer el siguiente. Los horarios, con su profesor, se
+        cargan de una vez al principio.
+        """
+        horarios = Horario.objects.select_related('profesor__user').in_bulk()
+        asistencias = (
+            self.filtrar(params)
+            .order_by('sesion__horario_id', 'sesion__inicio', 'sesion_id')
+            .values_list('sesion__horario_id', 'sesion_id', 'sesion__inicio',
+                         'alumno_id', 'alumno__nombre', 'alumno__apellido', 'presente')
+            .iterator(chunk_size=TAMANO_LOTE)
+        )
+        for horario_id, filas in groupby(asistencias, key=lambda fila: fila[0]):
+            horario = horarios[horario_id]
+            titulo = re_titulo_hoja.sub('', f'{horario.id} {horario.asignatura}')[:31]
+            yield self._pivote(titulo, list(filas))
+
+    def _pivote(self, titulo, filas):
+        sesiones = {}
+        alumnos = {}
+        for _, sesion_id, inicio, alumno_id, nombre, apellido, _ in filas:
+            sesiones.setdefault(sesion_id, inicio)
+            alumnos.setdefault(alumno_id, (apellido, nombre))
+        columna = {sesion_id: i for i, sesion_id in enumerate(sesiones)}
+        orden = sorted(alumnos, key=lambda alumno_id: alumnos[alumno_id])
+        fila = {alumno_id: i for i, alumno_id in enumerate(orden)}
+
+        matriz = [[''] * len(sesiones) for _ in orden]
+        for _, sesion_id, _, alumno_id, _, _, presente in filas:
+            matriz[fila[alumno_id]][columna[sesion_id]] = 'P' if presente else 'F'
+
+        hoja = Hoja(
+            titulo,
+            ('Alumno', *(inicio.strftime('%d/%m/%Y %H:%M') for inicio in sesiones.values()), '% Asistencia'),
+            self.color,
+        )
+        return hoja, self._filas_pivote(orden, alumnos, matriz)
+
+    @staticmethod
+    def _filas_pivote(orden, alumnos, matriz):
+        for alumno_id, celdas in zip(orden, matriz):
+            apellido, nombre = alumnos[alumno_id]
+            presentes = celdas.count('P')
+            registradas = presentes + celdas.count('F')
+            porcentaje = (presentes / registradas) * 100 if registradas else 0
+            yield (f'{nombre} {apellido}', *celdas, f'{porcentaje:.1f}%')
+
+
+class ExportacionHorarios(Exportacion):
+    nombre = 'horarios'
+    titulo = 'Horarios'
+    color = '366092'
+    columnas = (
+        'ID', 'Asignatura', 'Profesor', 'Día', 'Hora Inicio', 'Hora Fin',
+        'Capacidad', 'Alumnos Matriculados', 'Ocupación %', 'Estado',
+    )
+    campos = (
+        'id', 'asignatura', 'profesor__user__first_name', 'profesor__user__last_name', 'profesor__user__username',
+        'dia_semana', 'hora_inicio', 'hora_fin', 'capacidad', 'alumnos_matriculados', 'activo',
+    )
+    campos_datos = (
+        'id', 'asignatura', 'profesor_id', 'dia_semana', 'hora_inicio', 'hora_fin', 'aula',
+        'capacidad', 'alumnos_matriculados', 'activo',
+    )
+    modelos = (Horario, MatriculaHorario, Profesor)
+
+    def filtrar(self, params):
+        return Horario.objects.annotate(
+            alumnos_matriculados=Count('matriculas', filter=Q(matriculas__estado='activa'))
+        ).order_by('dia_semana', 'hora_inicio')
+
+    def convertir(self, valores):
+        (id_, asignatura, prof_nombre, prof_apellido, prof_usuario, dia, hora_inicio, hora_fin,
+         capacidad, matriculados, activo) = valores
+        ocupacion = (matriculados / capacidad) * 100 if capacidad > 0 else 0
+        return (
+            id_, asignatura, _nombre_usuario(prof_nombre, prof_apellido, prof_usuario), DIAS.get(dia, dia),
+            hora_inicio.strftime('%H:%M'), hora_fin.strftime('%H:%M'),
+            capacidad, matriculados, f'{ocupacion:.1f}%', 'Activo' if activo else 'Inactivo',
+        )
+
+
+class ExportacionGastos(Exportacion):
+    nombre = 'gastos'
+    titulo = 'Gastos'
+    color = 'FF6600'
+    columnas = ('ID', 'Concepto', 'Importe', 'Categoría', 'Fecha', 'Observaciones', 'Tiene Factura')
+    campos = ('id', 'concepto', 'importe', 'categoria', 'fecha', 'observaciones', 'factura')
+    campos_datos = ('id', 'concepto', 'importe', 'categoria', 'fecha_gasto', 'fecha', 'observaciones', 'factura')
+    parametros = ('fecha_inicio', 'fecha_fin', 'gasto_desde', 'gasto_hasta', 'categoria')
+    modelos = (Gasto,)
+
+    def filtrar(self, params):
+        gastos = Gasto.objects.order_by('-fecha_gasto', '-fecha', '-id')
+        fecha_inicio = _fecha(params, 'fecha_inicio')
+        fecha_fin = _fecha(params, 'fecha_fin')
+        categoria = params.get('categoria', '')
+        # Fecha real del gasto (``fecha_*`` filtra por la fecha de registro)
+        gasto_desde = _fecha(params, 'gasto_desde')
+        gasto_hasta = _fecha(params, 'gasto_hasta')
+        if fecha_inicio:
+            gastos = gastos.filter(fecha__gte=fecha_inicio)
+        if fecha_fin:
+            gastos = gastos.filter(fecha__lte=fecha_fin)
+        if gasto_desde:
+            gastos = gastos.filter(fecha_gasto__gte=gasto_desde)
+        if gasto_hasta:
+            gastos = gastos.filter(fecha_gasto__lte=gasto_hasta)
+        if categoria:
+            gastos = gastos.filter(categoria=categoria)
+        return gastos
+
+    def convertir(self, valores):
+        id_, concepto, importe, categoria, fecha, observaciones, factura = valores
+        return (id_, concepto, float(importe), categoria, _dmy(fecha), observaciones or '', _si_no(factura))
+
+
+EXPORTACIONES = {
+    exportacion.nombre: exportacion
+    for exportacion in (
+        ExportacionAlumnos(), ExportacionPagos(), ExportacionAsistencias(),
+        ExportacionHorarios(), ExportacionGastos(),
+    )
+}
+
+# Hojas del libro Excel de cada exportación
+LIBROS_XLSX = {
+    'alumnos': ('alumnos',),
+    'pagos': ('pagos',),
+    'asistencias': ('asistencias', 'horarios'),
+    'horarios': ('horarios',),
+    'gastos': ('gastos',),
+}
@@ -0,0 +1,172 @@
+"""Escritura de las exportaciones en los distintos formatos de fichero.
+
+Los libros XLSX se escriben en modo ``write_only`` de openpyxl: las filas
+se vuelcan a disco según llegan de la base de datos y la memoria no crece
+con el número de filas. CSV y JSON Lines se generan directamente sobre la
+respuesta, bloque a bloque, y se comprimen con gzip si el cliente lo acepta.
+"""
+import csv
+import re
+from datetime import date, datetime, time
+from itertools import chain, islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CONTENT_TYPES_TEXTO = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# Filas de CSV/JSONL que se agrupan en cada bloque enviado al cliente
+FILAS_POR_BLOQUE = 1000
+
+re_acepta_gzip = re.compile(r'\bgzip\b')
+
+ANCHO_MAXIMO = 50
+# En write_only los anchos se escriben antes que las filas, así que se
+# calculan con las primeras filas de cada hoja
+FILAS_MUESTRA_ANCHOS = 500
+
+
+def _encabezados(ws, exportacion):
+    font = Font(bold=True, color="FFFFFF")
+    fill = PatternFill(start_color=exportacion.color, end_color=exportacion.color, fill_type="solid")
+    alignment = Alignment(horizontal="center", vertical="center")
+    celdas = []
+    for columna in exportacion.columnas:
+        celda = WriteOnlyCell(ws, value=columna)
+        celda.font = font
+        celda.fill = fill
+        celda.alignment = alignment
+        celdas.append(celda)
+    return celdas
+
+
+def medir_anchos(anchos, filas):
+    """Actualiza ``anchos`` con la longitud de los valores de ``filas``"""
+    for fila in filas:
+        for i, valor in enumerate(fila):
+            anchos[i] = max(anchos[i], len(str(valor)))
+    return anchos
+
+
+def escribir_hoja(wb, exportacion, filas, anchos=None):
+    """Añade a ``wb`` una hoja con las ``filas`` de ``exportacion``.
+
+    Sin ``anchos`` las columnas se dimensionan con las primeras filas.
+    """
+    ws = wb.create_sheet(title=exportacion.titulo)
+
+    muestra = []
+    if anchos is None:
+        muestra = list(islice(filas, FILAS_MUESTRA_ANCHOS))
+        anchos = medir_anchos([len(columna) for columna in exportacion.columnas], muestra)
+    for i, ancho in enumerate(anchos, 1):
+        ws.column_dimensions[get_column_letter(i)].width = min(ancho + 2, ANCHO_MAXIMO)
+
+    ws.append(_encabezados(ws, exportacion))
+    for fila in chain(muestra, filas):
+        ws.append(fila)
+
+
+def escribir_xlsx(destino, hojas):
+    """Escribe en ``destino`` (ruta o fichero) un libro con ``hojas``.
+
+    ``hojas`` es un iterable de pares ``(exportacion, filas)``.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    for exportacion, filas in hojas:
+        escribir_hoja(wb, exportacion, filas)
+    wb.save(destino)
+
+
+def nombre_fichero(nombre, extension):
+    return f'{nombre}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+
+
+def adjunto_xlsx(fichero, nombre):
+    """Respuesta que descarga por bloques el libro de ``fichero`` (ya posicionado)"""
+    # FileResponse cierra (y con ello borra, si es temporal) el fichero al terminar el envío
+    return FileResponse(
+        fichero,
+        as_attachment=True,
+        filename=nombre_fichero(nombre, 'xlsx'),
+        content_type=CONTENT_TYPE_XLSX,
+    )
+
+
+class _Eco:
+    """Pseudo-fichero para ``csv.writer``: devuelve la línea en lugar de guardarla"""
+
+    def write(self, valor):
+        return valor
+
+
+def _valor_csv(valor):
+    if isinstance(valor, (date, datetime, time)):
+        return valor.isoformat()
+    return valor
+
+
+def lineas_csv(campos, datos):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(campos)
+    for valores in datos:
+        yield escritor.writerow([_valor_csv(valor) for valor in valores])
+
+
+def lineas_jsonl(campos, datos):
+    codificador = DjangoJSONEncoder(ensure_ascii=False)
+    for valores in datos:
+        yield codificador.encode(dict(zip(campos, valores))) + '\n'
+
+
+LINEAS_TEXTO = {
+    'csv': lineas_csv,
+    'jsonl': lineas_jsonl,
+}
+
+
+def bloques(lineas):
+    """Agrupa las líneas en bloques de bytes para no enviar una escritura por fila"""
+    bloque = []
+    for linea in lineas:
+        bloque.append(linea)
+        if len(bloque) >= FILAS_POR_BLOQUE:
+            yield ''.join(bloque).encode('utf-8')
+            bloque = []
+    if bloque:
+        yield ''.join(bloque).encode('utf-8')
+
+
+def bloques_exportacion(exportacion, params, formato):
+    """Bloques de bytes con las filas en bruto de ``exportacion`` en CSV o JSONL"""
+    return bloques(LINEAS_TEXTO[formato](exportacion.campos_datos, exportacion.datos(params)))
+
+
+def escribir_texto(destino, exportacion, datos, formato):
+    """Escribe en el fichero binario ``destino`` las filas ``datos`` en CSV o JSONL"""
+    for bloque in bloques(LINEAS_TEXTO[formato](exportacion.campos_datos, datos)):
+        destino.write(bloque)
+
+
+def respuesta_texto(request, nombre, formato, contenido):
+    """Respuesta en streaming con los bloques de ``contenido`` en CSV o JSONL"""
+    comprimir = re_acepta_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if comprimir:
+        contenido = compress_sequence(contenido)
+
+    response = StreamingHttpResponse(contenido, content_type=CONTENT_TYPES_TEXTO[formato])
+    response['Content-Disposition'] = f'attachment; filename="{nombre_fichero(nombre, formato)}"'
+    if comprimir:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1 @@
+# Este archivo permite que el directorio commands sea un paquete de Python 
\ No newline at end of file
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from reportes.sincronizacion import SINCRONIZABLES, leer_cursor, lineas_cambios, siguiente_cursor
+
+
+class Command(BaseCommand):
+    help = 'Exporta en JSON Lines los pagos o gastos creados, modificados o borrados desde un cursor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=sorted(SINCRONIZABLES))
+        parser.add_argument('--desde', default='',
+                            help='Cursor devuelto por la exportación anterior (sin cursor se exporta todo)')
+        parser.add_argument('--salida', help='Fichero de salida (por defecto, la salida estándar)')
+
+    def handle(self, *args, **options):
+        try:
+            desde = leer_cursor(options['desde'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        hasta = siguiente_cursor(desde)
+
+        lineas = lineas_cambios(options['tipo'], desde, hasta)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as salida:
+                salida.writelines(lineas)
+        else:
+            for linea in lineas:
+                self.stdout.write(linea, ending='')
+        # El cursor va a stderr para no mezclarlo con los datos
+        self.stderr.write(f'Siguiente cursor: {hasta.isoformat()}')
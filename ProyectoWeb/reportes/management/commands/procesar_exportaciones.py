@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from reportes.trabajos import procesar, purgar_caducadas, tomar_siguiente
+
+# Segundos entre dos purgas de exportaciones caducadas
+INTERVALO_PURGA = 3600
+
+
+class Command(BaseCommand):
+    help = 'Procesa la cola de exportaciones en segundo plano (ExportJob)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesar los trabajos pendientes y terminar')
+        parser.add_argument('--intervalo', type=float, default=2,
+                            help='Segundos de espera cuando la cola está vacía (por defecto 2)')
+
+    def handle(self, *args, **options):
+        ultima_purga = 0
+        try:
+            while True:
+                close_old_connections()
+                if time.monotonic() - ultima_purga > INTERVALO_PURGA:
+                    borradas = purgar_caducadas()
+                    ultima_purga = time.monotonic()
+                    if borradas:
+                        self.stdout.write(f'🗑️  {borradas} exportaciones caducadas eliminadas')
+
+                job = tomar_siguiente()
+                if job is None:
+                    if options['una_vez']:
+                        break
+                    time.sleep(options['intervalo'])
+                    continue
+
+                self.stdout.write(f'Generando {job}...')
+                procesar(job)
+                if job.estado == 'completado':
+                    self.stdout.write(self.style.SUCCESS(f'✅ {job.archivo.name} ({job.filas_procesadas} filas)'))
+                elif job.estado in ('pendiente', 'en_proceso'):
+                    self.stdout.write(self.style.WARNING(f'⚠️  Exportación {job.pk}: la ha retomado otro proceso'))
+                else:
+                    self.stdout.write(self.style.ERROR(f'❌ Exportación {job.pk}: {job.error}'))
+        except KeyboardInterrupt:
+            self.stdout.write('Detenido')
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(help_text='Nombre de la exportación (alumnos, pagos...)', max_length=20)),
+                ('formato', models.CharField(choices=[('xlsx', 'Excel'), ('csv', 'CSV'), ('jsonl', 'JSON Lines')], default='xlsx', max_length=5)),
+                ('parametros', models.JSONField(blank=True, default=dict, help_text='Filtros GET de la exportación')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completado', 'Completado'), ('error', 'Error')], default='pendiente', max_length=10)),
+                ('filas_procesadas', models.PositiveIntegerField(default=0)),
+                ('filas_totales', models.PositiveIntegerField(default=0)),
+                ('archivo', models.FileField(blank=True, upload_to='exportaciones/%Y/%m/')),
+                ('error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='exportaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Exportación',
+                'verbose_name_plural': 'Exportaciones',
+                'indexes': [models.Index(fields=['estado', 'fecha_creacion'], name='exportjob_cola_idx'), models.Index(fields=['usuario', '-fecha_creacion'], name='exportjob_usuario_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Eliminacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(help_text='Modelo del objeto borrado (gestion.pago, gestion.gasto)', max_length=50)),
+                ('objeto_id', models.PositiveBigIntegerField()),
+                ('descripcion', models.CharField(blank=True, max_length=200)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Eliminación',
+                'verbose_name_plural': 'Eliminaciones',
+                'indexes': [models.Index(fields=['modelo', 'fecha', 'id'], name='eliminacion_modelo_fecha_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,70 @@
 from django.db import models
+from django.contrib.auth.models import User
+from django.utils import timezone
 
-# Create your models here.
+
+class ExportJob(models.Model):
+    """Exportación encolada que genera en segundo plano ``procesar_exportaciones``"""
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En proceso'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
+    FORMATOS = [
+        ('xlsx', 'Excel'),
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    ]
+
+    tipo = models.CharField(max_length=20, help_text="Nombre de la exportación (alumnos, pagos...)")
+    formato = models.CharField(max_length=5, choices=FORMATOS, default='xlsx')
+    parametros = models.JSONField(default=dict, blank=True, help_text="Filtros GET de la exportación")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='exportaciones')
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='pendiente')
+    filas_procesadas = models.PositiveIntegerField(default=0)
+    filas_totales = models.PositiveIntegerField(default=0)
+    archivo = models.FileField(upload_to='exportaciones/%Y/%m/', blank=True)
+    error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    # Última señal de vida del proceso que lo genera (reportes.trabajos)
+    fecha_latido = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Exportación'
+        verbose_name_plural = 'Exportaciones'
+        indexes = [
+            models.Index(fields=['estado', 'fecha_creacion'], name='exportjob_cola_idx'),
+            models.Index(fields=['usuario', '-fecha_creacion'], name='exportjob_usuario_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo}.{self.formato} ({self.get_estado_display()})"
+
+    @property
+    def porcentaje(self):
+        if self.estado == 'completado':
+            return 100
+        if not self.filas_totales:
+            return 0
+        return min(round(self.filas_procesadas * 100 / self.filas_totales), 100)
+
+
+class Eliminacion(models.Model):
+    """Registro de un pago o gasto borrado para la exportación incremental"""
+    modelo = models.CharField(max_length=50, help_text="Modelo del objeto borrado (gestion.pago, gestion.gasto)")
+    objeto_id = models.PositiveBigIntegerField()
+    descripcion = models.CharField(max_length=200, blank=True)
+    fecha = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Eliminación'
+        verbose_name_plural = 'Eliminaciones'
+        indexes = [
+            models.Index(fields=['modelo', 'fecha', 'id'], name='eliminacion_modelo_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.modelo} {self.objeto_id} ({self.fecha:%d/%m/%Y %H:%M})"
@@ -0,0 +1,93 @@
+"""Señales de reportes: versión de los datos de las exportaciones cacheadas,
+periodos cerrados del balance y borrados para la exportación incremental."""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from gestion.models import Gasto, Pago, Profesor
+from gestion.signals import pagos_creados_en_bloque
+
+from .balance import SERIES, invalidar_periodos
+from .cache_exportaciones import incrementar_version
+from .exportaciones import EXPORTACIONES
+from .sincronizacion import registrar_eliminacion
+
+MODELOS_EXPORTADOS = {modelo for exportacion in EXPORTACIONES.values() for modelo in exportacion.modelos}
+
+# Campos del usuario que salen en las exportaciones (el nombre del profesor)
+CAMPOS_USUARIO_EXPORTADOS = ('first_name', 'last_name', 'username')
+
+# Serie del balance de cada modelo y su campo de fecha
+SERIES_POR_MODELO = {modelo: (nombre, campo_fecha) for nombre, (modelo, campo_fecha, _, _) in SERIES.items()}
+
+
+def datos_modificados(sender, raw=False, **kwargs):
+    if not raw:
+        incrementar_version(sender)
+
+
+for modelo in MODELOS_EXPORTADOS:
+    post_save.connect(datos_modificados, sender=modelo, dispatch_uid=f'reportes_version_{modelo._meta.label_lower}_save')
+    post_delete.connect(datos_modificados, sender=modelo, dispatch_uid=f'reportes_version_{modelo._meta.label_lower}_delete')
+
+pagos_creados_en_bloque.connect(datos_modificados, sender=Pago, dispatch_uid='reportes_version_gestion.pago_bloque')
+
+
+@receiver(pre_save, sender=User)
+def recordar_nombre_usuario(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Guarda los campos exportados previos del usuario para ver si cambian.
+
+    Cada inicio de sesión guarda el usuario (``last_login``): solo los cambios
+    en el nombre deben invalidar las exportaciones, y a través de ``Profesor``.
+    """
+    instance._nombre_exportado_anterior = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(CAMPOS_USUARIO_EXPORTADOS):
+        return
+    instance._nombre_exportado_anterior = (
+        sender.objects.filter(pk=instance.pk).values_list(*CAMPOS_USUARIO_EXPORTADOS).first()
+    )
+
+
+@receiver(post_save, sender=User)
+def usuario_modificado(sender, instance, raw=False, **kwargs):
+    anterior = getattr(instance, '_nombre_exportado_anterior', None)
+    if raw or anterior is None:
+        return
+    actual = tuple(getattr(instance, campo) for campo in CAMPOS_USUARIO_EXPORTADOS)
+    if actual != anterior and Profesor.objects.filter(user=instance).exists():
+        incrementar_version(Profesor)
+
+
+@receiver(pre_save, sender=Pago)
+@receiver(pre_save, sender=Gasto)
+def recordar_fecha_balance(sender, instance, raw=False, **kwargs):
+    """Guarda la fecha previa por si el importe pasa a otro periodo"""
+    instance._fecha_balance_anterior = None
+    if raw or instance.pk is None:
+        return
+    campo_fecha = SERIES_POR_MODELO[sender][1]
+    instance._fecha_balance_anterior = sender.objects.filter(pk=instance.pk).values_list(campo_fecha, flat=True).first()
+
+
+@receiver(post_save, sender=Pago)
+@receiver(post_delete, sender=Pago)
+@receiver(post_save, sender=Gasto)
+@receiver(post_delete, sender=Gasto)
+def balance_modificado(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    nombre, campo_fecha = SERIES_POR_MODELO[sender]
+    invalidar_periodos(nombre, getattr(instance, campo_fecha), getattr(instance, '_fecha_balance_anterior', None))
+
+
+@receiver(pagos_creados_en_bloque, sender=Pago)
+def pagos_facturados(sender, pagos, **kwargs):
+    invalidar_periodos(SERIES_POR_MODELO[sender][0], *{pago.fecha for pago in pagos})
+
+
+@receiver(post_delete, sender=Pago)
+@receiver(post_delete, sender=Gasto)
+def registrar_borrado(sender, instance, **kwargs):
+    registrar_eliminacion(instance)
@@ -1,3 +1,307 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from gestion.facturacion import facturar_mes
+from gestion.models import Alumno, Gasto, Pago, Profesor, Tarifa
+
+from . import trabajos
+from .balance import serie
+from .documentos import bloques_zip, documentos
+from .models import Eliminacion, ExportJob
+from .sincronizacion import MARGEN
+
+
+class MediaTemporalMixin:
+    """Los ficheros generados van a un MEDIA_ROOT temporal"""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+
+class ColaExportacionesTests(MediaTemporalMixin, TestCase):
+    def _caducar(self, job):
+        hace_mucho = timezone.now() - trabajos.TIEMPO_MAXIMO - timedelta(minutes=1)
+        ExportJob.objects.filter(pk=job.pk).update(fecha_latido=hace_mucho)
+
+    def test_latido_reciente_no_se_reclama(self):
+        trabajos.encolar('pagos', 'csv', {})
+        job = trabajos.tomar_siguiente()
+        ExportJob.objects.filter(pk=job.pk).update(fecha_inicio=timezone.now() - timedelta(days=1))
+        self.assertEqual(trabajos.reclamar_caducados(), 0)
+        self._caducar(job)
+        self.assertEqual(trabajos.reclamar_caducados(), 1)
+
+    def test_reclamado_y_terminado_por_otro_proceso(self):
+        trabajos.encolar('pagos', 'csv', {})
+        lento = trabajos.tomar_siguiente()
+        nuevo = {}
+        escribir_texto = trabajos.escribir_texto
+
+        def escribir_y_perder_el_trabajo(*args, **kwargs):
+            escribir_texto(*args, **kwargs)
+            if 'job' not in nuevo:
+                # Mientras el proceso lento escribe, otro retoma el trabajo y lo termina
+                self._caducar(lento)
+                nuevo['job'] = trabajos.tomar_siguiente()
+                trabajos.procesar(nuevo['job'])
+
+        with mock.patch.object(trabajos, 'escribir_texto', escribir_y_perder_el_trabajo), \
+                self.assertLogs('reportes.trabajos', 'WARNING'):
+            resultado = trabajos.procesar(lento)
+
+        job = ExportJob.objects.get(pk=lento.pk)
+        self.assertEqual(job.estado, 'completado')
+        self.assertEqual(job.archivo.name, nuevo['job'].archivo.name)
+        self.assertEqual(job.fecha_inicio, nuevo['job'].fecha_inicio)
+        self.assertTrue(job.archivo.storage.exists(job.archivo.name))
+        # El fichero del proceso lento se descarta y no pisa al bueno
+        self.assertEqual(resultado.archivo.name, job.archivo.name)
+        self.assertEqual(len(job.archivo.storage.listdir(job.archivo.name.rsplit('/', 1)[0])[1]), 1)
+
+    def test_latido_de_trabajo_retomado_lo_detiene(self):
+        trabajos.encolar('pagos', 'csv', {})
+        lento = trabajos.tomar_siguiente()
+        self._caducar(lento)
+        trabajos.reclamar_caducados()
+        retomado = trabajos.tomar_siguiente()
+        with self.assertLogs('reportes.trabajos', 'WARNING'):
+            resultado = trabajos.procesar(lento)
+        self.assertEqual(resultado.estado, 'en_proceso')
+        self.assertEqual(resultado.fecha_inicio, retomado.fecha_inicio)
+        self.assertFalse(resultado.archivo)
+
+
+class CacheExportacionesTests(TestCase):
+    """ETag de las exportaciones y cambios de datos que lo invalidan"""
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('profe', password='x', first_name='Luis')
+        self.profesor = Profesor.objects.create(user=self.usuario)
+        self.alumno = Alumno.objects.create(nombre='Ana', apellido='García',
+                                            tarifa_predeterminada=Tarifa.objects.create(nombre='Mensual', precio=50))
+        # Un pago de hace dos meses: el alumno queda pendiente de facturar este mes
+        pago = Pago.objects.create(alumno=self.alumno, profesor=self.profesor, importe_original=10)
+        Pago.objects.filter(pk=pago.pk).update(fecha=timezone.localdate() - timedelta(days=62))
+        Alumno.objects.filter(pk=self.alumno.pk).update(ultimo_periodo_pagado=None)
+        self.client.force_login(self.usuario)
+        self.url = reverse('reportes:exportar_datos', args=['pagos', 'csv'])
+
+    def _etag(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        b''.join(respuesta.streaming_content)
+        return respuesta['ETag']
+
+    def test_if_none_match_devuelve_304(self):
+        etag = self._etag()
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+
+    def test_guardar_un_pago_cambia_el_etag(self):
+        etag = self._etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            Pago.objects.create(alumno=self.alumno, importe_original=20)
+        self.assertNotEqual(self._etag(), etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pagos_creados_en_bloque_cambian_el_etag(self):
+        etag = self._etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(len(facturar_mes(timezone.localdate())), 1)
+        self.assertNotEqual(self._etag(), etag)
+
+    def test_iniciar_sesion_no_cambia_el_etag(self):
+        etag = self._etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            # login() guarda last_login con update_fields
+            self.client.force_login(self.usuario)
+            self.usuario.email = 'luis@example.com'
+            self.usuario.save()
+        self.assertEqual(self._etag(), etag)
+
+    def test_cambiar_el_nombre_del_profesor_cambia_el_etag(self):
+        etag = self._etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.usuario.last_name = 'Pérez'
+            self.usuario.save()
+        self.assertNotEqual(self._etag(), etag)
+
+    def test_cambiar_el_nombre_de_otro_usuario_no_cambia_el_etag(self):
+        otro = User.objects.create_user('otro', password='x')
+        etag = self._etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            otro.first_name = 'Otro'
+            otro.save()
+        self.assertEqual(self._etag(), etag)
+
+
+class BalanceCacheTests(TestCase):
+    """Periodos cerrados del balance en caché y su invalidación"""
+
+    HOY = date(2025, 6, 15)
+    DESDE = date(2025, 1, 1)
+    HASTA = date(2025, 3, 31)
+
+    def setUp(self):
+        cache.clear()
+        self.tarifa = Tarifa.objects.create(nombre='Mensual', precio=50)
+        alumno = Alumno.objects.create(nombre='Ana', apellido='García')
+        self.pago = Pago.objects.create(alumno=alumno, tarifa=self.tarifa, importe_original=50)
+        Pago.objects.filter(pk=self.pago.pk).update(fecha=date(2025, 2, 10))
+        self.pago.refresh_from_db()
+        self.gasto = Gasto.objects.create(concepto='Luz', importe=30, categoria='suministros',
+                                          fecha_gasto=date(2025, 2, 20))
+
+    def _serie(self, nombre):
+        return {inicio.month: totales for inicio, totales in serie(nombre, self.DESDE, self.HASTA, 'mes', self.HOY)}
+
+    def test_periodos_cerrados_salen_de_la_cache(self):
+        self.assertEqual(self._serie('ingresos')[2], {self.tarifa.pk: Decimal('50')})
+        with self.assertNumQueries(0):
+            self.assertEqual(self._serie('ingresos')[2], {self.tarifa.pk: Decimal('50')})
+
+    def test_gasto_que_cambia_de_periodo(self):
+        self.assertEqual(self._serie('gastos'), {1: {}, 2: {'suministros': Decimal('30')}, 3: {}})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gasto.fecha_gasto = date(2025, 3, 5)
+            self.gasto.save()
+        self.assertEqual(self._serie('gastos'), {1: {}, 2: {}, 3: {'suministros': Decimal('30')}})
+
+    def test_pago_que_cambia_de_periodo(self):
+        self.assertEqual(self._serie('ingresos'), {1: {}, 2: {self.tarifa.pk: Decimal('50')}, 3: {}})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pago.fecha = date(2025, 1, 31)
+            self.pago.save()
+        self.assertEqual(self._serie('ingresos'), {1: {self.tarifa.pk: Decimal('50')}, 2: {}, 3: {}})
+
+    def test_borrar_un_gasto(self):
+        self._serie('gastos')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gasto.delete()
+        self.assertEqual(self._serie('gastos'), {1: {}, 2: {}, 3: {}})
+
+
+class DocumentosZipTests(MediaTemporalMixin, TestCase):
+    """ZIP de documentos compuesto mientras se envía"""
+
+    def setUp(self):
+        super().setUp()
+        alumno = Alumno.objects.create(nombre='Ana', apellido='García')
+        self.pago = Pago.objects.create(alumno=alumno, importe_original=50)
+        # Más de un bloque de lectura y comprimible
+        self.pdf = b'%PDF-1.4 ' + bytes(range(256)) * 1000
+        self.pago.comprobante.save('recibo.pdf', ContentFile(self.pdf))
+        self.gasto = Gasto.objects.create(concepto='Luz', importe=30, fecha_gasto=timezone.localdate())
+        self.gasto.factura.save('factura.pdf', ContentFile(b'%PDF factura'))
+        self.hoy = timezone.localdate()
+
+    def _zip(self):
+        bloques = list(bloques_zip(documentos(self.hoy, self.hoy)))
+        return zipfile.ZipFile(io.BytesIO(b''.join(bloques))), bloques
+
+    def test_zip_valido(self):
+        archivo, bloques = self._zip()
+        self.assertGreater(len(bloques), 2)
+        self.assertIsNone(archivo.testzip())
+        self.assertEqual(archivo.namelist(), [self.pago.comprobante.name, self.gasto.factura.name])
+        self.assertEqual(archivo.read(self.pago.comprobante.name), self.pdf)
+        self.assertEqual(archivo.getinfo(self.pago.comprobante.name).compress_type, zipfile.ZIP_STORED)
+
+    def test_ficheros_que_faltan(self):
+        nombre = self.gasto.factura.name
+        self.gasto.factura.storage.delete(nombre)
+        archivo, _ = self._zip()
+        self.assertEqual(archivo.namelist(), [self.pago.comprobante.name, 'faltan.txt'])
+        self.assertEqual(archivo.read('faltan.txt').decode(), f'{nombre}\n')
+
+    def test_vista(self):
+        self.client.force_login(User.objects.create_user('contable', password='x'))
+        respuesta = self.client.get(reverse('reportes:descargar_documentos'))
+        self.assertEqual(respuesta['Content-Type'], 'application/zip')
+        archivo = zipfile.ZipFile(io.BytesIO(b''.join(respuesta.streaming_content)))
+        self.assertEqual(len(archivo.namelist()), 2)
+        self.assertEqual(self.client.get(reverse('reportes:descargar_documentos'), {'desde': 'ayer'}).status_code, 400)
+
+
+class SincronizacionTests(TestCase):
+    """Cursor de la exportación incremental con un reloj que avanza a mano"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('contable', password='x'))
+        self.alumno = Alumno.objects.create(nombre='Ana', apellido='García')
+        self.url = reverse('reportes:sincronizar', args=['pagos'])
+        reloj = timezone.now
+        self.desfase = timedelta(0)
+        parche = mock.patch('django.utils.timezone.now', lambda: reloj() + self.desfase)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def _sincronizar(self, desde):
+        respuesta = self.client.get(self.url, {'desde': desde})
+        self.assertEqual(respuesta.status_code, 200)
+        lineas = [json.loads(linea) for linea in b''.join(respuesta.streaming_content).decode().splitlines()]
+        self.assertEqual(lineas[-1], {'operacion': 'cursor', 'cursor': respuesta['X-Cursor']})
+        return lineas[:-1], respuesta['X-Cursor']
+
+    def test_cada_cambio_sale_una_sola_vez(self):
+        cursor = (timezone.now() - timedelta(seconds=1)).isoformat()
+        pago = Pago.objects.create(alumno=self.alumno, importe_original=10)
+        borrado = Pago.objects.create(alumno=self.alumno, importe_original=20)
+        id_borrado, numero_borrado = borrado.pk, borrado.numero
+        borrado.delete()
+
+        # Aún dentro del margen: nada y el cursor no avanza
+        lineas, siguiente = self._sincronizar(cursor)
+        self.assertEqual(lineas, [])
+        self.assertEqual(siguiente, cursor)
+
+        self.desfase = MARGEN + timedelta(seconds=1)
+        lineas, cursor = self._sincronizar(cursor)
+        self.assertEqual([(l['operacion'], l['id']) for l in lineas],
+                         [('cambio', pago.pk), ('borrado', id_borrado)])
+        self.assertEqual(lineas[1]['descripcion'], numero_borrado)
+        self.assertEqual(Eliminacion.objects.filter(modelo='gestion.pago', objeto_id=id_borrado).count(), 1)
+
+        # Un cambio posterior sale en la llamada que lo deja fuera del margen, y solo en esa
+        pago.concepto = 'Corregido'
+        pago.save()
+        self.desfase = MARGEN + timedelta(seconds=2)
+        lineas, cursor = self._sincronizar(cursor)
+        self.assertEqual(lineas, [])
+        self.desfase = 2 * MARGEN + timedelta(seconds=2)
+        lineas, cursor = self._sincronizar(cursor)
+        self.assertEqual([(l['operacion'], l['id']) for l in lineas], [('cambio', pago.pk)])
+        self.assertEqual(lineas[0]['concepto'], 'Corregido')
+        self.desfase = 3 * MARGEN
+        lineas, cursor = self._sincronizar(cursor)
+        self.assertEqual(lineas, [])
+
+    def test_sin_cursor_devuelve_todo(self):
+        pagos = [Pago.objects.create(alumno=self.alumno, importe_original=10) for _ in range(3)]
+        self.desfase = MARGEN + timedelta(seconds=1)
+        lineas, _ = self._sincronizar('')
+        self.assertEqual([l['id'] for l in lineas], [pago.pk for pago in pagos])
+
+    def test_cursor_no_valido(self):
+        respuesta = self.client.get(self.url, {'desde': 'ayer'})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('error', respuesta.json())
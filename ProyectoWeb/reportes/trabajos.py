@@ -0,0 +1,219 @@
+"""Cola de exportaciones en segundo plano.
+
+La cola es la propia tabla ``ExportJob``: las vistas crean trabajos
+pendientes y el comando ``procesar_exportaciones`` los toma de uno en uno,
+genera el fichero en ``MEDIA_ROOT`` y va guardando el progreso.
+
+Cada vez que guarda el progreso, el proceso deja también un latido
+(``fecha_latido``). Un trabajo en proceso sin latidos desde hace más de
+``EXPORTACIONES_TIEMPO_MAXIMO_SEGUNDOS`` es de un proceso que murió a medias
+y vuelve a la cola. El ``fecha_inicio`` que fija :func:`tomar_siguiente`
+identifica al proceso dueño del trabajo: los latidos y el resultado final
+solo se guardan si el trabajo sigue siendo suyo, así que un proceso lento al
+que se le ha retomado el trabajo no pisa el resultado del nuevo dueño.
+"""
+import logging
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cierre_anual import HOJAS_CIERRE, escribir_cierre_anual, parametros_hoja
+from .exportaciones import EXPORTACIONES, LIBROS_XLSX
+from .formatos import escribir_texto, escribir_xlsx, nombre_fichero
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+# Días que se conservan los ficheros generados
+RETENCION_DIAS = getattr(settings, 'EXPORTACIONES_RETENCION_DIAS', 7)
+# Tras este tiempo sin latidos se da por muerto el proceso que lo tomó
+TIEMPO_MAXIMO = timedelta(seconds=getattr(settings, 'EXPORTACIONES_TIEMPO_MAXIMO_SEGUNDOS', 3600))
+# Filas procesadas entre dos actualizaciones del progreso
+INTERVALO_PROGRESO = 1000
+# Libro de cierre anual (reportes.cierre_anual), con el año en ``parametros['anio']``
+CIERRE_ANUAL = 'cierre_anual'
+
+
+def encolar(tipo, formato, params, usuario=None):
+    """Crea un trabajo pendiente para la exportación ``tipo`` en ``formato``"""
+    if tipo == CIERRE_ANUAL:
+        if formato != 'xlsx' or not str(params.get('anio', '')).isdigit():
+            raise ValueError('El cierre anual necesita un año y solo se genera en Excel')
+    elif tipo not in EXPORTACIONES or formato not in dict(ExportJob.FORMATOS):
+        raise ValueError(f'Exportación no disponible: {tipo}.{formato}')
+    return ExportJob.objects.create(tipo=tipo, formato=formato, parametros=dict(params), usuario=usuario)
+
+
+class TrabajoRetomado(Exception):
+    """El trabajo se ha devuelto a la cola y ya es de otro proceso"""
+
+
+def reclamar_caducados(ahora=None):
+    """Devuelve a la cola los trabajos en proceso sin latidos desde hace más de ``TIEMPO_MAXIMO``"""
+    limite = (ahora or timezone.now()) - TIEMPO_MAXIMO
+    return (ExportJob.objects
+            .filter(estado='en_proceso')
+            .filter(Q(fecha_latido__lt=limite) | Q(fecha_latido__isnull=True, fecha_inicio__lt=limite))
+            .update(estado='pendiente', filas_procesadas=0))
+
+
+def _del_proceso(job):
+    """El trabajo si aún es del proceso que lo tomó en ``job.fecha_inicio``"""
+    return ExportJob.objects.filter(pk=job.pk, estado='en_proceso', fecha_inicio=job.fecha_inicio)
+
+
+def latido(job, **campos):
+    """Guarda ``campos`` en el trabajo junto con un latido.
+
+    Lanza :class:`TrabajoRetomado` si el trabajo ya no es de este proceso.
+    """
+    if not _del_proceso(job).update(fecha_latido=timezone.now(), **campos):
+        raise TrabajoRetomado(f'La exportación {job.pk} la ha retomado otro proceso')
+
+
+def tomar_siguiente():
+    """Marca como en proceso el trabajo pendiente más antiguo y lo devuelve.
+
+    ``skip_locked`` permite varios procesos trabajando sobre la misma cola
+    sin que dos tomen el mismo trabajo. Antes recupera los trabajos caducados.
+    """
+    reclamar_caducados()
+    with transaction.atomic():
+        job = (ExportJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(estado='pendiente')
+               .order_by('fecha_creacion', 'id')
+               .first())
+        if job is None:
+            return None
+        job.estado = 'en_proceso'
+        job.fecha_inicio = job.fecha_latido = timezone.now()
+        job.save(update_fields=['estado', 'fecha_inicio', 'fecha_latido'])
+    return job
+
+
+class _Progreso:
+    """Cuenta las filas generadas y las guarda en el trabajo cada ``INTERVALO_PROGRESO``"""
+
+    def __init__(self, job):
+        self.job = job
+        self.filas = 0
+
+    def contar(self, filas):
+        for fila in filas:
+            yield fila
+            self.filas += 1
+            if self.filas % INTERVALO_PROGRESO == 0:
+                self.guardar()
+
+    def guardar(self):
+        latido(self.job, filas_procesadas=self.filas)
+
+
+def _guardar_filas_totales(job, partes):
+    """Guarda en ``job`` las filas que contará el progreso de ``partes``.
+
+    ``partes`` son pares ``(exportacion, params)``. En Excel cuentan las filas
+    de las hojas (en la disposición pivote, una por alumno y horario); en
+    CSV/JSONL, una por fila de la consulta.
+    """
+    if job.formato == 'xlsx':
+        job.filas_totales = sum(exportacion.contar_filas(params) for exportacion, params in partes)
+    else:
+        job.filas_totales = sum(exportacion.filtrar(params).count() for exportacion, params in partes)
+    job.filas_procesadas = 0
+    latido(job, filas_totales=job.filas_totales, filas_procesadas=0)
+
+
+def _generar_exportacion(job, fichero):
+    """Escribe en ``fichero`` la exportación de ``job`` y devuelve el nombre de descarga"""
+    params = job.parametros
+    if job.formato == 'xlsx':
+        exportaciones = [EXPORTACIONES[hoja] for hoja in LIBROS_XLSX[job.tipo]]
+    else:
+        exportaciones = [EXPORTACIONES[job.tipo]]
+
+    _guardar_filas_totales(job, [(exportacion, params) for exportacion in exportaciones])
+
+    progreso = _Progreso(job)
+    if job.formato == 'xlsx':
+        escribir_xlsx(fichero, (
+            (hoja, progreso.contar(filas)) for exportacion in exportaciones for hoja, filas in exportacion.hojas(params)
+        ))
+    else:
+        exportacion = exportaciones[0]
+        escribir_texto(fichero, exportacion, progreso.contar(exportacion.datos(params)), job.formato)
+    job.filas_procesadas = progreso.filas
+    return nombre_fichero(job.tipo, job.formato)
+
+
+def _generar_cierre_anual(job, fichero):
+    """Escribe en ``fichero`` el libro de cierre anual; el progreso avanza por hojas"""
+    anio = int(job.parametros['anio'])
+    _guardar_filas_totales(job, [(EXPORTACIONES[nombre], parametros_hoja(nombre, anio)) for nombre in HOJAS_CIERRE])
+
+    def hoja_terminada(nombre, filas):
+        job.filas_procesadas += filas
+        latido(job, filas_procesadas=job.filas_procesadas)
+
+    escribir_cierre_anual(fichero, anio, al_terminar_hoja=hoja_terminada)
+    return nombre_fichero(f'cierre_{anio}', 'xlsx')
+
+
+def procesar(job):
+    """Genera el fichero de ``job`` y lo deja completado (o con el error).
+
+    Si mientras tanto el trabajo ha vuelto a la cola, se descarta el fichero
+    y se devuelve ``job`` con el estado actual, sin tocarlo.
+    """
+    generar = _generar_cierre_anual if job.tipo == CIERRE_ANUAL else _generar_exportacion
+    try:
+        with tempfile.TemporaryFile() as fichero:
+            nombre = generar(job, fichero)
+            fichero.seek(0)
+            job.archivo.save(nombre, File(fichero), save=False)
+    except TrabajoRetomado:
+        logger.warning('La exportación %s la ha retomado otro proceso', job.pk)
+        job.refresh_from_db()
+        return job
+    except Exception as e:
+        logger.exception('Error generando la exportación %s', job.pk)
+        job.estado = 'error'
+        job.error = str(e)
+    else:
+        job.estado = 'completado'
+    job.fecha_fin = timezone.now()
+    terminado = _del_proceso(job).update(
+        estado=job.estado, error=job.error, archivo=job.archivo.name or '',
+        filas_procesadas=job.filas_procesadas, fecha_fin=job.fecha_fin,
+    )
+    if not terminado:
+        logger.warning('La exportación %s la ha retomado otro proceso', job.pk)
+        if job.archivo:
+            job.archivo.delete(save=False)
+        job.refresh_from_db()
+    return job
+
+
+def purgar_caducadas(ahora=None):
+    """Borra los trabajos terminados hace más de ``RETENCION_DIAS`` y sus ficheros"""
+    limite = (ahora or timezone.now()) - timedelta(days=RETENCION_DIAS)
+    caducadas = ExportJob.objects.filter(estado__in=['completado', 'error'], fecha_fin__lt=limite)
+    total = 0
+    for job in caducadas.iterator():
+        if job.archivo:
+            job.archivo.delete(save=False)
+        job.delete()
+        total += 1
+    return total
+
+
+def recientes(usuario):
+    """Trabajos del usuario que aún están dentro del periodo de retención"""
+    limite = timezone.now() - timedelta(days=RETENCION_DIAS)
+    return ExportJob.objects.filter(usuario=usuario, fecha_creacion__gte=limite).order_by('-fecha_creacion')
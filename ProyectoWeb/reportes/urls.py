@@ -5,8 +5,16 @@ app_name = 'reportes'
 
 urlpatterns = [
     path('', views.reportes, name='reportes'),
+    path('balance/', views.balance, name='balance'),
+    path('balance/datos/', views.balance_datos, name='balance_datos'),
     path('exportar-alumnos/', views.exportar_alumnos_excel, name='exportar_alumnos'),
     path('exportar-pagos/', views.exportar_pagos_excel, name='exportar_pagos'),
     path('exportar-asistencias/', views.exportar_asistencias_excel, name='exportar_asistencias'),
     path('exportar-gastos/', views.exportar_gastos_excel, name='exportar_gastos'),
+    path('exportar/<str:tipo>.<str:formato>', views.exportar_datos, name='exportar_datos'),
+    path('documentos.zip', views.descargar_documentos, name='descargar_documentos'),
+    path('sincronizacion/<str:tipo>.jsonl', views.sincronizar, name='sincronizar'),
+    path('exportaciones/encolar/<str:tipo>.<str:formato>', views.encolar_exportacion, name='encolar_exportacion'),
+    path('exportaciones/estado/', views.estado_exportaciones, name='estado_exportaciones'),
+    path('exportaciones/<int:job_id>/descargar/', views.descargar_exportacion, name='descargar_exportacion'),
 ] 
\ No newline at end of file